@@ -140,6 +140,12 @@ class SportAtDate2(TestDateModel):
         ordering = '-dt'
 
 
+class SportAtDate3(TestDateModel):
+
+    class Meta:
+        sort_indexes = ('dt',)
+
+
 class Group(odm.StdModel):
     name = odm.SymbolField()
     description = odm.CharField()
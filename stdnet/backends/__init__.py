@@ -3,18 +3,24 @@ from collections import namedtuple
 from inspect import isgenerator
 
 try:
-    from pulsar import maybe_async as async
+    from pulsar import maybe_async as async, multi_async, async_sleep
 except ImportError:     # pragma    noproxy
 
     def async(gen):
         raise NotImplementedError
 
+    def multi_async(iterable):
+        raise NotImplementedError
+
+    def async_sleep(timeout):
+        raise NotImplementedError
+
 
 from stdnet.utils.exceptions import *
 from stdnet.utils import raise_error_trace
 from stdnet.utils.importer import import_module
 from stdnet.utils import (iteritems, int_or_float, to_string, urlencode,
-                          urlparse)
+                          urlparse, JSPLITTER)
 
 
 __all__ = ['BackendStructure',
@@ -23,11 +29,15 @@ __all__ = ['BackendStructure',
            'session_result',
            'session_data',
            'instance_session_result',
+           'change_record',
+           'index_error',
            'query_result',
            'range_lookups',
            'getdb',
            'settings',
-           'async']
+           'async',
+           'multi_async',
+           'async_sleep']
 
 
 query_result = namedtuple('query_result', 'key count')
@@ -37,8 +47,16 @@ query_result = namedtuple('query_result', 'key count')
 instance_session_result = namedtuple('instance_session_result',
                                      'iid persistent id deleted score')
 session_data = namedtuple('session_data',
-                          'meta dirty deletes queries structures')
+                          'meta dirty deletes queries structures bulk')
 session_result = namedtuple('session_result', 'meta results')
+# A change appended to the changelog of a backend. Seq is the position in the
+# changelog, model the model hash, id the instance id, action one of add,
+# update, override and delete and fields the changed attribute names.
+change_record = namedtuple('change_record', 'seq model id action fields')
+# An inconsistency found when building an index. Error is "missing" for an
+# instance not in the index, "stale" for an index entry not matching the
+# instance and "unique" for an instance violating a unique constraint.
+index_error = namedtuple('index_error', 'model field value id error')
 
 pass_through = lambda x: x
 str_lower_case = lambda x: to_string(x).lower()
@@ -144,6 +162,12 @@ class BackendDataServer(object):
         with this value, one obtain a :class:`BackendDataServer` connected to
         the same database as this instance.
 
+    .. attribute:: changelog
+
+        Maximum number of :class:`change_record` kept by the backend, set by
+        the ``changelog`` connection parameter. When ``0`` changes are not
+        recorded. Default ``0``.
+
     .. attribute:: client
 
         The client handler for the backend database.
@@ -163,6 +187,7 @@ class BackendDataServer(object):
     default_manager = None
     default_port = 8000
     struct_map = {}
+    changelog = 0
 
     def __init__(self, name=None, address=None, charset=None, namespace='',
                  **params):
@@ -180,9 +205,12 @@ class BackendDataServer(object):
             else:
                 address[1] = int(address[1])
         self.charset = charset or 'utf-8'
+        changelog = params.pop('changelog', None)
         self.params = params
         self.namespace = namespace
         self.client = self.setup_connection(address)
+        if changelog is not None:
+            self.changelog = self.params['changelog'] = int(changelog)
         self.connection_string = get_connection_string(
             self.name, address, self.params)
 
@@ -216,6 +244,11 @@ class BackendDataServer(object):
         postfix = ':'.join((str(p) for p in args if p is not None))
         return '%s:%s' % (key, postfix) if postfix else key
 
+    @property
+    def changelog_key(self):
+        '''The key of the changelog of this backend.'''
+        return '%schangelog' % self.namespace
+
     def disconnect(self):
         '''Disconnect the connection.'''
         pass
@@ -234,7 +267,30 @@ from database.
         make_object = meta.make_object
         related_data = []
         if related_fields:
-            for fname, fdata in iteritems(related_fields):
+            loaded = {}
+            # nested paths are linked to the objects of their parent path
+            for fname in sorted(related_fields,
+                                key=lambda n: n.count(JSPLITTER)):
+                fdata = related_fields[fname]
+                if JSPLITTER in fname:
+                    field = meta.related_path(fname)[-1]
+                    related = dict(((obj.id, obj) for obj in self.make_objects(
+                        field.relmodel._meta, fdata)))
+                    parent = fname.rsplit(JSPLITTER, 1)[0]
+                    for obj in loaded.get(parent, {}).values():
+                        rid = getattr(obj, field.attname, None)
+                        if rid is not None:
+                            setattr(obj, field.name, related.get(rid))
+                    loaded[fname] = related
+                    continue
+                if fname in meta.related:
+                    # related manager, a list of instances for each id
+                    manager = meta.related[fname]
+                    rmeta = manager.formodel._meta
+                    related = dict(((id, self.objects_from_db(rmeta, rdata))
+                                    for id, rdata in fdata))
+                    related_data.append((manager, related, None))
+                    continue
                 field = meta.dfields[fname]
                 if field in meta.multifields:
                     related = dict(fdata)
@@ -244,11 +300,14 @@ from database.
                     relmodel = field.relmodel
                     related = dict(((obj.id, obj) for obj in
                                     self.make_objects(relmodel._meta, fdata)))
+                    loaded[fname] = related
                 related_data.append((field, related, multi))
         for state in data:
             instance = make_object(state, self)
             for field, rdata, multi in related_data:
-                if multi:
+                if multi is None:
+                    field.set_cache(instance, rdata.get(str(instance.id), []))
+                elif multi:
                     field.set_cache(instance, rdata.get(str(instance.id)))
                 else:
                     rid = getattr(instance, field.attname, None)
@@ -260,6 +319,40 @@ from database.
     def objects_from_db(self, meta, data, related_fields=None):
         return list(self.make_objects(meta, data, related_fields))
 
+    def values_from_db(self, meta, data, values):
+        '''List of field values from database, without creating model
+instances. Check :meth:`stdnet.odm.Query.values`.
+
+:parameter meta: instance of model :class:`stdnet.odm.Metaclass`.
+:parameter data: iterator over instances data.
+:parameter values: two elements tuple with the field names and the kind of
+    values, one of ``dict``, ``tuple``, ``flat`` or ``raw`` for tuples of
+    values not converted to python.
+'''
+        names, kind = values
+        fields = [meta.dfields[name] for name in names]
+        pk = meta.pk
+        raw = kind == 'raw'
+        result = []
+        for id, _, data in data:
+            row = []
+            for field in fields:
+                if field is pk:
+                    value = id if raw else pk.to_python(id, self)
+                else:
+                    value = field.value_from_data(None, data)
+                    if not raw:
+                        value = field.to_python(value, self)
+                row.append(value)
+            if kind == 'dict':
+                row = dict(zip(names, row))
+            elif kind == 'flat':
+                row = row[0]
+            else:
+                row = tuple(row)
+            result.append(row)
+        return result
+
     def structure(self, instance, client=None):
         '''Create a backend :class:`stdnet.odm.Structure` handler.
 
@@ -324,6 +417,50 @@ must return a instance of the backend handler.'''
         '''Execute a :class:`stdnet.odm.Session` in the backend server.'''
         raise NotImplementedError()
 
+    def expired(self, meta, limit=None):
+        '''Ids of instances of ``meta`` which have expired, at most
+``limit`` of them. Check :attr:`stdnet.odm.ModelMeta.ttl`.'''
+        raise NotImplementedError()
+
+    def incr(self, meta, id, field, by=1):
+        '''Increment the numeric ``field`` of instance ``id`` of ``meta`` by
+``by`` and return the new value, or ``None`` if the instance does not exist.
+Check :meth:`stdnet.odm.Manager.incr`.'''
+        raise NotImplementedError()
+
+    def rebuild_indices(self, meta, chunk=1000):
+        '''Rebuild all the indices of ``meta`` from the stored instances,
+``chunk`` instances at a time. Instances violating a unique constraint are
+deleted. Return a two elements tuple with the number of instances indexed
+and a list of ``(id, error)`` for the deleted instances.
+Check :meth:`stdnet.odm.Manager.rebuild_indices`.'''
+        raise NotImplementedError()
+
+    def build_index(self, meta, field, chunk=1000, throttle=0, compare=False,
+                    swap=True):
+        '''Build the index of ``field`` for the instances of ``meta``, walking
+the ids ``chunk`` at a time and sleeping ``throttle`` seconds between chunks.
+The index is built into shadow keys, kept up to date by commits, which
+replace the index, ``chunk`` values at a time, if ``swap`` is ``True``. Return a list of
+:class:`index_error` with the unique constraint violations and, if
+``compare`` is ``True``, the differences between the built and the current
+index. Check :meth:`stdnet.odm.Manager.build_index`.'''
+        raise NotImplementedError()
+
+    def changes(self, offset=0, count=100):
+        '''Return at most ``count`` :class:`change_record` following the
+record at ``offset``. Records dropped from the :attr:`changelog` are
+skipped.'''
+        raise NotImplementedError()
+
+    def changes_offset(self, consumer):
+        '''The last change acknowledged by ``consumer``, ``0`` if none.'''
+        raise NotImplementedError()
+
+    def ack_changes(self, consumer, offset):
+        '''Acknowledge the changes of ``consumer`` up to ``offset``.'''
+        raise NotImplementedError()
+
     def model_keys(self, meta):
         '''Return a list of database keys used by model *model*'''
         raise NotImplementedError()
@@ -463,6 +600,10 @@ class BackendQuery(object):
                 if isinstance(el, model):
                     session.add(el, modified=False)
                 seq.append(el)
+            if self.queryelem.data.get('batch_related'):
+                batch = [el for el in seq if isinstance(el, model)]
+                for el in batch:
+                    el._related_batch = batch
             self.__slice_cache[key] = seq
             yield seq
 
@@ -0,0 +1,1456 @@
+'''In-memory backend implementation.
+
+Data is stored in python containers living in the current process, so that
+queries and commits never leave the interpreter. Backends connected to the
+same address and database number share the same data.
+'''
+import json
+import threading
+import time
+from functools import partial
+from itertools import islice
+
+import stdnet
+from stdnet import FieldValueError, CommitException, QuerySetError
+from stdnet.utils import (to_bytes, to_string, native_str, iteritems,
+                          unique_tuple, JSPLITTER)
+from stdnet.utils.zset import zset
+from stdnet.backends import (BackendStructure, session_result,
+                             instance_session_result, change_record,
+                             index_error)
+
+MIN_FLOAT = -1.e99
+
+############################################################################
+#    prefixes for data
+OBJ = 'obj'     # the hash table for a instance
+############################################################################
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def encode(value, charset='utf-8'):
+    '''Encode ``value`` into bytes in the same way the redis client does.'''
+    if isinstance(value, float):
+        value = repr(value)
+    return to_bytes(value, charset)
+
+
+def native_id(value, charset='utf-8'):
+    '''Convert an instance id into a native string.'''
+    return native_str(encode(value, charset), charset)
+
+
+def memory_db(address, db=0):
+    '''Return the :class:`MemoryDb` at ``address`` and database ``db``.
+It is created the first time it is accessed.'''
+    key = (address, db)
+    with _databases_lock:
+        client = _databases.get(key)
+        if client is None:
+            client = MemoryDb(address, db)
+            _databases[key] = client
+    return client
+
+
+range_selectors = {
+    'ge': lambda v, v1: float(v) >= float(v1),
+    'gt': lambda v, v1: float(v) > float(v1),
+    'le': lambda v, v1: float(v) <= float(v1),
+    'lt': lambda v, v1: float(v) < float(v1),
+    'startswith': lambda v, v1: to_string(v).startswith(to_string(v1)),
+    'endswith': lambda v, v1: to_string(v).endswith(to_string(v1)),
+    'contains': lambda v, v1: to_string(v1) in to_string(v),
+    'istartswith': lambda v, v1: to_string(v).lower().startswith(
+        to_string(v1).lower()),
+    'iendswith': lambda v, v1: to_string(v).lower().endswith(
+        to_string(v1).lower()),
+    'icontains': lambda v, v1: to_string(v1).lower() in to_string(v).lower()
+}
+
+
+class sortedset(zset):
+    '''A :class:`stdnet.utils.zset.zset` where members with the same score
+are ordered lexicographically, as in redis sorted sets.'''
+    def __contains__(self, item):
+        return item in self._dict
+
+    def __iter__(self):
+        for _, value in self._sl:
+            yield value
+
+    def items(self):
+        for (score, _), value in self._sl:
+            yield score, value
+
+    def add(self, score, val):
+        r = 1
+        if val in self._dict:
+            sc = self._dict[val]
+            if sc == score:
+                return 0
+            self._sl.remove((sc, val))
+            r = 0
+        self._dict[val] = score
+        self._sl.insert((score, val), val)
+        return r
+
+    def incr(self, score, val):
+        '''Increment the score of ``val`` by ``score`` and return the new
+score.'''
+        score += self._dict.get(val, 0)
+        self.add(score, val)
+        return score
+
+    def remove(self, item):
+        score = self._dict.pop(item, None)
+        if score is not None:
+            self._sl.remove((score, item))
+            return score
+
+    def score(self, item):
+        return self._dict.get(item)
+
+    def rank(self, item):
+        score = self._dict.get(item)
+        if score is not None:
+            return self._sl.rank((score, item))
+
+    def range(self, start=0, stop=-1, desc=False):
+        '''List of ``(score, member)`` pairs between ranks ``start`` and
+``stop`` included.'''
+        n = len(self)
+        if start < 0:
+            start += n
+        if stop < 0:
+            stop += n
+        start = max(start, 0)
+        if start > stop or start >= n:
+            return []
+        items = self.items()
+        if desc:
+            items = reversed(list(items))
+        return list(islice(items, start, stop+1))
+
+    def range_by_score(self, start, stop):
+        '''List of ``(score, member)`` pairs with score between ``start`` and
+``stop`` included.'''
+        result = []
+        for score, value in self.items():
+            if score > stop:
+                break
+            elif score >= start:
+                result.append((score, value))
+        return result
+
+    def flat(self):
+        return tuple((v for pair in self.items() for v in pair))
+
+
+class MemoryDb(object):
+    '''An in-process key-value store. It is the client of the memory
+:class:`BackendDataServer`.'''
+    def __init__(self, address, db):
+        self.address = address
+        self.db = db
+        self.lock = threading.RLock()
+        self.data = {}
+
+    def __repr__(self):
+        return 'memory://%s?db=%s' % (self.address, self.db)
+    __str__ = __repr__
+
+    def ping(self):
+        return True
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def setdefault(self, key, factory):
+        value = self.data.get(key)
+        if value is None:
+            value = factory()
+            self.data[key] = value
+        return value
+
+    def delete(self, *keys):
+        pop = self.data.pop
+        return len([k for k in keys if pop(k, None) is not None])
+
+    def keys(self, prefix=''):
+        # like redis, empty containers are not keys
+        with self.lock:
+            return [k for k, v in iteritems(self.data) if k.startswith(prefix)
+                    and not (isinstance(v, (dict, set, list, zset)) and
+                             not v)]
+
+    def delpattern(self, prefix):
+        with self.lock:
+            return self.delete(*[k for k in self.data
+                                 if k.startswith(prefix)])
+
+
+############################################################################
+##    MODEL DATA
+############################################################################
+class MemoryModel(object):
+    '''Manage the data of a model in a :class:`MemoryDb`. It is the
+equivalent of the ``odm.Model`` pseudo-class in the ``odm.lua`` script
+used by the redis backend.'''
+    def __init__(self, backend, meta):
+        self.backend = backend
+        self.meta = meta
+        self.client = backend.client
+        self.charset = backend.charset
+        self.namespace = backend.basekey(meta)
+        self.id_name = meta.pkname()
+        self.auto_id = meta.pk.type == 'auto'
+        self.sorted = bool(meta.ordering)
+        self.autoincr = self.sorted and meta.ordering.auto
+        self.multi_fields = [field.name for field in meta.multifields]
+        self.indices = dict(((idx.attname, idx.unique)
+                             for idx in meta.indices))
+        self.idset = self.namespace + ':id'
+        self.auto_ids = self.namespace + ':ids'
+        self.ttl = meta.ttl
+        self.expiry = self.namespace + ':expiry'
+        self.cap = meta.cap
+        self.cap_by = meta.cap_by.attname if meta.cap_by else None
+        self.changelog = backend.changelog
+
+    def object_key(self, id):
+        return '%s:%s:%s' % (self.namespace, OBJ, id)
+
+    def map_key(self, field):
+        return '%s:uni:%s' % (self.namespace, field)
+
+    def index_key(self, field):
+        return '%s:idx:%s' % (self.namespace, field)
+
+    def ids(self):
+        return self.client.setdefault(self.idset,
+                                      sortedset if self.sorted else set)
+
+    def has_id(self, id):
+        return id in self.ids()
+
+    def object(self, id):
+        return self.client.get(self.object_key(id))
+
+    def load(self, id, attributes=None):
+        data = self.object(id) or {}
+        if attributes is None:
+            return dict(data)
+        else:
+            return dict(((name, data.get(name)) for name in attributes))
+
+    def field_value(self, id, field):
+        data = self.object(native_id(id, self.charset))
+        if data:
+            return data.get(field)
+
+    def field_values(self, ids, field):
+        values = []
+        for id in ids:
+            value = self.field_value(id, field)
+            if value is not None:
+                values.append(value)
+        return values
+
+    def setadd(self, score, id):
+        ids = self.ids()
+        if self.autoincr:
+            score = ids.incr(score, id)
+        elif self.sorted:
+            ids.add(score, id)
+        else:
+            ids.add(id)
+        return score
+
+    def remove_from_set(self, id):
+        ids = self.ids()
+        if self.sorted:
+            ids.remove(id)
+        else:
+            ids.discard(id)
+
+    ########################################################################
+    ##    QUERIES
+    def query(self, field, lookups):
+        '''Evaluate a set of ``lookups`` on ``field`` and return the set
+of matched ids.'''
+        ids, ranges, oper = set(), [], False
+        unique = self.indices.get(field)
+        for lookup, value in lookups:
+            if lookup == 'set':
+                oper = True
+                for v in value:
+                    self._queryvalue(ids, field, unique, v)
+            elif lookup == 'value':
+                oper = True
+                self._queryvalue(ids, field, unique, value)
+            else:
+                selector = range_selectors.get(lookup)
+                if selector is None:
+                    raise QuerySetError('Cannot understand query type "%s".'
+                                        % lookup)
+                value, nested = value
+                ranges.append((selector, value, nested or ()))
+        if ranges:
+            ids = self.select_ranges(ids if oper else self.ids(), field,
+                                     ranges)
+        return ids
+
+    def select_ranges(self, ids, field, ranges):
+        result = set()
+        for id in ids:
+            for selector, value, nested in ranges:
+                v = self.nested_field(id, field, nested)
+                try:
+                    if v is None or not selector(v, value):
+                        break
+                except (TypeError, ValueError):
+                    break
+            else:
+                result.add(id)
+        return result
+
+    def nested_field(self, id, field, nested):
+        value, model = id, self
+        for attname, meta in nested:
+            value = model.field_value(value, attname)
+            if value is None or meta is None:
+                return None
+            model = self.backend.model(meta)
+        if field != self.id_name:
+            value = model.field_value(value, field)
+        return value
+
+    def aggregate(self, ids, field):
+        '''Add to ``ids`` the ids of instances related to them via the
+self-referencing ``field``.'''
+        index = self.client.get(self.index_key(field)) or {}
+        has_id = self.has_id
+        charset = self.charset
+        processed = set()
+        stack = list(ids)
+        while stack:
+            id = stack.pop()
+            if id not in processed:
+                processed.add(id)
+                for rid in index.get(encode(id, charset), ()):
+                    if has_id(rid):
+                        ids.add(rid)
+                        stack.append(rid)
+
+    def sort(self, ids, ordering):
+        '''Sort ``ids`` according to the :class:`stdnet.odm.orderinginfo`
+``ordering`` in the same way as the redis ``SORT`` command.'''
+        return sorted(ids, key=self.sort_key(ordering),
+                      reverse=ordering.desc)
+
+    def sort_key(self, ordering):
+        name = ordering.name
+        last, nested = ordering, []
+        while last.nested:
+            last = last.nested
+            nested.append((self.backend.model(last.model._meta), last.name))
+        alpha = last.field.internal_type == 'text'
+        pk = not nested and name == self.id_name
+
+        def key(id):
+            if pk:
+                value = id
+            else:
+                value = self.field_value(id, name)
+                for model, attname in nested:
+                    if value is None:
+                        break
+                    value = model.field_value(value, attname)
+            if alpha:
+                return (to_string(value) if value is not None else '', id)
+            try:
+                return (float(value), id)
+            except (TypeError, ValueError):
+                return (0.0, id)
+        return key
+
+    def seek(self, ids, seek):
+        '''Keyset pagination of ``ids``. Return at most ``limit`` ids
+following, or preceding, the cursor in the query ordering.'''
+        if seek['index']:
+            key = self.sort_key(self.meta.sort_indexes[seek['index']])
+        else:
+            score = self.ids().score
+            key = lambda id: (score(id), id)
+        items = sorted((key(id) for id in ids))
+        forward = seek['after'] != seek['desc']
+        if not forward:
+            items.reverse()
+        cursor = seek['score']
+        if cursor is not None:
+            cursor = (cursor, seek['id'])
+            if forward:
+                items = [v for v in items
+                         if v[0] > cursor[0] or (cursor[1] and v > cursor)]
+            else:
+                items = [v for v in items
+                         if v[0] < cursor[0] or (cursor[1] and v < cursor)]
+        if seek['limit'] is not None:
+            items = items[:seek['limit']]
+        if not seek['after']:
+            items.reverse()
+        return [id for _, id in items]
+
+    def sorted_ids(self, ids, desc=False):
+        '''Sort ``ids`` using the score of the model ordering.'''
+        idset = self.ids()
+        if len(ids) == len(idset):
+            ordered = list(idset)
+        else:
+            score = idset.score
+            ordered = sorted((id for id in ids if id in idset),
+                             key=lambda id: (score(id), id))
+        if desc:
+            ordered.reverse()
+        return ordered
+
+    def related(self, ids, fields):
+        '''Load the data of related instances with ``ids``.'''
+        pk_only, attributes = False, None
+        if fields:
+            names = [f for f in fields if f != self.id_name]
+            if names:
+                fields, attributes = self.meta.backend_fields(names)
+            else:
+                pk_only = True
+        processed = set()
+        data = []
+        for id in ids:
+            id = native_id(id, self.charset)
+            if id in processed or self.object(id) is None:
+                continue
+            processed.add(id)
+            if pk_only:
+                data.append((id, (), {}))
+            elif attributes:
+                data.append((id, fields, self.load(id, attributes)))
+            else:
+                data.append((id, None, self.load(id)))
+        return data
+
+    def structures(self, ids, name):
+        '''Load the data of structure field ``name`` for instances with
+``ids``.'''
+        data = []
+        for id in ids:
+            value = self.client.get('%s:%s' % (self.object_key(id), name))
+            if value is None:
+                value = []
+            elif isinstance(value, sortedset):
+                value = list(value.items())
+            elif isinstance(value, dict):
+                value = dict(value)
+            else:
+                value = list(value)
+            data.append((id, value))
+        return data
+
+    ########################################################################
+    ##    WRITES
+    def expired(self, limit=None):
+        '''Ids of instances which have expired.'''
+        expiry = self.client.get(self.expiry) if self.ttl else None
+        if not expiry:
+            return []
+        ids = [id for _, id in expiry.range_by_score(float('-inf'),
+                                                      time.time())]
+        return ids if limit is None else ids[:limit]
+
+    def unexpired(self, ids):
+        '''Remove expired ids from ``ids``.'''
+        expired = set(self.expired())
+        if expired:
+            return [id for id in ids if id not in expired]
+        return ids
+
+    def cap_key(self, id):
+        '''Key of the sorted set of ids sharing the cap of instance ``id``.'''
+        key = self.namespace + ':cap'
+        if self.cap_by:
+            value = (self.object(id) or {}).get(self.cap_by)
+            key = '%s:%s' % (key, '' if value is None else value)
+        return key
+
+    def commit(self, instances, bulk=False):
+        results = [self._commit_instance(*data, bulk=bulk)
+                   for data in instances]
+        return session_result(self.meta, results)
+
+    def reindex(self, snapshot, start, count):
+        '''Rebuild the indices of ``count`` instances starting at position
+``start`` of ``snapshot``, a list of ids. When ``start`` is 0 all indices are
+removed first. Instances violating a unique constraint are deleted. Return
+the number of ids processed, a list of ``(id, error)`` and the number of
+instances indexed.'''
+        if start == 0:
+            for field, unique in iteritems(self.indices):
+                if unique:
+                    self.client.delete(self.map_key(field))
+                else:
+                    self.client.delete(self.index_key(field))
+        ids = snapshot[start:start+count]
+        failures, indexed = [], 0
+        for id in ids:
+            # instances deleted after the snapshot was taken are skipped
+            if not self.has_id(id):
+                continue
+            errors = self.update_indices(True, id, id)
+            if errors:
+                self.delete([id])
+                failures.append((id, errors[0]))
+            else:
+                indexed += 1
+        return len(ids), failures, indexed
+
+    def delete(self, ids):
+        results = []
+        client = self.client
+        for id in list(ids):
+            idkey = self.object_key(id)
+            if self.cap:
+                capped = client.get(self.cap_key(id))
+                if capped:
+                    capped.remove(id)
+            self.update_indices(False, id)
+            num = client.delete(idkey)
+            self.remove_from_set(id)
+            for name in self.multi_fields:
+                client.delete('%s:%s' % (idkey, name))
+            if self.ttl:
+                client.setdefault(self.expiry, sortedset).remove(id)
+            if num and self.changelog:
+                self._log_change('delete', id, [])
+            if num:
+                results.append(instance_session_result(id, False, id, True,
+                                                       0))
+        return session_result(self.meta, results)
+
+    def update_indices(self, update, id, oldid=None):
+        '''Update, or remove when ``update`` is ``False``, the indices of
+instance ``id``. Return a list of errors.'''
+        errors = []
+        client = self.client
+        data = self.object(id) or {}
+        for field, unique in iteritems(self.indices):
+            value = data.get(field)
+            if unique:
+                if value is None:
+                    continue
+                mapping = client.setdefault(self.map_key(field), dict)
+                stored_id = mapping.get(value)
+                if update:
+                    if (stored_id is None or stored_id in (id, oldid) or
+                            not self.has_id(stored_id)):
+                        mapping[value] = id
+                    else:
+                        # remove the field from the instance data so that
+                        # removing indices won't delete the stored index.
+                        data.pop(field)
+                        errors.append('Unique constraint "%s" violated: "%s"'
+                                      ' is already in database.' %
+                                      (field, to_string(value, self.charset)))
+                elif stored_id == id:
+                    mapping.pop(value)
+            else:
+                index = client.setdefault(self.index_key(field), dict)
+                if value is None:
+                    value = b''
+                if update:
+                    ids = index.get(value)
+                    if ids is None:
+                        ids = set()
+                        index[value] = ids
+                    ids.add(id)
+                else:
+                    ids = index.get(value)
+                    if ids:
+                        ids.discard(id)
+                        if not ids:
+                            index.pop(value)
+        return errors
+
+    def build_index(self, field, compare=False, swap=True):
+        '''Build the index of ``field`` from the stored instances. Return a
+list of ``(value, id, error)`` tuples. Check
+:meth:`stdnet.BackendDataServer.build_index`.'''
+        unique = self.indices[field]
+        index, errors = {}, []
+        for id in sorted(self.ids(), key=str):
+            value = (self.object(id) or {}).get(field)
+            if unique:
+                if value is not None and index.setdefault(value, id) != id:
+                    errors.append((value, id, 'unique'))
+            else:
+                if value is None:
+                    value = b''
+                index.setdefault(value, set()).add(id)
+        key = self.map_key(field) if unique else self.index_key(field)
+        if compare:
+            live = self.client.get(key) or {}
+            if unique:
+                self._index_diff(errors, index, live)
+            else:
+                for value in set(index).union(live):
+                    built = dict(((id, id) for id in index.get(value, ())))
+                    current = dict(((id, id) for id in live.get(value, ())))
+                    self._index_diff(errors, built, current, value)
+        if swap:
+            self.client.data[key] = index
+        return errors
+
+    def _index_diff(self, errors, built, live, value=None):
+        for k, id in iteritems(built):
+            if live.get(k) != id:
+                errors.append((k if value is None else value, id, 'missing'))
+        for k, id in iteritems(live):
+            if built.get(k) != id:
+                errors.append((k if value is None else value, id, 'stale'))
+
+    def _queryvalue(self, ids, field, unique, value):
+        if field == self.id_name:
+            id = native_id(value, self.charset)
+            if self.has_id(id):
+                ids.add(id)
+        elif unique:
+            mapping = self.client.get(self.map_key(field)) or {}
+            id = mapping.get(encode(value, self.charset))
+            if id is not None and self.has_id(id):
+                ids.add(id)
+        elif unique is False:
+            index = self.client.get(self.index_key(field)) or {}
+            value = b'' if value is None else encode(value, self.charset)
+            ids.update(index.get(value, ()))
+        else:
+            raise QuerySetError('Cannot query on field "%s". Not an index.'
+                                % field)
+
+    def incr(self, id, field, by, ordered=False):
+        id = native_id(id, self.charset)
+        data = self.object(id)
+        if data is None:
+            return None
+        reindex = ordered or field in self.indices
+        if reindex:
+            self.update_indices(False, id)
+        value = data.get(field)
+        if isinstance(by, float):
+            value = float(value or 0) + by
+        else:
+            value = int(value or 0) + by
+        data[field] = encode(value, self.charset)
+        if reindex:
+            if ordered:
+                self.ids().add(float(value), id)
+                if self.cap:
+                    self.client.setdefault(self.cap_key(id),
+                                           sortedset).add(float(value), id)
+            self.update_indices(True, id, id)
+        if self.changelog:
+            self._log_change('update', id, [field])
+        return data[field]
+
+    def _commit_instance(self, iid, action, prev_id, id, score, data,
+                         bulk=False):
+        client = self.client
+        created_id, errors = False, []
+        if self.auto_id:
+            counter = client.get(self.auto_ids, 0)
+            if id == '':
+                created_id = True
+                id = counter + 1
+                client.data[self.auto_ids] = id
+            else:
+                id = int(id)
+                if counter < id:
+                    client.data[self.auto_ids] = id
+        id = native_id(id, self.charset)
+        if id == '':
+            errors.append('Id not available. Cannot commit.')
+        else:
+            # If no previous ID force the action to be add
+            if prev_id == '':
+                prev_id = id
+                action = 'add'
+            else:
+                prev_id = native_id(prev_id, self.charset)
+            if self.cap:
+                capkey = self.cap_key(prev_id)
+            original_data, prev_score = None, None
+            if action != 'add':     # override or update
+                original_data = self.object(prev_id)
+                if original_data is not None:
+                    original_data = dict(original_data)
+                if self.sorted:
+                    prev_score = self.ids().score(prev_id)
+                if not bulk:
+                    self.update_indices(False, prev_id)
+                # when overriding, remove all data from previous object
+                if action == 'override':
+                    client.delete(self.object_key(prev_id))
+            if id != prev_id:
+                self.remove_from_set(prev_id)
+                old = client.data.pop(self.object_key(prev_id), None)
+                if old and action == 'update':
+                    client.data[self.object_key(id)] = old
+            score = self.setadd(score, id)
+            client.setdefault(self.object_key(id), dict).update(data)
+            if not bulk:
+                errors = self.update_indices(True, id, prev_id)
+            # An error has occurred. Rollback changes.
+            if errors:
+                self.update_indices(False, id)
+                if action == 'add':
+                    self.remove_from_set(id)
+                    if created_id:
+                        client.data[self.auto_ids] -= 1
+                        client.delete(self.object_key(id))
+                        id = ''
+                elif original_data is not None:
+                    if id != prev_id:
+                        self.remove_from_set(id)
+                        client.delete(self.object_key(id))
+                        id = prev_id
+                        self.setadd(prev_score, id)
+                    client.data[self.object_key(id)] = original_data
+                    self.update_indices(True, id, id)
+        if errors:
+            return CommitException(errors[0])
+        else:
+            if self.ttl:
+                expiry = client.setdefault(self.expiry, sortedset)
+                if id != prev_id:
+                    expiry.remove(prev_id)
+                expiry.add(time.time() + self.ttl, id)
+            if self.changelog:
+                self._log_change(action, id, self._changed_fields(
+                    action, original_data, data))
+            # the oldest instances over the cap are deleted last
+            if self.cap:
+                self._cap(capkey, prev_id, id, score)
+            return instance_session_result(iid, True, id, False, float(score))
+
+    def _changed_fields(self, action, original_data, data):
+        previous = dict(original_data or ())
+        fields = [f for f in data if previous.pop(f, None) != data[f]]
+        if action == 'override':
+            fields.extend(previous)
+        return fields
+
+    def _log_change(self, action, id, fields):
+        client = self.client
+        key = self.backend.changelog_key
+        seq = client.get(key + ':seq', 0) + 1
+        client.data[key + ':seq'] = seq
+        log = client.setdefault(key, list)
+        log.append(change_record(seq, self.meta.hash, id, action, fields))
+        del log[:-self.changelog]
+
+    def _cap(self, prevkey, prev_id, id, score):
+        client = self.client
+        key = self.cap_key(id)
+        if prevkey != key or prev_id != id:
+            capped = client.get(prevkey)
+            if capped:
+                capped.remove(prev_id)
+        capped = client.setdefault(key, sortedset)
+        if self.sorted:
+            capped.add(float(score), id)
+        elif id not in capped:
+            seq = client.get(self.namespace + ':capseq', 0) + 1
+            client.data[self.namespace + ':capseq'] = seq
+            capped.add(seq, id)
+        excess = len(capped) - self.cap
+        if excess > 0:
+            self.delete([rid for _, rid in capped.range(0, excess - 1)])
+
+
+############################################################################
+##    MEMORY QUERY CLASS
+############################################################################
+class MemoryQuery(stdnet.BackendQuery):
+    '''The :class:`stdnet.BackendQuery` for the memory backend. The query
+is evaluated when executed and the matched ids (or field values when
+:meth:`stdnet.odm.Query.get_field` is used) are stored in :attr:`result`.'''
+    result = None
+
+    def _build(self, **kwargs):
+        # Nothing to do until the query is executed
+        pass
+
+    def _execute_query(self):
+        '''Evaluate the query. Returns the number of elements in the
+query.'''
+        with self.backend.client.lock:
+            self.result = self.evaluate()
+            size = len(self.result)
+            model = self.backend.model(self.meta)
+            if model.ttl and not self.queryelem._get_field:
+                # expired instances which are not yet swept are not counted
+                size -= len(set(model.expired()).intersection(self.result))
+        yield size
+
+    def evaluate(self):
+        qs = self.queryelem
+        meta = self.meta
+        model = self.backend.model(meta)
+        pkname = meta.pkname()
+        if qs.keyword == 'set':
+            if qs.name == pkname and not len(qs):
+                ids = set(model.ids())
+            else:
+                lookups = []
+                for lookup, value in qs:
+                    if lookup == 'set':
+                        value = self.members(value)
+                    lookups.append((lookup, value))
+                ids = model.query(qs.name, lookups)
+        else:
+            sets = [set(self.members(q)) for q in qs]
+            if qs.keyword == 'intersect':
+                ids = sets[0].intersection(*sets[1:])
+            elif qs.keyword == 'union':
+                ids = set().union(*sets)
+            elif qs.keyword == 'diff':
+                ids = sets[0].difference(*sets[1:])
+            else:
+                raise ValueError('Could not perform %s operation' % qs.keyword)
+        if qs.data.get('where'):
+            raise QuerySetError('where queries are not supported by the '
+                                'memory backend.')
+        #
+        # If we are getting a field (for a subsequent query maybe)
+        # unwind the query and store the result
+        gf = qs._get_field
+        if gf and gf != pkname:
+            return model.field_values(ids, meta.dfields[gf].attname)
+        return ids
+
+    def members(self, query):
+        '''The matched elements of another ``query``.'''
+        if query.keyword == 'empty':
+            return ()
+        be = query.backend_query()
+        if isinstance(be, MemoryQuery):
+            be.execute_query()
+            return be.result
+        else:
+            values = []
+            for value in be.items():
+                if hasattr(value, 'pkvalue'):
+                    value = native_id(value.pkvalue(), self.backend.charset)
+                values.append(value)
+            return values
+
+    def _has(self, val):
+        if isinstance(self.result, list):
+            return encode(val, self.backend.charset) in self.result
+        else:
+            return native_id(val, self.backend.charset) in self.result
+
+    def _items(self, slic):
+        backend = self.backend
+        meta = self.meta
+        model = backend.model(meta)
+        get = self.queryelem._get_field
+        with backend.client.lock:
+            # if the get_field is available, we only load that field
+            if get:
+                if slic:
+                    raise QuerySetError('Cannot slice a queryset in '
+                                        'conjunction with get_field. Use '
+                                        'load_only instead.')
+                values = self.result
+                if get == meta.pk.name:
+                    # ids are in the query order, as for redis
+                    values = self.ordered(model, values)
+                tpy = meta.dfields.get(get).to_python
+                return [tpy(v, backend) for v in values]
+            ids = self.ordered(model, self.result, slic)
+            if model.ttl:
+                ids = model.unexpired(ids)
+            if slic:
+                ids = ids[slic]
+            fields = self.queryelem.fields or None
+            if fields:
+                fields = unique_tuple(fields,
+                                      self.queryelem.select_related or ())
+            if fields == (meta.pk.name,):
+                data = [(id, (), {}) for id in ids]
+            elif fields:
+                fields, attributes = meta.backend_fields(fields)
+                data = [(id, fields, model.load(id, attributes))
+                        for id in ids]
+            else:
+                data = [(id, None, model.load(id)) for id in ids]
+            values = self.queryelem.data.get('values')
+            if values:
+                return backend.values_from_db(meta, data, values)
+            related = self.load_related(model, ids)
+        return backend.objects_from_db(meta, data, related)
+
+    def ordered(self, model, ids, slic=None):
+        '''List of ``ids`` in the query order.'''
+        meta = self.meta
+        seek = self.queryelem.data.get('seek')
+        if seek:
+            if slic:
+                raise QuerySetError('Cannot slice a queryset in conjunction '
+                                    'with keyset pagination.')
+            return model.seek(ids, seek)
+        elif self.queryelem.ordering:
+            return model.sort(ids, self.queryelem.ordering)
+        elif meta.ordering:
+            return model.sorted_ids(ids, meta.ordering.desc)
+        elif slic:
+            return model.sort(ids, meta.get_sorting(meta.pkname()))
+        else:
+            return list(ids)
+
+    def load_related(self, model, ids):
+        '''Load related fields data for instances with ``ids``.'''
+        related = self.queryelem.select_related
+        if related:
+            meta = self.meta
+            related_fields = {}
+            for name, fields in iteritems(related):
+                if name in meta.related:
+                    related_fields[name] = self.load_related_manager(
+                        meta.related[name], ids, fields)
+                    continue
+                if JSPLITTER in name:
+                    related_fields[name] = self.load_related_path(
+                        model, name, ids, fields)
+                    continue
+                field = meta.dfields[name]
+                if field in meta.multifields:
+                    related_fields[name] = model.structures(ids, field.name)
+                else:
+                    rids = model.field_values(ids, field.attname)
+                    rmodel = self.backend.model(field.relmodel._meta)
+                    related_fields[name] = rmodel.related(rids, fields)
+            return related_fields
+
+    def load_related_manager(self, manager, ids, fields):
+        '''Load instances related to ``ids`` via a reverse foreign key or a
+many-to-many related ``manager``.'''
+        backend = self.backend
+        through = backend.model(manager.model._meta)
+        rmodel = backend.model(manager.formodel._meta)
+        index = backend.client.get(through.index_key(manager.field.attname))
+        index = index or {}
+        name_formodel = getattr(manager, 'name_formodel', None)
+        if name_formodel:
+            rfield = through.meta.dfields[name_formodel].attname
+        data = []
+        for id in ids:
+            rids = index.get(encode(id, backend.charset), ())
+            if through.sorted:
+                rids = through.sorted_ids(rids)
+            if name_formodel:
+                rids = through.field_values(rids, rfield)
+            data.append((id, rmodel.related(rids, fields)))
+        return data
+
+    def load_related_path(self, model, path, ids, fields):
+        '''Load instances at the end of a ``path`` of foreign keys starting
+from ``ids`` of ``model``.'''
+        for field in self.meta.related_path(path):
+            ids = unique_tuple(model.field_values(ids, field.attname))
+            model = self.backend.model(field.relmodel._meta)
+        return model.related(ids, fields)
+
+
+############################################################################
+##    STRUCTURES
+############################################################################
+class MemoryStructure(BackendStructure):
+    container = None
+
+    def __init__(self, *args, **kwargs):
+        super(MemoryStructure, self).__init__(*args, **kwargs)
+        instance = self.instance
+        field = instance.field
+        if field:
+            model = field.model
+            if instance._pkvalue:
+                id = self.backend.basekey(model._meta, OBJ,
+                                          instance._pkvalue, field.name)
+            else:
+                id = self.backend.basekey(model._meta, 'struct', field.name)
+        else:
+            id = '%s.%s' % (instance._meta.name, instance.id)
+        self.id = id
+
+    def encode(self, value):
+        return encode(value, self.backend.charset)
+
+    def delete(self):
+        return self.client.delete(self.id)
+
+    def size(self):
+        value = self._value()
+        return len(value) if value is not None else 0
+
+    def _value(self):
+        return self.client.get(self.id)
+
+    def _create(self):
+        return self.client.setdefault(self.id, self.container)
+
+    def _prune(self):
+        # redis removes empty keys, we do the same
+        if not self._value():
+            self.delete()
+
+
+class String(MemoryStructure):
+    container = bytearray
+
+    def flush(self):
+        cache = self.instance.cache
+        result = None
+        data = cache.getvalue()
+        if data:
+            self._create().extend(self.encode(data))
+            result = True
+        return result
+
+    def incr(self, num=1):
+        with self.client.lock:
+            value = int(self._value() or 0) + num
+            self.client.data[self.id] = bytearray(self.encode(value))
+        return value
+
+
+class Set(MemoryStructure):
+    container = set
+
+    def flush(self):
+        cache = self.instance.cache
+        result = None
+        if cache.toadd:
+            self._create().update((self.encode(v) for v in cache.toadd))
+            result = True
+        if cache.toremove:
+            self._create().difference_update(
+                (self.encode(v) for v in cache.toremove))
+            self._prune()
+            result = True
+        return result
+
+    def __contains__(self, value):
+        return self.encode(value) in (self._value() or ())
+
+    def items(self):
+        return set(self._value() or ())
+
+
+class Zset(MemoryStructure):
+    '''Memory ordered set structure'''
+    container = sortedset
+
+    def flush(self):
+        cache = self.instance.cache
+        result = None
+        if cache.toadd:
+            z = self._create()
+            for score, value in cache.toadd.items():
+                z.add(float(score), self.encode(value))
+            result = True
+        if cache.toremove:
+            z = self._create()
+            for value in cache.toremove:
+                z.remove(self.encode(value))
+            self._prune()
+            result = True
+        return result
+
+    def __contains__(self, value):
+        return self.encode(value) in (self._value() or ())
+
+    def get(self, score):
+        r = self.range(score, score, withscores=False)
+        if r:
+            if len(r) > 1:
+                return r
+            else:
+                return r[0]
+
+    def items(self):
+        return self.irange(withscores=True)
+
+    def values(self):
+        return self.irange(withscores=False)
+
+    def rank(self, value):
+        z = self._value()
+        if z is not None:
+            return z.rank(self.encode(value))
+
+    def count(self, start, stop):
+        return len(self.range(start, stop, withscores=False))
+
+    def range(self, start, end, withscores=True, **options):
+        z = self._value()
+        result = z.range_by_score(float(start), float(end)) if z else []
+        return self._range(withscores, result)
+
+    def irange(self, start=0, stop=-1, desc=False, withscores=True,
+               **options):
+        z = self._value()
+        result = z.range(start, stop, desc) if z else []
+        return self._range(withscores, result)
+
+    def ipop_range(self, start, stop=None, withscores=True, **options):
+        '''Remove and return a range from the ordered set by rank (index).'''
+        stop = stop if stop is not None else start
+        with self.client.lock:
+            result = self.irange(start, stop, withscores=True)
+            self._remove(result)
+        return self._range(withscores, result)
+
+    def pop_range(self, start, stop=None, withscores=True, **options):
+        '''Remove and return a range from the ordered set by score.'''
+        stop = stop if stop is not None else start
+        with self.client.lock:
+            result = self.range(start, stop, withscores=True)
+            self._remove(result)
+        return self._range(withscores, result)
+
+    # PRIVATE
+    def _range(self, withscores, result):
+        if withscores:
+            return result
+        else:
+            return [v for _, v in result]
+
+    def _remove(self, result):
+        if result:
+            z = self._value()
+            for _, value in result:
+                z.remove(value)
+            self._prune()
+
+
+class List(MemoryStructure):
+    container = list
+
+    def pop_front(self):
+        with self.client.lock:
+            value = self._value()
+            if value:
+                value = value.pop(0)
+                self._prune()
+                return value
+
+    def pop_back(self):
+        with self.client.lock:
+            value = self._value()
+            if value:
+                value = value.pop()
+                self._prune()
+                return value
+
+    def block_pop_front(self, timeout):
+        return self._block_pop(self.pop_front, timeout)
+
+    def block_pop_back(self, timeout):
+        return self._block_pop(self.pop_back, timeout)
+
+    def flush(self):
+        cache = self.instance.cache
+        result = None
+        if cache.front:
+            l = self._create()
+            l[0:0] = reversed([self.encode(v) for v in cache.front])
+            result = True
+        if cache.back:
+            self._create().extend((self.encode(v) for v in cache.back))
+            result = True
+        return result
+
+    def get(self, index):
+        value = self._value() or ()
+        try:
+            return value[index]
+        except IndexError:
+            return None
+
+    def range(self, start=0, end=-1):
+        value = self._value() or ()
+        end = end + 1 if end != -1 else len(value)
+        return list(value[start:end])
+
+    def _block_pop(self, pop, timeout):
+        end = time.time() + timeout if timeout else None
+        while True:
+            value = pop()
+            if value is not None or (end and time.time() >= end):
+                return value
+            time.sleep(0.01)
+
+
+class Hash(MemoryStructure):
+    container = dict
+
+    def flush(self):
+        cache = self.instance.cache
+        result = None
+        encode = self.encode
+        if cache.toadd:
+            self._create().update(((encode(k), encode(v)) for k, v in
+                                   iteritems(cache.toadd)))
+            result = True
+        if cache.toremove:
+            self.remove(*cache.toremove)
+            result = True
+        return result
+
+    def get(self, key):
+        return (self._value() or {}).get(self.encode(key))
+
+    def pop(self, key):
+        with self.client.lock:
+            value = (self._value() or {}).pop(self.encode(key), None)
+            self._prune()
+        return value
+
+    def remove(self, *fields):
+        with self.client.lock:
+            value = self._value() or {}
+            n = len([f for f in fields
+                     if value.pop(self.encode(f), None) is not None])
+            self._prune()
+        return n
+
+    def __contains__(self, key):
+        return self.encode(key) in (self._value() or {})
+
+    def keys(self):
+        return list(self._value() or ())
+
+    def values(self):
+        return list((self._value() or {}).values())
+
+    def items(self):
+        return dict(self._value() or {})
+
+
+############################################################################
+##    MEMORY BACKEND
+############################################################################
+class BackendDataServer(stdnet.BackendDataServer):
+    '''A :class:`stdnet.BackendDataServer` which keeps data in the memory
+of the current process.'''
+    Query = MemoryQuery
+    default_port = 0
+    struct_map = {'set': Set,
+                  'list': List,
+                  'zset': Zset,
+                  'hashtable': Hash,
+                  'string': String}
+
+    def setup_connection(self, address):
+        if 'db' not in self.params:
+            self.params['db'] = 0
+        address = ':'.join((str(a) for a in address))
+        client = memory_db(address, int(self.params['db']))
+        self._models = {}
+        if self.namespace:
+            self.params['namespace'] = self.namespace
+        return client
+
+    def auto_id_to_python(self, value):
+        return int(value)
+
+    def ping(self):
+        return self.client.ping()
+
+    def model(self, meta):
+        '''Return the :class:`MemoryModel` for ``meta``.'''
+        model = self._models.get(meta)
+        if model is None:
+            model = MemoryModel(self, meta)
+            self._models[meta] = model
+        return model
+
+    def execute_session(self, session_data):
+        '''Execute a session in memory.'''
+        commands = []
+        for sm in session_data:  # loop through model sessions
+            meta = sm.meta
+            if sm.structures:
+                commands.append((self.flush_structure, sm))
+            if sm.deletes is not None:
+                delquery = sm.deletes.backend_query()
+                commands.append((self.accumulate_delete, delquery))
+            if sm.dirty:
+                instances = []
+                for instance in sm.dirty:
+                    state = instance.get_state()
+                    if not meta.is_valid(instance):
+                        raise FieldValueError(
+                            json.dumps(instance._dbdata['errors']))
+                    score = MIN_FLOAT
+                    if meta.ordering:
+                        if meta.ordering.auto:
+                            score = meta.ordering.name.incrby
+                        else:
+                            v = getattr(instance, meta.ordering.name, None)
+                            if v is not None:
+                                score = meta.ordering.field.scorefun(v)
+                    data = instance._dbdata['cleaned_data']
+                    data = dict(((k, encode(v, self.charset)) for k, v in
+                                 iteritems(data)))
+                    action = state.action
+                    prev_id = state.iid if state.persistent else ''
+                    id = instance.pkvalue() or ''
+                    instances.append((state.iid, action, prev_id, id, score,
+                                      data))
+                commands.append((partial(self.model(meta).commit,
+                                         bulk=sm.bulk), instances))
+        # All data is validated, execute commands
+        results = []
+        with self.client.lock:
+            for command, args in commands:
+                result = command(args)
+                if isinstance(result, session_result):
+                    results.append(result)
+                elif result:
+                    results.extend(result)
+        return results
+
+    def accumulate_delete(self, backend_query):
+        # Delete models queries. It loops through the related models to
+        # delete related instances.
+        session = backend_query.session
+        query = backend_query.queryelem
+        meta = query.meta
+        model = self.model(meta)
+        backend_query.execute_query()
+        ids = backend_query.result
+        if query.data.get('expired'):
+            # instances refreshed since they were read are not deleted
+            expired = ids.intersection(model.expired())
+            if expired != ids:
+                if not expired:
+                    return [model.delete(expired)]
+                qs = session.query(meta.model).filter(
+                    **{meta.pkname(): expired})
+                return self.accumulate_delete(qs.backend_query())
+        rel_managers = []
+        results = []
+        for name in meta.related:
+            rmanager = getattr(meta.model, name)
+            # the related manager model is the same as current model
+            if rmanager.model == meta.model:
+                model.aggregate(ids, rmanager.field.attname)
+            # only consider models which are registered with the router
+            elif rmanager.model in session.router:
+                rel_managers.append(rmanager)
+        # loop over related managers
+        for rmanager in rel_managers:
+            # IMPORTANT. delete only if field is required
+            if rmanager.field.required:
+                rq = rmanager.query_from_query(query).backend_query()
+                results.extend(self.accumulate_delete(rq))
+        results.append(model.delete(ids))
+        return results
+
+    def flush(self, meta=None):
+        '''Flush all model keys from the database'''
+        prefix = self.basekey(meta) if meta else self.namespace
+        return self.client.delpattern(prefix)
+
+    def clean(self, meta):
+        # There are no temporary keys
+        return 0
+
+    def expired(self, meta, limit=None):
+        with self.client.lock:
+            return self.model(meta).expired(limit)
+
+    def incr(self, meta, id, field, by=1):
+        ordering = meta.ordering
+        ordered = bool(ordering and not ordering.auto and
+                       ordering.field is field)
+        with self.client.lock:
+            return self.model(meta).incr(id, field.attname, by, ordered)
+
+    def rebuild_indices(self, meta, chunk=1000):
+        model = self.model(meta)
+        # ids are indexed in alphabetical order, as for redis, so that the
+        # instance with the lowest id wins unique constraint conflicts
+        with self.client.lock:
+            snapshot = sorted(model.ids(), key=str)
+        start, total, failures = 0, 0, []
+        while True:
+            with self.client.lock:
+                count, errors, indexed = model.reindex(snapshot, start, chunk)
+            failures.extend(errors)
+            start += count
+            total += indexed
+            if count < chunk:
+                return total, failures
+
+    def build_index(self, meta, field, chunk=1000, throttle=0, compare=False,
+                    swap=True):
+        # Instances are in the memory of this process, the index is built
+        # in a single pass.
+        with self.client.lock:
+            errors = self.model(meta).build_index(field.attname, compare,
+                                                  swap)
+        return [index_error(meta.model, field.attname,
+                            to_string(value, self.charset),
+                            to_string(id, self.charset),
+                            error) for value, id, error in errors]
+
+    def changes(self, offset=0, count=100):
+        key = self.changelog_key
+        with self.client.lock:
+            log = self.client.get(key) or []
+            last = self.client.get(key + ':seq', 0)
+            start = max(offset - last + len(log), 0)
+            return log[start:start + count]
+
+    def changes_offset(self, consumer):
+        offsets = self.client.get(self.changelog_key + ':offsets') or {}
+        return offsets.get(consumer, 0)
+
+    def ack_changes(self, consumer, offset):
+        with self.client.lock:
+            self.client.setdefault(self.changelog_key + ':offsets',
+                                   dict)[consumer] = offset
+
+    def model_keys(self, meta):
+        return sorted(self.client.keys(self.basekey(meta)))
+
+    def instance_keys(self, obj):
+        meta = obj._meta
+        keys = [self.basekey(meta, OBJ, obj.pkvalue())]
+        for field in meta.multifields:
+            f = getattr(obj, field.attname)
+            be = self.structure(f)
+            keys.append(be.id)
+        return keys
+
+    def flush_structure(self, sm):
+        for instance in sm.structures:
+            be = self.structure(instance)
+            if instance.action == 'update':
+                be.flush()
+            else:
+                be.delete()
+            instance.cache.clear()
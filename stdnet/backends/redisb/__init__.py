@@ -1,15 +1,21 @@
 '''Redis backend implementation'''
+import sys
 import json
+import time
+from collections import namedtuple, OrderedDict
 from functools import partial
 
 from .client import *
 
 import stdnet
-from stdnet import FieldValueError, CommitException, QuerySetError
-from stdnet.utils import (gen_unique_id, zip, ispy3k,
-                          native_str, flat_mapping, unique_tuple)
+from stdnet import (FieldValueError, CommitException, QuerySetError,
+                    FieldError)
+from stdnet.utils import (gen_unique_id, zip, ispy3k, to_bytes,
+                          native_str, flat_mapping, unique_tuple, JSPLITTER,
+                          raise_error_trace)
 from stdnet.backends import (BackendStructure, session_result,
-                             instance_session_result)
+                             instance_session_result, change_record,
+                             index_error, async_sleep)
 
 MIN_FLOAT = -1.e99
 
@@ -17,7 +23,9 @@ MIN_FLOAT = -1.e99
 #    prefixes for data
 OBJ = 'obj'     # the hash table for a instance
 TMP = 'tmp'     # temorary key
+SORT = 'sort'   # sorted set of a sort index
 ODM_SCRIPTS = ('odmrun', 'move2set', 'zdiffstore')
+cascade_result = namedtuple('cascade_result', 'remaining graph metas results')
 ############################################################################
 
 if ispy3k:
@@ -44,6 +52,7 @@ class odmrun(RedisScript):
               # timeseries must be included before utils
               read_lua_file('commands.timeseries'),
               read_lua_file('commands.utils'),
+              read_lua_file('objects'),
               read_lua_file('odm'))
     required_scripts = ODM_SCRIPTS
 
@@ -53,6 +62,8 @@ class odmrun(RedisScript):
             res = (instance_session_result(r, False, r, True, 0)
                    for r in response)
             return session_result(meta, res)
+        elif odm_command == 'cascade_delete':
+            return self._wrap_cascade_delete(response, **opts)
         elif odm_command == 'commit':
             res = self._wrap_commit(response, **opts)
             return session_result(meta, res)
@@ -63,6 +74,17 @@ class odmrun(RedisScript):
         else:
             return response
 
+    def _wrap_cascade_delete(self, response, graph=None, metas=None,
+                             redis_client=None, **options):
+        remaining, deleted = response
+        results = []
+        for meta, ids in zip(metas, deleted):
+            if ids:
+                res = [instance_session_result(r, False, r, True, 0)
+                       for r in ids]
+                results.append(session_result(meta, res))
+        return cascade_result(int(remaining), graph, metas, results)
+
     def _wrap_commit(self, response, iids=None, redis_client=None, **options):
         for id, iid in zip(response, iids):
             id, flag, info = id
@@ -74,7 +96,8 @@ class odmrun(RedisScript):
                 yield CommitException(msg)
 
     def load_query(self, response, backend, meta, get=None, fields=None,
-                   fields_attributes=None, redis_client=None, **options):
+                   fields_attributes=None, values=None, redis_client=None,
+                   **options):
         if get:
             tpy = meta.dfields.get(get).to_python
             return [tpy(v, backend) for v in response]
@@ -82,6 +105,8 @@ class odmrun(RedisScript):
             data, related = response
             encoding = redis_client.encoding
             data = self.build(data, meta, fields, fields_attributes, encoding)
+            if values:
+                return backend.values_from_db(meta, data, values)
             related_fields = {}
             if related:
                 for fname, rdata, fields in related:
@@ -106,6 +131,16 @@ class odmrun(RedisScript):
 
     def load_related(self, meta, fname, data, fields, encoding):
         '''Parse data for related objects.'''
+        if fname in meta.related:
+            rmeta = meta.related[fname].formodel._meta
+            names = self.field_names(rmeta, fields)
+            return ((native_str(id, encoding),
+                     list(self.build(fdata, rmeta, names, fields, encoding)))
+                    for id, fdata in data)
+        if JSPLITTER in fname:
+            rmeta = meta.related_path(fname)[-1].relmodel._meta
+            names = self.field_names(rmeta, fields)
+            return self.build(data, rmeta, names, fields, encoding)
         field = meta.dfields[fname]
         if field in meta.multifields:
             fmeta = field.structure_class()._meta
@@ -118,7 +153,14 @@ class odmrun(RedisScript):
                         id, fdata in data)
         else:
             # this is data for stdmodel instances
-            return self.build(data, meta, fields, fields, encoding)
+            rmeta = field.relmodel._meta
+            names = self.field_names(rmeta, fields)
+            return self.build(data, rmeta, names, fields, encoding)
+
+    def field_names(self, meta, attnames):
+        '''Field names from the attribute names of related fields.'''
+        names = dict(((f.attname, f.name) for f in meta.scalarfields))
+        return tuple((names.get(a, a) for a in attnames))
 
 
 class check_structures(RedisScript):
@@ -141,7 +183,8 @@ class RedisQuery(stdnet.BackendQuery):
 
     @property
     def meta_info(self):
-        if self._meta_info is None:
+        # models with a ttl carry the current time, which must not go stale
+        if self._meta_info is None or self.meta.ttl:
             self._meta_info = json.dumps(self.backend.meta(self.meta))
         return self._meta_info
 
@@ -171,6 +214,10 @@ class RedisQuery(stdnet.BackendQuery):
         if qs.keyword == 'set':
             if qs.name == pkname and not args:
                 key = backend.basekey(meta, 'id')
+            elif not keys:
+                # A single equality on an index uses the index set directly
+                key = self.index_key(qs.name, args)
+            if key:
                 temp_key = False
             else:
                 key = backend.tempkey(meta)
@@ -202,6 +249,16 @@ class RedisQuery(stdnet.BackendQuery):
             # key if it is temporary key)
             keys.insert(0, key)
             backend.where_run(pipe, self.meta_info, keys, *where)
+        # Expired instances which are not yet swept are removed before the
+        # query is sliced. Sweeps keep the expired instances only.
+        if meta.ttl:
+            bkey = key
+            if not temp_key:
+                temp_key = True
+                key = backend.tempkey(meta)
+            expired = '1' if qs.data.get('expired') else '0'
+            backend.odmrun(pipe, 'expiry', meta, (key, bkey), self.meta_info,
+                           expired)
         #
         # If we are getting a field (for a subsequent query maybe)
         # unwind the query and store the result
@@ -212,13 +269,40 @@ class RedisQuery(stdnet.BackendQuery):
             if not temp_key:
                 temp_key = True
                 key = backend.tempkey(meta)
-            okey = backend.basekey(meta, OBJ, '*->' + field_attribute)
-            pipe.sort(bkey, by='nosort', get=okey, store=key)
+            if meta.storage == 'packed':
+                # packed instances have no hash fields to sort by
+                backend.odmrun(pipe, 'get_field', meta, (key, bkey),
+                               self.meta_info, field_attribute)
+            else:
+                okey = backend.basekey(meta, OBJ, '*->' + field_attribute)
+                pipe.sort(bkey, by='nosort', get=okey, store=key)
             self.card = getattr(pipe, 'llen')
         if temp_key:
             pipe.expire(key, self.expire)
         self.query_key = key
 
+    def index_key(self, field, args):
+        '''The redis key of the index set for a single ``value`` lookup on a
+non unique index ``field``, which can be used in place of a query key.
+Return ``None`` when ``args`` are not a single equality.'''
+        if len(args) != 2 or args[0] != 'value':
+            return
+        for idx in self.meta.indices:
+            if idx.attname == field:
+                if idx.unique:
+                    return
+                break
+        else:
+            return
+        value = args[1]
+        key = self.backend.basekey(self.meta, 'idx', field, '')
+        if isinstance(value, bytes):
+            return to_bytes(key, self.backend.client.encoding) + value
+        elif isinstance(value, float):
+            return key + repr(value)
+        else:
+            return '%s%s' % (key, value)
+
     def _execute_query(self):
         '''Execute the query without fetching data. Returns the number of
 elements in the query.'''
@@ -234,12 +318,20 @@ elements in the query.'''
                 self._check_member = self.sism
         else:
             self.ismember = None
-        self.card(self.query_key)
+        if self.meta.ttl and self.ismember:
+            # expired instances which are not yet swept are not counted
+            self.backend.odmrun(pipe, 'count', self.meta, (self.query_key,),
+                                self.meta_info)
+        else:
+            self.card(self.query_key)
         result = yield pipe.execute()
         yield result[-1]
 
     def order(self, last):
         '''Perform ordering with respect model fields.'''
+        index = self.meta.sort_index(last)
+        if index:
+            index = self.backend.basekey(self.meta, SORT, index)
         desc = last.desc
         field = last.name
         nested = last.nested
@@ -255,7 +347,23 @@ elements in the query.'''
         return {'field': field,
                 'method': method,
                 'desc': desc,
-                'nested': nested_args}
+                'nested': nested_args,
+                'index': index or ''}
+
+    def seek(self, seek):
+        '''Keyset pagination arguments for the ``load`` script.'''
+        meta = self.meta
+        if seek['index']:
+            key = self.backend.basekey(meta, SORT, seek['index'])
+        else:
+            key = self.backend.basekey(meta, 'id')
+        limit = seek['limit']
+        return {'index': key,
+                'after': seek['after'],
+                'desc': seek['desc'],
+                'score': seek['score'],
+                'id': seek['id'] or '',
+                'limit': -1 if limit is None else limit}
 
     def dump_nested(self, value, nested):
         nested_args = []
@@ -287,7 +395,14 @@ elements in the query.'''
         name = ''
         order = ()
         start, stop = self.get_redis_slice(slic)
-        if self.queryelem.ordering:
+        seek = self.queryelem.data.get('seek')
+        if seek:
+            if slic:
+                raise QuerySetError('Cannot slice a queryset in conjunction '
+                                    'with keyset pagination.')
+            name = 'seek'
+            order = self.seek(seek)
+        elif self.queryelem.ordering:
             order = self.order(self.queryelem.ordering)
         elif meta.ordering:
             name = 'DESC' if meta.ordering.desc else 'ASC'
@@ -295,8 +410,8 @@ elements in the query.'''
             order = self.order(meta.get_sorting(meta.pkname()))
         # Wen using the sort algorithm redis requires the number of element
         # not the stop index
-        if order:
-            name = 'explicit'
+        if order and not seek:
+            name = 'index' if order['index'] else 'explicit'
             N = self.execute_query()
             if stop is None:
                 stop = N
@@ -307,6 +422,11 @@ elements in the query.'''
             stop -= start
         elif stop is None:
             stop = -1
+        elif stop == 0:
+            start = 1
+        else:
+            # redis ranges include the stop index
+            stop -= 1
         get = self.queryelem._get_field
         fields_attributes = None
         pkname_tuple = (meta.pk.name,)
@@ -339,7 +459,8 @@ elements in the query.'''
                    'get': get}
         joptions = json.dumps(options)
         options.update({'fields': fields,
-                        'fields_attributes': fields_attributes})
+                        'fields_attributes': fields_attributes,
+                        'values': self.queryelem.data.get('values')})
         return backend.odmrun(backend.client, 'load', meta, (self.query_key,),
                               self.meta_info, joptions, **options)
 
@@ -349,19 +470,63 @@ elements in the query.'''
         if related:
             meta = self.meta
             for rel in related:
+                if rel in meta.related:
+                    yield rel, self.related_manager_lua_args(rel, related[rel])
+                    continue
+                if JSPLITTER in rel:
+                    yield rel, self.related_path_lua_args(rel, related[rel])
+                    continue
                 field = meta.dfields[rel]
                 relmodel = field.relmodel
-                bk = self.backend.basekey(relmodel._meta) if relmodel else ''
-                fields = list(related[rel])
-                if meta.pkname() in fields:
-                    fields.remove(meta.pkname())
-                    if not fields:
-                        fields.append('')
+                if relmodel:
+                    bk = self.backend.basekey(relmodel._meta)
+                    fields = self.related_fields(relmodel._meta, related[rel])
+                else:
+                    bk, fields = '', list(related[rel])
                 ftype = field.type if field in meta.multifields else ''
                 data = {'field': field.attname, 'type': ftype,
                         'bk': bk, 'fields': fields}
                 yield field.name, data
 
+    def related_manager_lua_args(self, name, fields):
+        '''load_related arguments for the related manager ``name``, a
+reverse foreign key or a many-to-many relationship.'''
+        basekey = self.backend.basekey
+        manager = self.meta.related[name]
+        through = manager.model._meta
+        idx = basekey(through, 'idx', manager.field.attname, '')
+        # many-to-many managers query the model of the through model field
+        # name_formodel
+        rmeta = manager.formodel._meta
+        name_formodel = getattr(manager, 'name_formodel', None)
+        if name_formodel:
+            data = {'type': 'many2many', 'idx': idx, 'tbk': basekey(through),
+                    'rfield': through.dfields[name_formodel].attname}
+        else:
+            data = {'type': 'one2many', 'idx': idx}
+        data.update({'field': name, 'bk': basekey(rmeta),
+                     'fields': self.related_fields(rmeta, fields)})
+        return data
+
+    def related_path_lua_args(self, path, fields):
+        '''load_related arguments for a ``path`` of foreign keys. Each hop
+reads a foreign key from the instances loaded by the previous one.'''
+        basekey = self.backend.basekey
+        rfields = self.meta.related_path(path)
+        meta, hops = self.meta, []
+        for field in rfields:
+            hops.append([basekey(meta), field.attname])
+            meta = field.relmodel._meta
+        return {'field': rfields[-1].attname, 'type': '', 'hops': hops,
+                'bk': basekey(meta), 'fields': self.related_fields(meta, fields)}
+
+    def related_fields(self, meta, fields):
+        '''Attribute names of ``fields`` of the related model ``meta``. A
+single empty string loads the primary key only.'''
+        if fields:
+            return meta.backend_fields(fields)[1] or ['']
+        return []
+
 
 ############################################################################
 ##    STRUCTURES
@@ -713,11 +878,34 @@ for _,v in ipairs(ARGV) do
 end''')
 
 
+class changelog_read(RedisScript):
+    script = '''\
+local size, last = redis.call('llen', KEYS[1]), redis.call('get', KEYS[2])
+local start = ARGV[1] - (tonumber(last) or 0) + size
+if start < 0 then
+    start = 0
+end
+return redis.call('lrange', KEYS[1], start, start + ARGV[2] - 1)'''
+
+    def callback(self, response, redis_client=None, **options):
+        encoding = redis_client.encoding
+        records = []
+        for r in response:
+            seq, model, id, action, fields = json.loads(native_str(r, encoding))
+            # empty lua tables are encoded as json objects
+            records.append(change_record(seq, model, id, action,
+                                         list(fields)))
+        return records
+
+
 ############################################################################
 ##    REDIS BACKEND
 ############################################################################
 class BackendDataServer(stdnet.BackendDataServer):
     Query = RedisQuery
+    delete_chunk = 1000
+    # seconds the keys of an index being built live between two chunks
+    build_expire = 60
     _redis_clients = {}
     default_port = 6379
     struct_map = {'set': Set,
@@ -735,9 +923,12 @@ class BackendDataServer(stdnet.BackendDataServer):
             address = address[0]
         if 'db' not in self.params:
             self.params['db'] = 0
+        chunk = self.params.pop('delete_chunk', None)
         rpy = redis_client(address=address, **self.params)
         if self.namespace:
             self.params['namespace'] = self.namespace
+        if chunk is not None:
+            self.delete_chunk = self.params['delete_chunk'] = int(chunk)
         return rpy
 
     def auto_id_to_python(self, value):
@@ -756,8 +947,225 @@ class BackendDataServer(stdnet.BackendDataServer):
         '''Extract model metadata for lua script stdnet/lib/lua/odm.lua'''
         data = meta.as_dict()
         data['namespace'] = self.basekey(meta)
+        indexes = []
+        for name, sort in meta.sort_indexes.items():
+            nested = sort.nested
+            indexes.append({'key': self.basekey(meta, SORT, name),
+                            'field': sort.name,
+                            'bk': self.basekey(nested.model._meta)
+                            if nested else '',
+                            'rfield': nested.name if nested else ''})
+        # sort indexes of other models which depend on this model fields
+        dependents = []
+        for manager in meta.related.values():
+            rmeta = manager.model._meta
+            for name, sort in rmeta.sort_indexes.items():
+                if sort.nested and sort.field is manager.field:
+                    dependents.append({
+                        'key': self.basekey(rmeta, SORT, name),
+                        'idx': self.basekey(rmeta, 'idx', sort.name, ''),
+                        'rfield': sort.nested.name})
+        data['sort_indexes'] = indexes
+        data['sort_dependents'] = dependents
+        if meta.storage == 'packed':
+            fields = meta.scalarfields
+            data['packed'] = {'bucket': meta.bucket or 0,
+                              'fields': [f.attname for f in fields],
+                              'numeric': [f.attname for f in fields
+                                          if f.internal_type == 'numeric']}
+        if meta.cap:
+            data['cap'] = meta.cap
+            if meta.cap_by:
+                data['cap_by'] = meta.cap_by.attname
+        if self.changelog:
+            data['changelog'] = {'key': self.changelog_key,
+                                 'size': self.changelog,
+                                 'model': meta.hash}
+        if meta.ttl:
+            data.update({'expiry': self.basekey(meta, 'expiry'),
+                         'ttl': meta.ttl,
+                         'now': time.time()})
         return data
 
+    def expired(self, meta, limit=None):
+        key = self.basekey(meta, 'expiry')
+        if limit is None:
+            return self.client.zrangebyscore(key, '-inf', time.time())
+        return self.client.zrangebyscore(key, '-inf', time.time(), 0, limit)
+
+    def incr(self, meta, id, field, by=1):
+        ordering = meta.ordering
+        ordered = bool(ordering and not ordering.auto and
+                       ordering.field is field)
+        return self.odmrun(self.client, 'incr', meta, (),
+                           json.dumps(self.meta(meta)), id, field.attname,
+                           by, field.type, '1' if ordered else '0')
+
+    def rebuild_indices(self, meta, chunk=1000):
+        return self.execute(self._rebuild_indices(meta, chunk))
+
+    def _rebuild_indices(self, meta, chunk):
+        # Each script call indexes a chunk of a snapshot of the id set
+        # stored by the first call.
+        meta_info = json.dumps(self.meta(meta))
+        encoding = self.client.encoding
+        snapshot = (self.tempkey(meta),)
+        start, total, failures = 0, 0, []
+        for idx in meta.indices:
+            if not idx.unique:
+                yield self._index_registry(meta, idx.attname, chunk)
+        while True:
+            count, errors, indexed = yield self.odmrun(
+                self.client, 'reindex', meta, snapshot, meta_info, start,
+                chunk, self.build_expire)
+            failures.extend(((decode(id, encoding), decode(e, encoding))
+                             for id, e in errors))
+            start += count
+            total += indexed
+            if count < chunk:
+                break
+        yield total, failures
+
+    def _index_registry(self, meta, field, chunk):
+        # Index keys of a non unique field missing from the registry of its
+        # values, for example written before the registry existed, are found
+        # with SCAN, chunk keys at a time, and added to the registry.
+        client = self.client
+        prefix = self.basekey(meta, 'idx', field, '')
+        pattern = ''.join(('\\' + c if c in '*?[]\\' else c for c in prefix))
+        prefix = to_bytes(prefix, client.encoding)
+        registry = prefix[:-1]
+        cursor = 0
+        while True:
+            cursor, keys = yield client.execute_command(
+                'SCAN', cursor, 'MATCH', pattern + '*', 'COUNT', chunk)
+            if keys:
+                yield client.sadd(registry,
+                                  *[key[len(prefix):] for key in keys])
+            if int(cursor) == 0:
+                break
+
+    def build_index(self, meta, field, chunk=1000, throttle=0, compare=False,
+                    swap=True):
+        return self.execute(self._build_index(meta, field, chunk, throttle,
+                                              compare, swap))
+
+    def _build_index(self, meta, field, chunk, throttle, compare, swap):
+        # Chunks page through a snapshot of the id set stored by the first
+        # chunk, then the index is compared and swapped with the shadow a
+        # chunk of values at a time. The snapshot, and the registration of
+        # the shadow which commits update, expire if chunks stop coming.
+        meta_info = json.dumps(self.meta(meta))
+        encoding = self.client.encoding
+        name = field.attname
+        shadow = self.tempkey(meta)
+        snapshot = (self.tempkey(meta),)
+        expire = int(throttle) + self.build_expire
+        start, errors = 0, []
+        if not field.unique:
+            yield self._index_registry(meta, name, chunk)
+        try:
+            while True:
+                count, conflicts = yield self.odmrun(
+                    self.client, 'build_index', meta, snapshot, meta_info,
+                    name, shadow, start, chunk, expire)
+                errors.extend(conflicts)
+                start += count
+                if count < chunk:
+                    break
+                yield self._throttle(throttle)
+            if compare or swap:
+                diff = yield self._swap_index(meta, meta_info, field, shadow,
+                                              chunk, throttle, expire,
+                                              compare, swap)
+                errors.extend(diff)
+        except Exception:
+            # remove the shadow keys and the snapshot
+            error = sys.exc_info()
+            yield self._end_index(meta, meta_info, field, shadow, snapshot,
+                                  chunk)
+            raise_error_trace(error[1], error[2])
+        yield self._end_index(meta, meta_info, field, shadow, snapshot, chunk)
+        yield [index_error(meta.model, name, decode(value, encoding),
+                           decode(id, encoding), decode(error, encoding))
+               for value, id, error in errors]
+
+    def _swap_index(self, meta, meta_info, field, shadow, chunk, throttle,
+                    expire, compare, swap):
+        # The values of the shadow are compared and swapped first, then the
+        # values of the index which are not in the shadow.
+        name = field.attname
+        if field.unique:
+            command, index = 'HSCAN', self.basekey(meta, 'uni', name)
+        else:
+            command, index = 'SSCAN', self.basekey(meta, 'idx', name)
+        diff, seen = [], set()
+        for live, key in enumerate((shadow, index)):
+            cursor = 0
+            while True:
+                cursor, values = yield self.client.execute_command(
+                    command, key, cursor, 'COUNT', chunk)
+                if field.unique:
+                    values = values[::2]
+                if values:
+                    result = yield self.odmrun(
+                        self.client, 'swap_index', meta, (), meta_info, name,
+                        shadow, live, '1' if compare else '0',
+                        '1' if swap else '0', expire, *values)
+                    # scans can return a value more than once
+                    for entry in result:
+                        entry = tuple(entry)
+                        if entry not in seen:
+                            seen.add(entry)
+                            diff.append(entry)
+                if int(cursor) == 0:
+                    break
+                yield self._throttle(throttle)
+        yield diff
+
+    def _end_index(self, meta, meta_info, field, shadow, snapshot, chunk):
+        # Commits stop updating the shadow keys which are removed a chunk
+        # at a time.
+        client = self.client
+        yield self.odmrun(client, 'end_index', meta, snapshot, meta_info,
+                          field.attname, shadow)
+        prefix = to_bytes(shadow + ':', client.encoding)
+        cursor = 0
+        while True:
+            if field.unique:
+                cursor, values = yield client.execute_command(
+                    'HSCAN', shadow, cursor, 'COUNT', chunk)
+                if values:
+                    yield client.hdel(shadow, *values[::2])
+            else:
+                cursor, values = yield client.execute_command(
+                    'SSCAN', shadow, cursor, 'COUNT', chunk)
+                if values:
+                    yield client.delete(*[prefix + v for v in values])
+            if int(cursor) == 0:
+                break
+        yield client.delete(shadow)
+
+    def _throttle(self, throttle):
+        if throttle:
+            if self.is_async():
+                return async_sleep(throttle)
+            time.sleep(throttle)
+
+    def changes(self, offset=0, count=100):
+        key = self.changelog_key
+        return self.client.execute_script('changelog_read',
+                                          (key, key + ':seq'), offset, count)
+
+    def changes_offset(self, consumer):
+        return self.execute(self.client.hget(self.changelog_key + ':offsets',
+                                             consumer),
+                            lambda r: int(r or 0))
+
+    def ack_changes(self, consumer, offset):
+        return self.client.hset(self.changelog_key + ':offsets', consumer,
+                                offset)
+
     def odmrun(self, client, odm_command, meta, keys, meta_info,
                *args, **options):
         options.update({'backend': self, 'meta': meta,
@@ -766,7 +1174,8 @@ class BackendDataServer(stdnet.BackendDataServer):
                                      *args, **options)
 
     def where_run(self, client, meta_info, keys, where, load_only):
-        where = read_lua_file('where', context={'where_clause': where})
+        where = read_lua_file('objects') + read_lua_file(
+            'where', context={'where_clause': where})
         numkeys = len(keys)
         keys.append(meta_info)
         if load_only:
@@ -785,7 +1194,10 @@ class BackendDataServer(stdnet.BackendDataServer):
                 delquery = sm.deletes.backend_query(pipe=pipe)
             self.accumulate_delete(pipe, delquery)
             if sm.dirty:
-                meta_info = json.dumps(self.meta(meta))
+                info = self.meta(meta)
+                if sm.bulk:
+                    info['bulk'] = True
+                meta_info = json.dumps(info)
                 lua_data = [len(sm.dirty)]
                 processed = []
                 for instance in sm.dirty:
@@ -811,37 +1223,87 @@ class BackendDataServer(stdnet.BackendDataServer):
                     processed.append(state.iid)
                 self.odmrun(pipe, 'commit', meta, (), meta_info,
                             *lua_data, iids=processed)
-        return pipe.execute()
+        return self.execute(self._execute_pipe(pipe))
+
+    def _execute_pipe(self, pipe):
+        # Execute the session pipeline and the remaining chunks of cascade
+        # deletes
+        results = []
+        response = yield pipe.execute()
+        for result in response:
+            if not isinstance(result, cascade_result):
+                results.append(result)
+                continue
+            deleted = OrderedDict()
+            while isinstance(result, cascade_result):
+                for meta, res in result.results:
+                    deleted.setdefault(meta, []).extend(res)
+                if not result.remaining:
+                    break
+                meta = result.metas[0]
+                result = yield self.odmrun(
+                    self.client, 'cascade_delete', meta, (),
+                    json.dumps(self.meta(meta)), json.dumps(result.graph),
+                    self.delete_chunk, graph=result.graph,
+                    metas=result.metas)
+            else:
+                results.append(result)
+            results.extend((session_result(meta, res)
+                            for meta, res in deleted.items()))
+        yield results
 
     def accumulate_delete(self, pipe, backend_query):
-        # Accumulate models queries for a delete. It loops through the
-        # related models to build related queries.
+        # Delete a query and the instances related to it in a single script.
         # We pass the pipe since the backend_query may have been evaluated
         # using a different pipe
         if backend_query is None:
             return
-        session = backend_query.session
-        query = backend_query.queryelem
-        keys = (backend_query.query_key,)
-        meta_info = backend_query.meta_info
-        meta = query.meta
-        rel_managers = []
-        for name in meta.related:
-            rmanager = getattr(meta.model, name)
-            # the related manager model is the same as current model
-            if rmanager.model == meta.model:
-                self.odmrun(pipe, 'aggregate', meta, keys, meta_info,
-                            rmanager.field.attname)
-            # only consider models which are registered with the router
-            elif rmanager.model in session.router:
-                rel_managers.append(rmanager)
-        # loop over related managers
-        for rmanager in rel_managers:
-            # IMPORTANT. delete only if field is required
-            if rmanager.field.required:
-                rq = rmanager.query_from_query(query).backend_query(pipe=pipe)
-                self.accumulate_delete(pipe, rq)
-        self.odmrun(pipe, 'delete', meta, keys, meta_info)
+        meta = backend_query.meta
+        graph, metas = self.cascade_graph(meta, backend_query.session.router)
+        # sets of pending ids expire if a cascade is aborted
+        graph['expire'] = backend_query.expire
+        if backend_query.queryelem.data.get('expired'):
+            graph['expired'] = True
+        self.odmrun(pipe, 'cascade_delete', meta, (backend_query.query_key,),
+                    backend_query.meta_info, json.dumps(graph),
+                    self.delete_chunk, graph=graph, metas=metas)
+
+    def cascade_graph(self, meta, router):
+        '''The graph of models whose instances are deleted together with
+instances of ``meta``. Instances of a related model are deleted when their
+foreign key is required and the model is registered with ``router``.
+Instances related via a foreign key to their own model are always deleted.
+A :class:`stdnet.FieldError` is raised when one of these foreign keys is not
+an index, since their instances could not be found.
+
+:return: a two elements tuple with the graph used by the ``cascade_delete``
+    lua script and the list of model metadata in the graph.'''
+        metas, nodes = [], []
+
+        def visit(meta):
+            if meta in metas:
+                return metas.index(meta) + 1
+            metas.append(meta)
+            index = len(metas)
+            node = {'meta': self.meta(meta), 'related': []}
+            nodes.append(node)
+            for name in meta.related:
+                rmanager = getattr(meta.model, name)
+                field = rmanager.field
+                if rmanager.model != meta.model and not (
+                        field.required and rmanager.model in router):
+                    continue
+                # instances can be found via the index of the field only
+                if not field.index:
+                    raise FieldError('Cannot delete %s instances. %s is not '
+                                     'an index.' % (meta, field))
+                node['related'].append(
+                    {'model': visit(rmanager.model._meta),
+                     'field': field.attname})
+            return index
+        visit(meta)
+        pending = [self.tempkey(m) for m in metas]
+        return {'models': nodes, 'pending': pending}, metas
 
     def tempkey(self, meta, name=None):
         return self.basekey(meta, TMP, name if name is not None else
@@ -861,7 +1323,10 @@ class BackendDataServer(stdnet.BackendDataServer):
 
     def instance_keys(self, obj):
         meta = obj._meta
-        keys = [self.basekey(meta, OBJ, obj.pkvalue())]
+        if meta.bucket:
+            keys = [self.basekey(meta, 'pk', int(obj.pkvalue())//meta.bucket)]
+        else:
+            keys = [self.basekey(meta, OBJ, obj.pkvalue())]
         for field in meta.multifields:
             f = getattr(obj, field.attname)
             be = self.structure(f)
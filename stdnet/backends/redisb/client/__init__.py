@@ -14,13 +14,15 @@ __all__ = ['redis_client', 'RedisScript', 'read_lua_file', 'RedisError',
 
 
 def redis_client(address=None, connection_pool=None, timeout=None,
-                 parser=None, **kwargs):
+                 parser=None, autopipeline=None, **kwargs):
     '''Get a new redis client.
 
     :param address: a ``host``, ``port`` tuple.
     :param connection_pool: optional connection pool.
     :param timeout: socket timeout.
-    :param timeout: socket timeout.
+    :param autopipeline: optional time window, in milliseconds, used to
+        coalesce commands issued concurrently into pipelines. Available for
+        synchronous clients only.
     '''
     if not connection_pool:
         if timeout == 0:
@@ -30,6 +32,9 @@ def redis_client(address=None, connection_pool=None, timeout=None,
             return async.pool.redis(address, **kwargs)
         else:
             kwargs['socket_timeout'] = timeout
-            return Redis(address[0], address[1], **kwargs)
+            client = Redis(address[0], address[1], **kwargs)
     else:
-        return Redis(connection_pool=connection_pool)
+        client = Redis(connection_pool=connection_pool)
+    if autopipeline:
+        client = client.autopipeline(0.001*float(autopipeline))
+    return client
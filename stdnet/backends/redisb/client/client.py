@@ -29,10 +29,19 @@ import io
 import socket
 from copy import copy
 
-from .extensions import RedisExtensionsMixin, redis, BasePipeline
+from .extensions import (RedisExtensionsMixin, CommandCollector, redis,
+                         BasePipeline)
 from .prefixed import PrefixedRedisMixin
 
 
+# Commands which depend on the state of the connection they are sent with
+# and therefore can't be coalesced by a CommandCollector
+CONNECTION_COMMANDS = frozenset(('WATCH', 'UNWATCH', 'MULTI', 'EXEC',
+                                 'DISCARD', 'BLPOP', 'BRPOP', 'BRPOPLPUSH',
+                                 'SUBSCRIBE', 'PSUBSCRIBE', 'UNSUBSCRIBE',
+                                 'PUNSUBSCRIBE', 'MONITOR', 'SELECT', 'QUIT'))
+
+
 class Redis(RedisExtensionsMixin, redis.StrictRedis):
 
     @property
@@ -54,6 +63,17 @@ class Redis(RedisExtensionsMixin, redis.StrictRedis):
             transaction,
             shard_hint)
 
+    def autopipeline(self, window=0.001, max_size=1000):
+        client = Redis(connection_pool=self.connection_pool)
+        client.collector = CommandCollector(self, window, max_size)
+        return client
+
+    def execute_command(self, *args, **options):
+        collector = self.collector
+        if collector is not None and args[0] not in CONNECTION_COMMANDS:
+            return collector(*args, **options)
+        return super(Redis, self).execute_command(*args, **options)
+
 
 class PrefixedRedis(PrefixedRedisMixin, Redis):
     pass
@@ -1,4 +1,5 @@
 import os
+import threading
 from hashlib import sha1
 from collections import namedtuple
 from datetime import datetime
@@ -94,10 +95,94 @@ def dict_update(original, data):
     return target
 
 
+class PendingCommand(object):
+    '''A command waiting to be sent to the server by a
+    :class:`CommandCollector`.'''
+    __slots__ = ('args', 'options', 'response', 'done')
+
+    def __init__(self, args, options):
+        self.args = args
+        self.options = options
+        self.response = None
+        self.done = threading.Event()
+
+    def set_response(self, response):
+        self.response = response
+        self.done.set()
+
+    def result(self):
+        self.done.wait()
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class CommandCollector(object):
+    '''Coalesce commands issued concurrently on a client into pipelines.
+
+    The first caller to arrive becomes the leader: it waits for ``window``
+    seconds (or until ``max_size`` commands are pending), takes all commands
+    issued in the meantime by other callers and sends them to the server as
+    one non-transactional pipeline. Each reply is routed back to the caller
+    which issued the command, exceptions included.
+
+    :param client: the :class:`Redis` client sending the pipelines.
+    :param window: time window in seconds used to collect commands.
+    :param max_size: maximum number of commands in one pipeline.
+    '''
+    def __init__(self, client, window=0.001, max_size=1000):
+        self.client = client
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._leader = False
+        self._condition = threading.Condition()
+
+    def __call__(self, *args, **options):
+        command = PendingCommand(args, options)
+        batch = None
+        with self._condition:
+            self._pending.append(command)
+            if self._leader:
+                if len(self._pending) >= self.max_size:
+                    self._condition.notify()
+            else:
+                self._leader = True
+                if len(self._pending) < self.max_size:
+                    self._condition.wait(self.window)
+                batch, self._pending = self._pending, []
+                self._leader = False
+        if batch:
+            self.flush(batch)
+        return command.result()
+
+    def flush(self, batch):
+        '''Send a ``batch`` of :class:`PendingCommand` to the server.'''
+        client = self.client
+        if len(batch) == 1:
+            command = batch[0]
+            try:
+                responses = [client.execute_command(*command.args,
+                                                    **command.options)]
+            except Exception as e:
+                responses = [e]
+        else:
+            pipe = client.pipeline(transaction=False)
+            for command in batch:
+                pipe.execute_command(*command.args, **command.options)
+            try:
+                responses = pipe.execute(raise_on_error=False)
+            except Exception as e:
+                responses = [e]*len(batch)
+        for command, response in zip(batch, responses):
+            command.set_response(response)
+
+
 class RedisExtensionsMixin(object):
     '''Extension for Redis clients.
     '''
     prefix = ''
+    collector = None
     RESPONSE_CALLBACKS = dict_update(
         redis.StrictRedis.RESPONSE_CALLBACKS,
         {'EVALSHA': script_callback,
@@ -117,6 +202,20 @@ class RedisExtensionsMixin(object):
         '''
         raise NotImplementedError
 
+    def autopipeline(self, window=0.001, max_size=1000):
+        '''Return a new client which coalesces commands into pipelines.
+
+        Commands issued concurrently, from different threads, on the
+        returned client are collected by a :class:`CommandCollector` and sent
+        to the server in one round trip. Commands which hold server-side
+        connection state (transactions, blocking pops, publish/subscribe)
+        bypass the collector.
+
+        :param window: time window in seconds used to collect commands.
+        :param max_size: maximum number of commands in one pipeline.
+        '''
+        raise NotImplementedError
+
     def execute_script(self, name, keys, *args, **options):
         '''Execute a registered lua script at ``name``.
 
@@ -0,0 +1,279 @@
+--[[
+Storage of model instances. An instance is either a hash at
+namespace:obj:id, with a hash field for each model field, or, for models
+with packed storage, a single MessagePack value. Packed values are strings
+at namespace:obj:id or, when instances are grouped in buckets of ids,
+fields of the hash namespace:pk:n containing the ids from n*bucket to
+(n+1)*bucket-1.
+
+The layout of packed instances is stored in the hash namespace:layout. It
+assigns a position to each field name when the field is first stored, so
+that adding fields to a model does not change the position of the others.
+A packed value is the array
+    {N, v_1, ..., v_N, name_1, value_1, ...}
+where v_i is the value of the field at position i, false when missing,
+followed by the pairs of names and values of fields not in the layout.
+--]]
+local objects = {
+    layouts = {},   -- layouts loaded from redis, false for hashes
+    models = {}     -- packed metadata of models committing instances
+}
+--
+-- Register the packed metadata of the model with namespace bk. Fields are
+-- added to the stored layout when instances are saved.
+objects.register = function (bk, packed)
+    objects.models[bk] = packed
+end
+--
+-- The layout of packed instances of namespace bk or false for hashes
+objects.layout = function (bk)
+    local layout = objects.layouts[bk]
+    if layout == nil then
+        local bucket, fields = unpack(redis.call('hmget', bk .. ':layout',
+                                                 'bucket', 'fields'))
+        layout = false
+        if bucket then
+            layout = objects._layout(bucket + 0, cjson.decode(fields))
+        end
+        objects.layouts[bk] = layout
+    end
+    return layout
+end
+--
+-- The key storing instance id
+objects.key = function (bk, id, layout)
+    if layout and layout.bucket > 0 then
+        local n = tonumber(id)
+        if not n then
+            error('Packed buckets require numeric ids, got "' .. id .. '".')
+        end
+        return bk .. ':pk:' .. math.floor(n / layout.bucket)
+    end
+    return bk .. ':obj:' .. id
+end
+--
+-- Check if instance id exists
+objects.exists = function (bk, id)
+    local layout = objects.layout(bk)
+    if layout and layout.bucket > 0 then
+        return redis.call('hexists', objects.key(bk, id, layout), id) + 0 == 1
+    end
+    return redis.call('exists', objects.key(bk, id, layout)) + 0 == 1
+end
+--
+-- Value of field of instance id, false when not available
+objects.get = function (bk, id, field)
+    local layout = objects.layout(bk)
+    if layout then
+        return objects._load(bk, id, layout)[field] or false
+    end
+    return redis.call('hget', objects.key(bk, id), field)
+end
+--
+-- Array of values of fields of instance id
+objects.hmget = function (bk, id, fields)
+    local layout = objects.layout(bk)
+    if layout then
+        local data, values = objects._load(bk, id, layout), {}
+        for i, field in ipairs(fields) do
+            values[i] = data[field] or false
+        end
+        return values
+    end
+    return redis.call('hmget', objects.key(bk, id), unpack(fields))
+end
+--
+-- Flat array of field names and values of instance id
+objects.getall = function (bk, id)
+    local layout = objects.layout(bk)
+    if layout then
+        local values = {}
+        for field, value in pairs(objects._load(bk, id, layout)) do
+            table.insert(values, field)
+            table.insert(values, value)
+        end
+        return values
+    end
+    return redis.call('hgetall', objects.key(bk, id))
+end
+--
+-- Set fields of instance id from a flat array of field names and values
+objects.set = function (bk, id, data)
+    local layout = objects._write_layout(bk)
+    if layout then
+        local values = objects._load(bk, id, layout)
+        for i = 1, # data, 2 do
+            values[data[i]] = data[i+1]
+        end
+        objects._store(bk, id, layout, values)
+    else
+        redis.call('hmset', objects.key(bk, id), unpack(data))
+    end
+end
+--
+-- Remove field from instance id
+objects.hdel = function (bk, id, field)
+    local layout = objects._write_layout(bk)
+    if layout then
+        local values = objects._load(bk, id, layout)
+        if values[field] then
+            values[field] = nil
+            objects._store(bk, id, layout, values)
+        end
+    else
+        redis.call('hdel', objects.key(bk, id), field)
+    end
+end
+--
+-- Increment the numeric field of instance id by the amount by
+objects.incr = function (bk, id, field, by, float)
+    local layout = objects._write_layout(bk)
+    if layout then
+        local values = objects._load(bk, id, layout)
+        local value = (tonumber(values[field]) or 0) + by
+        values[field] = objects._tostring(value)
+        objects._store(bk, id, layout, values)
+        return float and values[field] or value
+    elseif float then
+        return redis.call('hincrbyfloat', objects.key(bk, id), field, by)
+    else
+        return redis.call('hincrby', objects.key(bk, id), field, by)
+    end
+end
+--
+-- Delete instance id. Return the number of instances removed
+objects.del = function (bk, id)
+    local layout = objects.layout(bk)
+    if layout and layout.bucket > 0 then
+        return redis.call('hdel', objects.key(bk, id, layout), id) + 0
+    end
+    return redis.call('del', objects.key(bk, id, layout)) + 0
+end
+--
+--          INTERNAL FUNCTIONS
+--
+objects._layout = function (bucket, fields)
+    local positions = {}
+    for i, name in ipairs(fields) do
+        positions[name] = i
+    end
+    return {bucket = bucket, fields = fields, positions = positions,
+            numeric = {}}
+end
+--
+-- The layout used to save instances. Fields of the registered model are
+-- added to the stored layout, the first time only.
+objects._write_layout = function (bk)
+    local packed, layout = objects.models[bk], objects.layout(bk)
+    if packed and not packed.registered then
+        local fields, changed = {}, not layout
+        packed.registered = true
+        if layout then
+            if layout.bucket ~= packed.bucket then
+                error('Cannot change the bucket size of packed instances "' ..
+                      bk .. '".')
+            end
+            fields = layout.fields
+        end
+        for _, name in ipairs(packed.fields) do
+            if not (layout and layout.positions[name]) then
+                table.insert(fields, name)
+                changed = true
+            end
+        end
+        if changed then
+            redis.call('hmset', bk .. ':layout', 'bucket', packed.bucket,
+                       'fields', cjson.encode(fields))
+        end
+        layout = objects._layout(packed.bucket, fields)
+        for _, name in ipairs(packed.numeric) do
+            layout.numeric[name] = true
+        end
+        objects.layouts[bk] = layout
+    end
+    return layout
+end
+--
+-- Table of field values of packed instance id
+objects._load = function (bk, id, layout)
+    local key, data, value = objects.key(bk, id, layout), {}
+    if layout.bucket > 0 then
+        value = redis.call('hget', key, id)
+    else
+        value = redis.call('get', key)
+    end
+    if value then
+        local values = cmsgpack.unpack(value)
+        local n = values[1]
+        for i = 1, n do
+            if values[i+1] then
+                data[layout.fields[i]] = objects._tostring(values[i+1])
+            end
+        end
+        for i = n + 2, # values, 2 do
+            data[values[i]] = objects._tostring(values[i+1])
+        end
+    end
+    return data
+end
+--
+-- Pack the table of field values of instance id
+objects._store = function (bk, id, layout, data)
+    local values, n, value = {0}, 0
+    for i, name in ipairs(layout.fields) do
+        value = data[name]
+        if value then
+            n = i
+            if layout.numeric[name] then
+                value = objects._tonumber(value)
+            end
+            values[i+1] = value
+        else
+            values[i+1] = false
+        end
+    end
+    -- missing fields at the end are not stored
+    for i = # values, n + 2, -1 do
+        values[i] = nil
+    end
+    values[1] = n
+    for name, value in pairs(data) do
+        if not layout.positions[name] then
+            table.insert(values, name)
+            table.insert(values, value)
+        end
+    end
+    value = cmsgpack.pack(values)
+    if layout.bucket > 0 then
+        redis.call('hset', objects.key(bk, id, layout), id, value)
+    else
+        redis.call('set', objects.key(bk, id, layout), value)
+    end
+end
+--
+-- Convert a string into a number when the number converts back to the
+-- same string, so that packing does not change values.
+objects._tonumber = function (value)
+    local number = tonumber(value)
+    if number and objects._tostring(number) == value then
+        return number
+    end
+    return value
+end
+--
+-- The shortest string representation of a number
+objects._tostring = function (value)
+    if type(value) ~= 'number' then
+        return value
+    elseif value == math.floor(value) and math.abs(value) < 2^53 then
+        return string.format('%d', value)
+    end
+    local s
+    for precision = 15, 17 do
+        s = string.format('%.' .. precision .. 'g', value)
+        if tonumber(s) == value then
+            break
+        end
+    end
+    return s
+end
@@ -50,6 +50,10 @@ odm.Model = {
         self.meta = tabletools.json_clean(meta)
         self.idset = self.meta.namespace .. ':id'    -- key for set containing all ids
         self.auto_ids = self.meta.namespace .. ':ids' -- key for auto ids
+        self.shadows = false -- shadow indices being built, loaded when needed
+        if self.meta.packed then
+            objects.register(self.meta.namespace, self.meta.packed)
+        end
         return self
     end,
     --[[
@@ -113,27 +117,308 @@ odm.Model = {
         end
         return self:setsize(destkey)
     end,
+    --[[
+        Number of ids in key which have not expired
+    --]]
+    count = function (self, key)
+        local size = self:setsize(key)
+        for _, id in ipairs(self:_expired()) do
+            if self.meta.sorted then
+                if odm.redis.call('zscore', key, id) then
+                    size = size - 1
+                end
+            elseif odm.redis.call('sismember', key, id) + 0 == 1 then
+                size = size - 1
+            end
+        end
+        return size
+    end,
+    --[[
+        Increment the numeric field of instance id by the amount by and
+        return the new value. Indices are updated only when the field is
+        indexed or, if ordered is true, when it is the ordering field.
+    --]]
+    incr = function (self, id, field, by, float, ordered)
+        if not objects.exists(self.meta.namespace, id) then
+            return false
+        end
+        local reindex, value = ordered or self.meta.indices[field] ~= nil
+        for _, index in ipairs(self.meta.sort_indexes or {}) do
+            if index.field == field then
+                reindex = true
+            end
+        end
+        if reindex then
+            self:_update_indices(false, id)
+        end
+        value = objects.incr(self.meta.namespace, id, field, by, float)
+        if reindex then
+            local score = 0
+            if ordered then
+                score = value
+                odm.redis.call('zadd', self.idset, score, id)
+                if self.meta.cap then
+                    odm.redis.call('zadd', self:_cap_key(id), score, id)
+                end
+            elseif self.meta.sorted then
+                score = odm.redis.call('zscore', self.idset, id)
+            end
+            self:_update_indices(true, id, id, score)
+        end
+        self:_update_sort_dependents(id, field)
+        if self.meta.changelog then
+            self:_log_change('update', id, {field})
+        end
+        return value
+    end,
+    --[[
+        Rebuild the indices of count instances starting at position start
+        of snapshot, a list of the ids sorted alphabetically stored when start
+        is 0. When start is 0 all indices are removed first. The snapshot
+        expires after expire seconds unless refreshed by the next chunk.
+        Instances violating a unique constraint are deleted, the instance
+        with the lowest id in alphabetical order is kept.
+        @return an array containing the number of ids processed, an array
+            of {id, error} pairs and the number of instances indexed
+    --]]
+    reindex = function (self, snapshot, start, count, expire)
+        if start == 0 then
+            self:_clear_indices()
+            odm.redis.call('sort', self.idset, 'alpha', 'store', snapshot)
+        end
+        odm.redis.call('expire', snapshot, expire)
+        local ids = odm.redis.call('lrange', snapshot, start, start + count - 1)
+        local failures, indexed, errors, score = {}, 0
+        for _, id in ipairs(ids) do
+            -- instances deleted after the snapshot was stored are skipped
+            if self:has_id(id) then
+                score = 0
+                if self.meta.sorted then
+                    score = odm.redis.call('zscore', self.idset, id)
+                end
+                errors = self:_update_indices(true, id, id, score)
+                if # errors > 0 then
+                    self:_delete_instance(id)
+                    table.insert(failures, {id, errors[1]})
+                else
+                    indexed = indexed + 1
+                end
+            end
+        end
+        if # ids < count then
+            odm.redis.call('del', snapshot)
+        end
+        return {# ids, failures, indexed}
+    end,
+    --[[
+        Build the index of field into shadow keys for count instances starting
+        at position start of snapshot, a list of the ids sorted
+        alphabetically stored when start is 0. When start is 0 the shadow is also registered so that commits
+        update it as well. The registration and the snapshot expire after
+        expire seconds unless refreshed by the next chunk.
+        @return an array containing the number of ids processed and
+            an array of {value, id, 'unique'} for unique constraint conflicts
+    --]]
+    build_index = function (self, field, shadow, snapshot, start, count, expire)
+        local unique, conflicts = self.meta.indices[field], {}
+        local building = self:_building_key()
+        if start == 0 then
+            odm.redis.call('hset', building, field, shadow)
+            odm.redis.call('sort', self.idset, 'alpha', 'store', snapshot)
+        elseif odm.redis.call('hget', building, field) ~= shadow then
+            error('The index of "' .. field .. '" is no longer being built.')
+        end
+        odm.redis.call('expire', building, expire)
+        odm.redis.call('expire', snapshot, expire)
+        local ids = odm.redis.call('lrange', snapshot, start, start + count - 1)
+        for _, id in ipairs(ids) do
+            -- instances deleted after the snapshot was stored are skipped
+            if self:has_id(id) then
+                local value = self:field_value(id, field)
+                if unique then
+                    if value and odm.redis.call('hsetnx', shadow, value, id) + 0 == 0 then
+                        local stored_id = odm.redis.call('hget', shadow, value)
+                        if stored_id ~= id then
+                            table.insert(conflicts, {value, id, 'unique'})
+                        end
+                    end
+                else
+                    local score = 0
+                    if self.meta.sorted then
+                        score = odm.redis.call('zscore', self.idset, id)
+                    end
+                    self:setadd(shadow .. ':' .. (value or ''), score, id)
+                    odm.redis.call('sadd', shadow, value or '')
+                end
+            end
+        end
+        return {# ids, conflicts}
+    end,
+    --[[
+        Compare and swap the index of field with the shadow built by
+        build_index for the given values, which are keys of the shadow when
+        live is false, otherwise keys of the index. For non unique indices
+        they are the values of the shadow set and of the registry. Values of
+        the index also in the shadow are skipped, they are handled with the
+        shadow ones. If compare is true returns an array of
+        {value, id, problem} where problem is 'missing' for entries of the
+        shadow not in the index and 'stale' for entries of the index not in
+        the shadow. If swap is true the index entries of the values are
+        replaced by the shadow ones. Commits update both the index and the
+        shadow until end_index is called so that the index can be swapped a
+        chunk of values at a time.
+    --]]
+    swap_index = function (self, field, shadow, live, compare, swap, expire, values)
+        local unique, diff = self.meta.indices[field], {}
+        local building = self:_building_key()
+        if odm.redis.call('hget', building, field) ~= shadow then
+            error('The index of "' .. field .. '" is no longer being built.')
+        end
+        odm.redis.call('expire', building, expire)
+        if unique then
+            local idxkey = self:map_key(field)
+            for _, value in ipairs(values) do
+                local built = odm.redis.call('hget', shadow, value)
+                local id = odm.redis.call('hget', idxkey, value)
+                if not (live and built) and built ~= id then
+                    if compare then
+                        if built then
+                            table.insert(diff, {value, built, 'missing'})
+                        end
+                        if id then
+                            table.insert(diff, {value, id, 'stale'})
+                        end
+                    end
+                    if swap then
+                        if built then
+                            odm.redis.call('hset', idxkey, value, built)
+                        else
+                            odm.redis.call('hdel', idxkey, value)
+                        end
+                    end
+                end
+            end
+        else
+            local registry = self:index_registry(field)
+            for _, value in ipairs(values) do
+                local built = shadow .. ':' .. value
+                local idxkey = self:index_key(field, value)
+                if odm.redis.call('sismember', shadow, value) + 0 == 0 then
+                    built = nil
+                end
+                if not (live and built) then
+                    if compare then
+                        self:_index_diff(diff, value,
+                                         built and self:_members(built) or {},
+                                         self:_members(idxkey))
+                    end
+                    if swap then
+                        odm.redis.call('del', idxkey)
+                        if built and odm.redis.call('exists', built) + 0 == 1 then
+                            if self.meta.sorted then
+                                odm.redis.call('zunionstore', idxkey, 1, built)
+                            else
+                                odm.redis.call('sunionstore', idxkey, built)
+                            end
+                            odm.redis.call('sadd', registry, value)
+                        else
+                            odm.redis.call('srem', registry, value)
+                        end
+                    end
+                end
+            end
+        end
+        return diff
+    end,
+    --[[
+        Finish building the index of field into shadow. Commits stop
+        updating the shadow, which can then be removed, and the snapshot of
+        ids is removed.
+    --]]
+    end_index = function (self, field, shadow, snapshot)
+        local building = self:_building_key()
+        if odm.redis.call('hget', building, field) == shadow then
+            odm.redis.call('hdel', building, field)
+        end
+        odm.redis.call('del', snapshot)
+    end,
     --[[
         Delete a query stored in key id
     --]]
     delete = function (self, key)
         local ids, results = redis_members(key), {}
         for _, id in ipairs(ids) do
-            local idkey = self:object_key(id)
-            self:_update_indices(false, id)
-            local num = odm.redis.call('del', idkey) + 0
-            self:remove_from_set(self.idset, id)
-            if self.meta.multi_fields then
-                for _, name in ipairs(self.meta.multi_fields) do
-                    odm.redis.call('del', idkey .. ':' .. name)
-                end
-            end
-            if num == 1 then
+            if self:_delete_instance(id) then
                 table.insert(results, id)
             end
         end
         return results
     end,
+    --[[
+        Delete, together with the instances related to them, the ids
+        stored in key.
+        :param key: the query key, only given to the first call.
+        :param graph: table with the array of models metadata, each with the
+            related fields pointing to it, and the array of keys of the sets
+            of ids waiting to be deleted for each model.
+        :param limit: maximum number of instances deleted by this call.
+        @return an array containing the number of instances still pending
+            and the array of deleted ids for each model.
+    --]]
+    cascade_delete = function (self, key, graph, limit)
+        local models, pending, results, count = {}, graph.pending, {}, 0
+        for i, node in ipairs(graph.models) do
+            models[i] = setmetatable({}, {__index = odm.Model}):init(node.meta)
+            results[i] = {}
+        end
+        if key ~= '' then
+            local ids = redis_members(key)
+            if graph.expired then
+                -- instances refreshed after the query was built are kept
+                local unexpired = {}
+                for _, id in ipairs(models[1]:_unexpired(ids)) do
+                    unexpired[id] = true
+                end
+                for _, id in ipairs(ids) do
+                    if not unexpired[id] then
+                        odm.redis.call('sadd', pending[1], id)
+                    end
+                end
+            else
+                for _, id in ipairs(ids) do
+                    odm.redis.call('sadd', pending[1], id)
+                end
+            end
+        end
+        for i, node in ipairs(graph.models) do
+            while count < limit do
+                local id = odm.redis.call('spop', pending[i])
+                if not id then
+                    break
+                end
+                -- instances related via a required foreign key go as well
+                for _, rel in ipairs(node.related) do
+                    local rids = models[rel.model]:_related_ids(rel.field, id)
+                    for _, rid in ipairs(rids) do
+                        odm.redis.call('sadd', pending[rel.model], rid)
+                    end
+                end
+                if models[i]:_delete_instance(id) then
+                    table.insert(results[i], id)
+                end
+                count = count + 1
+            end
+        end
+        local remaining, size = 0
+        for _, pkey in ipairs(pending) do
+            size = odm.redis.call('scard', pkey) + 0
+            if size > 0 and graph.expire then
+                odm.redis.call('expire', pkey, graph.expire)
+            end
+            remaining = remaining + size
+        end
+        return {remaining, results}
+    end,
     --[[
     --]]
     aggregate = function (self, destkey, field)
@@ -143,6 +428,30 @@ odm.Model = {
             self:_aggregate(destkey, id, field, processed)
         end
     end,
+    --[[
+        Store in destkey the ids in key which have not expired or, when
+        expired is true, the ids which have expired. destkey can be key.
+    --]]
+    expiry = function (self, destkey, key, expired)
+        local zset = odm.redis.call('type', key)['ok'] == 'zset'
+        if destkey ~= key then
+            odm.redis.call('del', destkey)
+            if zset then
+                odm.redis.call('zunionstore', destkey, 1, key)
+            else
+                odm.redis.call('sunionstore', destkey, key)
+            end
+        end
+        local rem, ids = zset and 'zrem' or 'srem'
+        if expired then
+            ids = self:_unexpired(redis_members(destkey))
+        else
+            ids = self:_expired()
+        end
+        for _, id in ipairs(ids) do
+            odm.redis.call(rem, destkey, id)
+        end
+    end,
     --[[
         Load instances from ids stored in a query temporary key
         :param key: the key containing the set of ids
@@ -151,10 +460,16 @@ odm.Model = {
     load = function (self, key, options)
         local result, ids, related_items
         options = tabletools.json_clean(options)
-        if options.get and options.get ~= '' then
+        local get = options.get and options.get ~= ''
+        if get and options.get ~= self.meta.id_name then
+            -- key contains the field values
             return redis_members(key)
         elseif options.ordering == 'explicit' then
             ids = self:_explicit_ordering(key, options.start, options.stop, options.order)
+        elseif options.ordering == 'index' then
+            ids = self:_index_ordering(key, options.start, options.stop, options.order)
+        elseif options.ordering == 'seek' then
+            ids = self:_seek_ordering(key, options.order)
         elseif options.ordering == 'DESC' then
             ids = odm.redis.call('zrevrange', key, options.start, options.stop)
         elseif options.ordering == 'ASC' then
@@ -162,6 +477,13 @@ odm.Model = {
         else
             ids = odm.redis.call('smembers', key)
         end
+        if self.meta.expiry then
+            ids = self:_unexpired(ids)
+        end
+        if get then
+            -- the ids in the query order
+            return ids
+        end
         -- Now load fields
         if options.fields and # options.fields > 0 then
             if # options.fields == 1 and options.fields[1] == self.meta.id_name then
@@ -169,13 +491,13 @@ odm.Model = {
             else
                 result = {}
                 for _, id in ipairs(ids) do
-                    table.insert(result, {id, odm.redis.call('hmget', self:object_key(id), unpack(options.fields))})
+                    table.insert(result, {id, objects.hmget(self.meta.namespace, id, options.fields)})
                 end
             end
         else
             result = {}
             for _, id in ipairs(ids) do
-                table.insert(result, {id, odm.redis.call('hgetall', self:object_key(id))})
+                table.insert(result, {id, objects.getall(self.meta.namespace, id)})
             end
         end
         if options.related then
@@ -185,13 +507,31 @@ odm.Model = {
         end
         return {result, related_items}
     end,
+    --[[
+        Store the values of field for the ids in key into the list destkey
+        @return the length of destkey
+    --]]
+    get_field = function (self, destkey, key, field)
+        local ids = redis_members(key)
+        odm.redis.call('del', destkey)
+        for _, id in ipairs(ids) do
+            odm.redis.call('rpush', destkey, self:field_value(id, field) or '')
+        end
+        return odm.redis.call('llen', destkey)
+    end,
     --
     --          INTERNAL METHODS
     --
+    -- Key of instance id hash table and prefix of its structures
     object_key = function (self, id)
         return self.meta.namespace .. ':obj:' .. id
     end,
     --
+    -- Value of field of instance id, false when not available
+    field_value = function (self, id, field)
+        return objects.get(self.meta.namespace, id, field)
+    end,
+    --
     map_key = function (self, field)
         return self.meta.namespace .. ':uni:' .. field
     end,
@@ -204,6 +544,11 @@ odm.Model = {
         return idxkey
     end,
     --
+    -- Key of the set of values with an index key for a non unique field
+    index_registry = function (self, field)
+        return self.meta.namespace .. ':idx:' .. field
+    end,
+    --
     --[[
         A temporary key in the model namespace
     --]]
@@ -357,7 +702,7 @@ odm.Model = {
             -- loop through range selectors
             for _, range in ipairs(ranges) do
                 if # range.nested > 0 then
-                    _, value = self:_nested_field(id, range.nested)
+                    value = self:_nested_field(id, range.nested)
                 else
                     value = id
                 end
@@ -378,7 +723,7 @@ odm.Model = {
     --
     _commit_instance = function (self, action, prev_id, id, score, data)
         -- Commit one instance and update indices
-        local created_id, errors = false, {}
+        local created_id, errors, original_data, capkey = false, {}, {}
         if self.meta.id_type == AUTO_ID then
             if id == '' then
                 created_id = true
@@ -399,29 +744,35 @@ odm.Model = {
         		prev_id = id
         		action = 'add'
         	end
-            local idkey, original_data, field = self:object_key(prev_id), {}
+            local bk = self.meta.namespace
+            if self.meta.cap then
+                capkey = self:_cap_key(prev_id)
+            end
             if action ~= 'add' then  -- override or update
-                original_data = odm.redis.call('hgetall', idkey)
-                -- remove indices
-                self:_update_indices(false, prev_id)
+                original_data = objects.getall(bk, prev_id)
+                -- remove indices, unless loading in bulk
+                if not self.meta.bulk then
+                    self:_update_indices(false, prev_id)
+                end
                 -- when overriding, remove all data from previous hash table
                 -- only if the previous id is the same as the current one.
                 if action == 'override' and prev_id .. '' == id .. '' then
-                    odm.redis.call('del', idkey)
+                    objects.del(bk, prev_id)
                 end
             end
             -- remove previous id from the set of ids
             if id ~= prev_id then
-            	idkey = self:object_key(id)
                 self:remove_from_set(self.idset, prev_id)
             end
             -- Add id to the idset
             score = self:setadd(self.idset, score, id, self.meta.autoincr)
             -- set the new data in the hash table
             if # data > 0 then
-                odm.redis.call('hmset', idkey, unpack(data))
+                objects.set(bk, id, data)
+            end
+            if not self.meta.bulk then
+                errors = self:_update_indices(true, id, prev_id, score)
             end
-            errors = self:_update_indices(true, id, prev_id, score)
             -- An error has occurred. Rollback changes.
             if # errors > 0 then
                 -- Remove indices
@@ -434,8 +785,7 @@ odm.Model = {
                     end
                 elseif # original_data > 0 then
                     id = prev_id
-                    idkey = self:object_key(id)
-                    odm.redis.call('hmset', idkey, unpack(original_data))
+                    objects.set(bk, id, original_data)
                     self:_update_indices(true, id, prev_id, score)
                 end
             end
@@ -443,15 +793,33 @@ odm.Model = {
         if # errors > 0 then
             return {id, 0, errors[1]}
         else
+            self:_update_sort_dependents(id)
+            if self.meta.expiry then
+                if prev_id .. '' ~= id .. '' then
+                    odm.redis.call('zrem', self.meta.expiry, prev_id)
+                end
+                odm.redis.call('zadd', self.meta.expiry, string.format(
+                               '%.17g', self.meta.now + self.meta.ttl), id)
+            end
+            if self.meta.changelog then
+                self:_log_change(action, id,
+                                 self:_changed_fields(action, original_data, data))
+            end
+            -- the oldest instances over the cap are deleted last
+            if self.meta.cap then
+                self:_cap(capkey, prev_id, id, score)
+            end
             return {id, 1, score}
         end
     end,
     --
     _update_indices = function (self, update, id, oldid, score)
-        local idkey, errors, idxkey, value = self:object_key(id), {}
+        local errors, idxkey, value = {}
+        local shadows, shadow = self:_shadow_indices()
         for field, unique in pairs(self.meta.indices) do
             -- obtain the field value
-            value = odm.redis.call('hget', idkey, field)
+            value = self:field_value(id, field)
+            shadow = shadows[field]
             if unique then
                 idxkey = self:map_key(field) -- id for the hash table mapping field value to instance ids
                 if update then
@@ -465,53 +833,169 @@ odm.Model = {
                             if self:has_id(stored_id) then
 	                            -- remove the field from the instance hashtable so that
 	                            -- the next call to _update_indices won't delete the index. Important!
-	                            odm.redis.call('hdel', idkey, field)
+	                            objects.hdel(self.meta.namespace, id, field)
 	                            table.insert(errors, 'Unique constraint "' .. field .. '" violated: "' .. value .. '" is already in database.')
+	                            shadow = nil
 	                        else
                                 odm.redis.call('hset', idxkey, value, id)
                             end
                         end
                     end
+                    if shadow and value then
+                        odm.redis.call('hset', shadow, value, id)
+                    end
                 elseif value then
                     odm.redis.call('hdel', idxkey, value)
+                    if shadow then
+                        odm.redis.call('hdel', shadow, value)
+                    end
                 end
             else
                 idxkey = self:index_key(field, value)
                 if update then
                     self:setadd(idxkey, score, id)
+                    odm.redis.call('sadd', self:index_registry(field), value or '')
                 else
                     self:remove_from_set(idxkey, id)
+                    if odm.redis.call('exists', idxkey) + 0 == 0 then
+                        odm.redis.call('srem', self:index_registry(field), value or '')
+                    end
+                end
+                -- keep the index being built up to date
+                if shadow then
+                    if update then
+                        odm.redis.call('sadd', shadow, value or '')
+                    end
+                    shadow = shadow .. ':' .. (value or '')
+                    if update then
+                        self:setadd(shadow, score, id)
+                    else
+                        self:remove_from_set(shadow, id)
+                    end
                 end
             end
         end
+        self:_update_sort_indexes(update, id)
         return errors
     end,
     --
+    -- Key of the hash table mapping fields to the shadow keys of indices
+    -- being built
+    _building_key = function (self)
+        return self.meta.namespace .. ':building'
+    end,
+    --
+    -- Table of shadow keys of the indices being built
+    _shadow_indices = function (self)
+        if not self.shadows then
+            self.shadows = tabletools.asdict(
+                odm.redis.call('hgetall', self:_building_key()))
+        end
+        return self.shadows
+    end,
+    --
+    -- Table with the members of set key as keys. For unique indices
+    -- the values are the ids
+    _members = function (self, key)
+        local members = {}
+        for _, id in ipairs(redis_members(key)) do
+            members[id] = id
+        end
+        return members
+    end,
+    --
+    -- Append to diff the entries of built not in live, as missing, and the
+    -- entries of live not in built, as stale. For unique indices value is
+    -- nil and the keys of the tables are the values.
+    _index_diff = function (self, diff, value, built, live)
+        for k, id in pairs(built) do
+            if live[k] ~= id then
+                table.insert(diff, {value or k, id, 'missing'})
+            end
+        end
+        for k, id in pairs(live) do
+            if built[k] ~= id then
+                table.insert(diff, {value or k, id, 'stale'})
+            end
+        end
+    end,
+    --
+    -- Remove all the indices and sort indexes of the model
+    _clear_indices = function (self)
+        for field, unique in pairs(self.meta.indices) do
+            if unique then
+                odm.redis.call('del', self:map_key(field))
+            else
+                local registry = self:index_registry(field)
+                for _, value in ipairs(odm.redis.call('smembers', registry)) do
+                    odm.redis.call('del', self:index_key(field, value))
+                end
+                odm.redis.call('del', registry)
+            end
+        end
+        for _, index in ipairs(self.meta.sort_indexes or {}) do
+            odm.redis.call('del', index.key)
+        end
+    end,
+    --
+    -- Update the sorted sets of sort indexes for instance id
+    _update_sort_indexes = function (self, update, id)
+        for _, index in ipairs(self.meta.sort_indexes or {}) do
+            if update then
+                local value = self:field_value(id, index.field)
+                if value and index.bk ~= '' then
+                    value = objects.get(index.bk, value, index.rfield)
+                end
+                odm.redis.call('zadd', index.key, tonumber(value) or 0, id)
+            else
+                odm.redis.call('zrem', index.key, id)
+            end
+        end
+    end,
+    --
+    -- Refresh sort indexes of other models which sort by fields of instance
+    -- id, only those sorting by field when given
+    _update_sort_dependents = function (self, id, field)
+        for _, dep in ipairs(self.meta.sort_dependents or {}) do
+            if not field or dep.rfield == field then
+                local value = self:field_value(id, dep.rfield)
+                value = tonumber(value) or 0
+                for _, rid in ipairs(redis_members(dep.idx .. id)) do
+                    odm.redis.call('zadd', dep.key, value, rid)
+                end
+            end
+        end
+    end,
+    --
     -- Perform explicit ordering via redis SORT command.
     _explicit_ordering = function (self, key, start, stop, order)
-        local okey, tkeys, sortargs, bykey, ids, status = key, {}, {}
-        -- nested sorting for foreign key fields
-        if order.nested and # order.nested > 0 then
+        local tkeys, sortargs, bykey, ids = {}, {}
+        local nested = order.nested and # order.nested > 0
+        -- nested sorting for foreign key fields and sorting of packed
+        -- instances, which cannot be sorted by hash fields
+        if nested or (order.field ~= '' and objects.layout(self.meta.namespace)) then
             -- generate a temporary key where to store the hash table holding
             -- the values to sort with
             local skey = self:temp_key()
             for i, id in ipairs(redis_members(key)) do
-                local value, key = redis.call('hget', self:object_key(id), order.field)
-                for n, name in ipairs(order.nested) do
+                local value, bk, rid = self:field_value(id, order.field)
+                for n, name in ipairs(order.nested or {}) do
                     if 2*math.floor(n/2) == n then
-                        value = redis.call('hget', key, name)
+                        value = objects.get(bk, rid, name)
                     else
                         -- Check test_sort_by_missing_fk_data test if fknotrequired tests
-                        status, key = pcall(function() return name .. ':obj:' .. value end)
-                        if status == false then
-                             key = okey
-                             break
+                        if not value then
+                            break
                         end
+                        bk, rid = name, value
                     end
                 end
-                -- store value on temporary key
+                -- store value on temporary key, missing values sort as
+                -- missing hash fields do
                 tkeys[i] = skey .. id
-                redis.call('set', tkeys[i], value)
+                if value then
+                    redis.call('set', tkeys[i], value)
+                end
             end
             bykey = skey .. '*'
         elseif order.field ~= '' then
@@ -537,14 +1021,143 @@ odm.Model = {
         return ids
     end,
     --
+    -- Perform ordering via the sorted set of a sort index. Fall back to
+    -- explicit ordering when the sort index does not cover the query.
+    _index_ordering = function (self, key, start, stop, order)
+        local skey, size, ids = order.index, self:setsize(key)
+        if key ~= self.idset then
+            skey = key .. ':sorted'
+            odm.redis.call('zinterstore', skey, 2, key, order.index, 'WEIGHTS', 0, 1)
+        end
+        if odm.redis.call('zcard', skey) + 0 < size then
+            ids = self:_explicit_ordering(key, start, stop, order)
+        else
+            if start > 0 or stop > 0 then
+                stop = start + stop - 1
+            else
+                stop = -1
+            end
+            if order.desc then
+                ids = odm.redis.call('zrevrange', skey, start, stop)
+            else
+                ids = odm.redis.call('zrange', skey, start, stop)
+            end
+        end
+        if skey ~= order.index then
+            odm.redis.call('del', skey)
+        end
+        return ids
+    end,
+    --
+    -- Keyset pagination. Load at most seek.limit ids following (or preceding)
+    -- the cursor (seek.score, seek.id) in the sorted set seek.index.
+    _seek_ordering = function (self, key, seek)
+        local skey, ids, limit, rank, score = seek.index, {}, seek.limit
+        local forward = seek.after ~= seek.desc
+        if key ~= skey and key ~= self.idset then
+            skey = key .. ':seek'
+            odm.redis.call('zinterstore', skey, 2, key, seek.index, 'WEIGHTS', 0, 1)
+        end
+        if seek.score and seek.id ~= '' then
+            score = odm.redis.call('zscore', skey, seek.id)
+            if score and score + 0 == seek.score then
+                rank = odm.redis.call(forward and 'zrank' or 'zrevrank', skey, seek.id) + 1
+            end
+        elseif not seek.score then
+            rank = 0
+        end
+        if rank then
+            local stop = limit < 0 and -1 or rank + limit - 1
+            ids = odm.redis.call(forward and 'zrange' or 'zrevrange', skey, rank, stop)
+        else
+            -- the cursor is not in the set. Collect ties first.
+            score = string.format('%.17g', seek.score)
+            local ties, tail
+            if forward then
+                ties = odm.redis.call('zrangebyscore', skey, score, score)
+            else
+                ties = odm.redis.call('zrevrangebyscore', skey, score, score)
+            end
+            for _, id in ipairs(ties) do
+                if seek.id ~= '' and ((forward and id > seek.id) or (not forward and id < seek.id)) then
+                    table.insert(ids, id)
+                end
+            end
+            if limit < 0 or # ids < limit then
+                local count = limit < 0 and -1 or limit - # ids
+                if forward then
+                    tail = odm.redis.call('zrangebyscore', skey, '(' .. score, '+inf', 'LIMIT', 0, count)
+                else
+                    tail = odm.redis.call('zrevrangebyscore', skey, '(' .. score, '-inf', 'LIMIT', 0, count)
+                end
+                for _, id in ipairs(tail) do
+                    table.insert(ids, id)
+                end
+            elseif # ids > limit then
+                ids = {unpack(ids, 1, limit)}
+            end
+        end
+        if skey ~= seek.index then
+            odm.redis.call('del', skey)
+        end
+        if not seek.after then
+            local n = # ids
+            for i = 1, math.floor(n / 2) do
+                ids[i], ids[n - i + 1] = ids[n - i + 1], ids[i]
+            end
+        end
+        return ids
+    end,
+    --
     -- Load related objects with their fields
     _load_related = function (self, result, related)
         local related_items = {}
         for name, rel in pairs(related) do
             local field_items, field, fields = {}, rel.field, rel.fields
             table.insert(related_items, {name, field_items, rel.fields})
+            -- Instances pointing to the result via a reverse foreign key
+            -- or a many-to-many through model
+            if rel.type == 'one2many' or rel.type == 'many2many' then
+                for i, res in ipairs(result) do
+                    local id, items = type(res) == 'table' and res[1] or res, {}
+                    for _, rid in ipairs(redis_members(rel.idx .. id)) do
+                        if rel.type == 'many2many' then
+                            rid = objects.get(rel.tbk, rid, rel.rfield)
+                        end
+                        if rid then
+                            local val = self:_load_object(rel.bk, rid, fields)
+                            if val then
+                                table.insert(items, val)
+                            end
+                        end
+                    end
+                    field_items[i] = {id, items}
+                end
+            -- A chain of foreign keys, one hash field for each model
+            elseif rel.hops then
+                local ids = {}
+                for i, res in ipairs(result) do
+                    ids[i] = type(res) == 'table' and res[1] or res
+                end
+                for _, hop in ipairs(rel.hops) do
+                    local rids, processed = {}, {}
+                    for _, id in ipairs(ids) do
+                        local rid = objects.get(hop[1], id, hop[2])
+                        if rid and not processed[rid] then
+                            processed[rid] = true
+                            table.insert(rids, rid)
+                        end
+                    end
+                    ids = rids
+                end
+                for _, rid in ipairs(ids) do
+                    local val = self:_load_object(rel.bk, rid, fields)
+                    if val then
+                        table.insert(field_items, val)
+                    end
+                end
             -- A structure has type defined
-            if # rel.type > 0 then
+            elseif # rel.type > 0 then
                 for i, res in ipairs(result) do
                     local id = res[1]
                     local fid = self:object_key(id .. ':' .. field)
@@ -554,21 +1167,20 @@ odm.Model = {
             else
                 local rbk, processed = rel.bk, {}
                 for i, res in ipairs(result) do
-                    local rid = redis.call('hget', self:object_key(res[1]), field)
+                    local rid = self:field_value(res[1], field)
                     if rid then
                         local val = processed[rid]
                         -- The related field needs to be loaded
                         if not val then
-                            local related_key = rbk .. ':obj:' .. rid
                             val = 1
-                            if redis_type(related_key) == 'hash' then
+                            if objects.exists(rbk, rid) then
                                 if # fields == 1 and fields[1] == '' then
                                     table.insert(field_items, rid)
                                 else
                                     if # fields > 0 then
-                                        val = redis.call('hmget', related_key, unpack(fields))
+                                        val = objects.hmget(rbk, rid, fields)
                                     else
-                                        val = redis.call('hgetall', related_key)
+                                        val = objects.getall(rbk, rid)
                                     end
                                     table.insert(field_items, {rid, val})
                                 end
@@ -587,6 +1199,133 @@ odm.Model = {
         end
         return related_items
     end,
+    -- Delete instance id and its indices. Return true if it existed.
+    _delete_instance = function (self, id)
+        local idkey = self:object_key(id)
+        if self.meta.cap then
+            odm.redis.call('zrem', self:_cap_key(id), id)
+        end
+        self:_update_indices(false, id)
+        local num = objects.del(self.meta.namespace, id)
+        self:remove_from_set(self.idset, id)
+        if self.meta.multi_fields then
+            for _, name in ipairs(self.meta.multi_fields) do
+                odm.redis.call('del', idkey .. ':' .. name)
+            end
+        end
+        if self.meta.expiry then
+            odm.redis.call('zrem', self.meta.expiry, id)
+        end
+        if num == 1 and self.meta.changelog then
+            self:_log_change('delete', id, {})
+        end
+        return num == 1
+    end,
+    --
+    -- Names of the fields in data (a flat array of field, value pairs)
+    -- which differ from original_data
+    _changed_fields = function (self, action, original_data, data)
+        local previous, fields = {}, {}
+        for i = 1, # original_data, 2 do
+            previous[original_data[i]] = original_data[i+1]
+        end
+        for i = 1, # data, 2 do
+            if previous[data[i]] ~= data[i+1] then
+                table.insert(fields, data[i])
+            end
+            previous[data[i]] = nil
+        end
+        if action == 'override' then
+            for field, _ in pairs(previous) do
+                table.insert(fields, field)
+            end
+        end
+        return fields
+    end,
+    --
+    -- Append a change record to the capped changelog list
+    _log_change = function (self, action, id, fields)
+        local log = self.meta.changelog
+        local seq = odm.redis.call('incr', log.key .. ':seq')
+        odm.redis.call('rpush', log.key,
+                       cjson.encode({seq, log.model, id .. '', action, fields}))
+        odm.redis.call('ltrim', log.key, -log.size, -1)
+    end,
+    --
+    -- Sorted set of the ids sharing the cap of instance id
+    _cap_key = function (self, id)
+        local key = self.meta.namespace .. ':cap'
+        if self.meta.cap_by then
+            local value = self:field_value(id, self.meta.cap_by)
+            key = key .. ':' .. (value or '')
+        end
+        return key
+    end,
+    --
+    -- Add id to its capped set, previously prev_id in prevkey, and delete
+    -- the oldest instances exceeding the cap
+    _cap = function (self, prevkey, prev_id, id, score)
+        local key = self:_cap_key(id)
+        if prevkey ~= key or prev_id .. '' ~= id .. '' then
+            odm.redis.call('zrem', prevkey, prev_id)
+        end
+        if self.meta.sorted then
+            odm.redis.call('zadd', key, score, id)
+        elseif not odm.redis.call('zscore', key, id) then
+            local seq = odm.redis.call('incr', self.meta.namespace .. ':capseq')
+            odm.redis.call('zadd', key, seq, id)
+        end
+        local excess = odm.redis.call('zcard', key) - self.meta.cap
+        if excess > 0 then
+            for _, rid in ipairs(odm.redis.call('zrange', key, 0, excess - 1)) do
+                self:_delete_instance(rid)
+            end
+        end
+    end,
+    --
+    -- Ids which have expired but are not yet deleted
+    _expired = function (self)
+        if self.meta.expiry then
+            return odm.redis.call('zrangebyscore', self.meta.expiry, '-inf',
+                                  string.format('%.17g', self.meta.now))
+        end
+        return {}
+    end,
+    --
+    -- Remove expired ids from an array of ids
+    _unexpired = function (self, ids)
+        local result, now = {}, self.meta.now
+        for _, id in ipairs(ids) do
+            local deadline = odm.redis.call('zscore', self.meta.expiry, id)
+            if not deadline or deadline + 0 > now then
+                table.insert(result, id)
+            end
+        end
+        return result
+    end,
+    --
+    -- Ids of instances with index field equal to value
+    _related_ids = function (self, field, value)
+        if self.meta.indices[field] then
+            local id = odm.redis.call('hget', self:map_key(field), value)
+            return id and {id} or {}
+        else
+            return self:setids(self:index_key(field, value))
+        end
+    end,
+    --
+    -- Load the fields of instance id of the model with namespace bk
+    _load_object = function (self, bk, id, fields)
+        if objects.exists(bk, id) then
+            if # fields == 1 and fields[1] == '' then
+                return id
+            elseif # fields > 0 then
+                return {id, objects.hmget(bk, id, fields)}
+            else
+                return {id, objects.getall(bk, id)}
+            end
+        end
+    end,
     -- Aggregate ids into destkey
     _aggregate = function (self, destkey, id, field, processed)
         if not processed[id] then
@@ -599,21 +1338,19 @@ odm.Model = {
     end,
     --
     _nested_field = function (self, id, nested)
-        local key, status, value = self:object_key(id)
+        local bk, value = self.meta.namespace
         for n, field_model_name in ipairs(nested) do
             if 2*math.floor(n/2) < n then
                 -- odd elements we get the value
-                value = redis.call('hget', key, field_model_name)
-            else    -- even we get the next key
-                status, key = pcall(function() return field_model_name .. ':obj:' .. value end)
-                if not status then
-                    key=  nil
-                    value = nil
-                    break
-                end
+                value = objects.get(bk, id, field_model_name)
+            elseif value then    -- even we get the next model
+                bk, id = field_model_name, value
+            else
+                value = nil
+                break
             end
         end
-        return key, value
+        return value
     end
 }
 --
@@ -647,6 +1384,46 @@ else
         load = function(self, model, keys, options, args)
             return model:load(first_key(keys), cjson.decode(options))
         end,
+        -- number of ids in a query which have not expired
+        count = function(self, model, keys, ...)
+            return model:count(first_key(keys))
+        end,
+        -- keep the ids in a query which have not expired, or have expired
+        expiry = function(self, model, keys, expired, args)
+            return model:expiry(keys[1], keys[2], expired == '1')
+        end,
+        -- increment a numeric field of an instance
+        incr = function(self, model, keys, id, args)
+            return model:incr(id, args[1], args[2], args[3] == 'float',
+                              args[4] == '1')
+        end,
+        -- rebuild indices of a chunk of instances
+        reindex = function(self, model, keys, start, args)
+            return model:reindex(keys[1], start + 0, args[1] + 0, args[2] + 0)
+        end,
+        -- build the index of a field into shadow keys, a chunk at a time
+        build_index = function(self, model, keys, field, args)
+            return model:build_index(field, args[1], keys[1], args[2] + 0,
+                                     args[3] + 0, args[4] + 0)
+        end,
+        -- compare and replace a chunk of an index with its shadow keys
+        swap_index = function(self, model, keys, field, args)
+            local values = {}
+            for i = 6, # args do
+                table.insert(values, args[i])
+            end
+            return model:swap_index(field, args[1], args[2] == '1',
+                                    args[3] == '1', args[4] == '1',
+                                    args[5] + 0, values)
+        end,
+        -- stop updating the shadow keys of an index
+        end_index = function(self, model, keys, field, args)
+            return model:end_index(field, args[1], keys[1])
+        end,
+        -- store the values of a field of the instances in a query
+        get_field = function(self, model, keys, field, args)
+            return model:get_field(keys[1], keys[2], field)
+        end,
         -- delete a query
         delete = function(self, model, keys, ...)
             return model:delete(first_key(keys))
@@ -655,6 +1432,11 @@ else
         aggregate = function(self, model, keys, field, args)
             return model:aggregate(first_key(keys), field)
         end,
+        -- delete a query and its related instances in chunks
+        cascade_delete = function(self, model, keys, graph, args)
+            return model:cascade_delete(keys[1] or '', cjson.decode(graph),
+                                        args[1] + 0)
+        end,
         -- structure. Don nothing
         structure = function(self, model, keys, ...)
             return ''
@@ -22,10 +22,9 @@ if redis then
     end
     
     for _, id in ipairs(ids) do
-        local okey = meta.namespace .. ':obj:' .. id
         local this = {{}}
         if load_only == nil then
-            local fields = redis.call('hgetall', okey)
+            local fields = objects.getall(meta.namespace, id)
             local name = nil
             for _, field in ipairs(fields) do
                 if name == nil then
@@ -38,7 +37,7 @@ if redis then
                 end
             end
         else
-            local fields = redis.call('hmget', okey, unpack(load_only))
+            local fields = objects.hmget(meta.namespace, id, load_only)
             for i, field in ipairs(fields) do
                 local name = load_only[i]
                 if pcall(setnumber, this, name, field) == false then
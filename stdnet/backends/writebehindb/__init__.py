@@ -0,0 +1,395 @@
+'''Write-behind redis backend.
+
+Instances committed to this backend are validated and kept in an in-process
+buffer which is written to redis, in a single pipeline, on a timer, when the
+buffer reaches a size threshold, on an explicit :meth:`BackendDataServer.drain`
+or when the interpreter exits. Several commits of the same instance are
+coalesced so that only the last one reaches the server.
+
+The connection string accepts the redis parameters plus:
+
+* ``flush_interval`` seconds between automatic drains. Default ``1``.
+* ``flush_size`` maximum number of pending instances. Default ``1000``.
+
+Queries drain the pending writes of the models they read before querying
+redis, while lookups by primary key of pending instances are served from the
+buffer without draining.
+'''
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+from stdnet import FieldValueError, CommitException, ImproperlyConfigured
+from stdnet.backends import session_result, instance_session_result
+from stdnet.backends import redisb
+from stdnet.utils import flat_mapping, JSPLITTER
+
+
+LOGGER = logging.getLogger('stdnet.writebehind')
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+class WriteBuffer(object):
+    '''Pending writes shared by all backends with the same connection
+string. Pending instances are stored by model and primary key.'''
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.RLock()
+        # held from pop to the end of a drain so that drains are serialised
+        self.drain_lock = threading.RLock()
+        self.models = OrderedDict()
+        self.callbacks = []
+        self.size = 0
+        self._timer = None
+
+    def add(self, meta, entry):
+        id = entry[2]
+        with self.lock:
+            if meta not in self.models:
+                self.models[meta] = OrderedDict()
+            pending = self.models[meta]
+            prev = pending.get(id)
+            if prev is None:
+                self.size += 1
+            elif entry[0] == 'update':
+                # partial update, merge with pending data
+                data = prev[4].copy()
+                data.update(entry[4])
+                entry = (prev[0], prev[1], id, entry[3], data)
+            pending[id] = entry
+            return self.size
+
+    def pop(self, metas=None):
+        '''Remove and return the pending writes of ``metas``, all models
+if not given.'''
+        with self.lock:
+            if metas is None:
+                models, self.models, self.size = self.models, OrderedDict(), 0
+                return models
+            models = OrderedDict()
+            for meta in metas:
+                pending = self.models.pop(meta, None)
+                if pending:
+                    models[meta] = pending
+                    self.size -= len(pending)
+            return models
+
+    def get(self, meta, ids):
+        '''The pending entries of ``ids`` of model ``meta`` when they all
+carry the full instance data, otherwise ``None``.'''
+        with self.lock:
+            pending = self.models.get(meta)
+            if not pending:
+                return
+            entries = []
+            for id in ids:
+                entry = pending.get(id)
+                # partial updates need the data on the server
+                if entry is None or entry[0] == 'update':
+                    return
+                entries.append(entry)
+            return entries
+
+    def restore(self, models):
+        '''Put back the ``models`` returned by :meth:`pop` when they could
+not be written. Writes added since then are newer and take precedence.'''
+        with self.lock:
+            for meta, pending in models.items():
+                restored = OrderedDict(pending)
+                for id, entry in self.models.get(meta, {}).items():
+                    prev = restored.get(id)
+                    if prev is not None and entry[0] == 'update':
+                        data = prev[4].copy()
+                        data.update(entry[4])
+                        entry = (prev[0], prev[1], id, entry[3], data)
+                    restored[id] = entry
+                self.models[meta] = restored
+            self.size = sum(len(p) for p in self.models.values())
+
+    def discard(self, meta=None):
+        with self.lock:
+            if meta is None:
+                self.models.clear()
+                self.size = 0
+            elif meta in self.models:
+                self.size -= len(self.models.pop(meta))
+
+    def start(self, backend):
+        if self._timer is None and self.interval > 0:
+            self._timer = threading.Thread(target=self._run, args=(backend,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self, backend):
+        while True:
+            time.sleep(self.interval)
+            try:
+                backend.drain(raise_error=False)
+            except Exception:
+                LOGGER.exception('Could not drain pending writes to %s',
+                                 backend)
+
+
+def drain_all():
+    '''Drain the pending writes of all write-behind backends.'''
+    with _buffers_lock:
+        backends = [b for b, _ in _buffers.values()]
+    for backend in backends:
+        backend.drain(raise_error=False)
+
+atexit.register(drain_all)
+
+
+def query_models(qs, models=None):
+    '''The set of model metas the query element ``qs`` reads from.'''
+    models = set() if models is None else models
+    meta = qs.meta
+    models.add(meta)
+    for child in qs:
+        if getattr(child, 'backend', None) is not None:
+            query_models(child, models)
+        elif isinstance(child[1], tuple):
+            # lookup across foreign keys
+            models.update(m for _, m in child[1][1] if m)
+    nested = qs.ordering.nested if qs.ordering else None
+    while nested:
+        models.add(nested.model._meta)
+        nested = nested.nested
+    for name in qs.select_related or ():
+        if name in meta.related:
+            manager = meta.related[name]
+            models.add(manager.model._meta)
+            models.add(manager.formodel._meta)
+        elif JSPLITTER in name:
+            models.update(f.relmodel._meta for f in meta.related_path(name))
+        else:
+            relmodel = meta.dfields[name].relmodel
+            if relmodel:
+                models.add(relmodel._meta)
+    return models
+
+
+class WriteBehindQuery(redisb.RedisQuery):
+    '''A :class:`stdnet.backends.redisb.RedisQuery` which serves lookups by
+primary key of pending instances from the :class:`WriteBuffer`.'''
+    buffered = None
+
+    def _build(self, pipe=None, **kwargs):
+        backend = self.backend
+        # sub queries are drained by the query containing them
+        if pipe is None:
+            self.buffered = self._buffered()
+            if self.buffered is not None:
+                return
+            # Pending writes must be on the server before querying it
+            backend.drain(models=query_models(self.queryelem))
+        return super(WriteBehindQuery, self)._build(pipe=pipe, **kwargs)
+
+    def _buffered(self):
+        qs = self.queryelem
+        meta = qs.meta
+        data = qs.data
+        if (qs.keyword != 'set' or qs.name != meta.pkname() or meta.ttl or
+                any(data.get(name) for name in ('select_related', 'ordering',
+                                                'get_field', 'where', 'seek'))):
+            return
+        # values are read from the full data, instances need all fields
+        if data.get('fields') and not data.get('values'):
+            return
+        ids = []
+        for child in qs:
+            if getattr(child, 'backend', None) is not None or \
+                    child[0] != 'value':
+                return
+            if child[1] not in ids:
+                ids.append(child[1])
+        if ids:
+            return self.backend.buffer.get(meta, ids)
+
+    def _execute_query(self):
+        if self.buffered is None:
+            return super(WriteBehindQuery, self)._execute_query()
+        return self._buffered_count()
+
+    def _buffered_count(self):
+        self.ids = [entry[2] for entry in self.buffered]
+        yield len(self.ids)
+
+    def _has(self, val):
+        if self.buffered is None:
+            return super(WriteBehindQuery, self)._has(val)
+        return val in self.ids
+
+    def _items(self, slic):
+        if self.buffered is None:
+            return super(WriteBehindQuery, self)._items(slic)
+        backend = self.backend
+        entries = self.buffered[slic] if slic else self.buffered
+        data = ((entry[2], None, entry[4]) for entry in entries)
+        values = self.queryelem.data.get('values')
+        if values:
+            return backend.values_from_db(self.meta, data, values)
+        return backend.objects_from_db(self.meta, data)
+
+
+class BackendDataServer(redisb.BackendDataServer):
+    '''A redis :class:`stdnet.BackendDataServer` which defers writes.
+
+Only instances with a primary key, of models without unique fields or auto
+ordering, are deferred. Everything else, deletes and structures included, is
+written through after draining the pending writes so that the order of
+operations is preserved.
+'''
+    Query = WriteBehindQuery
+
+    def setup_connection(self, address):
+        params = self.params
+        interval = float(params.pop('flush_interval', 1))
+        size = int(params.pop('flush_size', 1000))
+        client = super(BackendDataServer, self).setup_connection(address)
+        if client.is_async:
+            raise ImproperlyConfigured('Write-behind backend requires a '
+                                       'synchronous redis client.')
+        self.flush_interval = interval
+        self.flush_size = size
+        params['flush_interval'] = interval
+        params['flush_size'] = size
+        return client
+
+    @property
+    def buffer(self):
+        '''The :class:`WriteBuffer` of pending writes.'''
+        # parameters are not ordered in the connection string
+        key = (self.connection_string.split('?')[0],
+               tuple(sorted(self.params.items())))
+        with _buffers_lock:
+            if key not in _buffers:
+                _buffers[key] = (self, WriteBuffer(self.flush_interval))
+            return _buffers[key][1]
+
+    @property
+    def pending(self):
+        '''Number of instances waiting to be written to redis.'''
+        return self.buffer.size
+
+    def bind_drain(self, callback):
+        '''Register a ``callback`` invoked after pending writes are sent to
+redis. It is called with the backend and a list of
+:class:`stdnet.session_result`, failures included as
+:class:`stdnet.CommitException`.'''
+        self.buffer.callbacks.append(callback)
+
+    def drain(self, raise_error=True, models=None):
+        '''Write pending instances to redis in a single pipeline.
+
+:param raise_error: if ``True`` a :class:`stdnet.CommitException` is raised
+    when some instances could not be committed, otherwise failures are
+    logged.
+:param models: optional iterable of model metas to drain. By default the
+    pending instances of all models are written.
+:return: a list of :class:`stdnet.session_result`.
+
+When the pipeline cannot be executed, for example on connection errors, the
+pending writes are put back in the buffer and the error is raised.'''
+        buffer = self.buffer
+        with buffer.drain_lock:
+            models = buffer.pop(models)
+            if not models:
+                return []
+            try:
+                results = self._drain(models)
+            except Exception:
+                buffer.restore(models)
+                raise
+        for callback in buffer.callbacks:
+            callback(self, results)
+        errors = [str(e) for r in results for e in r.results
+                  if isinstance(e, Exception)]
+        if errors:
+            error = '\n'.join(errors)
+            if raise_error:
+                raise CommitException(error, failures=len(errors))
+            LOGGER.error('Failed to write behind to %s: %s', self, error)
+        return results
+
+    def _drain(self, models):
+        pipe = self.client.pipeline()
+        for meta, pending in models.items():
+            lua_data = [len(pending)]
+            for entry in pending.values():
+                data = flat_mapping(entry[4])
+                lua_data.extend(entry[:4])
+                lua_data.append(len(data))
+                lua_data.extend(data)
+            self.odmrun(pipe, 'commit', meta, (), json.dumps(self.meta(meta)),
+                        *lua_data, iids=list(pending))
+        # the pipeline may also contain script loading responses
+        return [session_result(r.meta, list(r.results))
+                for r in pipe.execute() if isinstance(r, session_result)]
+
+    def execute_session(self, session_data):
+        immediate = []
+        deferred = []
+        for sm in session_data:
+            meta = sm.meta
+            write_through = (
+                sm.bulk or meta.ordering and meta.ordering.auto or
+                any(idx.unique for idx in meta.indices))
+            dirty = []
+            instances = []
+            for instance in sm.dirty:
+                state = instance.get_state()
+                id = instance.pkvalue() or ''
+                prev_id = state.iid if state.persistent else ''
+                if write_through or not id or prev_id not in ('', id):
+                    dirty.append(instance)
+                    continue
+                if not meta.is_valid(instance):
+                    raise FieldValueError(
+                        json.dumps(instance._dbdata['errors']))
+                score = redisb.MIN_FLOAT
+                if meta.ordering:
+                    v = getattr(instance, meta.ordering.name, None)
+                    if v is not None:
+                        score = meta.ordering.field.scorefun(v)
+                data = instance._dbdata['cleaned_data']
+                instances.append((state.iid, (state.action, prev_id, id,
+                                              score, data)))
+            if instances:
+                deferred.append((meta, instances))
+            if dirty or sm.deletes is not None or sm.structures:
+                immediate.append(sm._replace(dirty=dirty))
+        results = []
+        buffer = self.buffer
+        size = 0
+        for meta, instances in deferred:
+            res = []
+            for iid, entry in instances:
+                size = buffer.add(meta, entry)
+                res.append(instance_session_result(iid, True, entry[2],
+                                                   False, entry[3]))
+            results.append(session_result(meta, res))
+        if immediate or size >= self.flush_size:
+            self.drain(raise_error=False)
+        elif deferred:
+            buffer.start(self)
+        if immediate:
+            results.extend(super(BackendDataServer,
+                                 self).execute_session(immediate))
+        return results
+
+    def flush(self, meta=None):
+        self.buffer.discard(meta)
+        return super(BackendDataServer, self).flush(meta)
+
+    def model_keys(self, meta):
+        self.drain(models=(meta,))
+        return super(BackendDataServer, self).model_keys(meta)
+
+    def disconnect(self):
+        self.drain(raise_error=False)
+        super(BackendDataServer, self).disconnect()
@@ -67,6 +67,12 @@ class of :class:`Model` in the following way::
     registered in the global models hashtable.
 :parameter abstract: Check the :attr:`abstract` attribute.
 :parameter ordering: Check the :attr:`ordering` attribute.
+:parameter sort_indexes: Check the :attr:`sort_indexes` attribute.
+:parameter ttl: Check the :attr:`ttl` attribute.
+:parameter cap: Check the :attr:`cap` attribute.
+:parameter cap_by: Check the :attr:`cap_by` attribute.
+:parameter storage: Check the :attr:`storage` attribute.
+:parameter bucket: Check the :attr:`bucket` attribute.
 :parameter app_label: Check the :attr:`app_label` attribute.
 :parameter name: Check the :attr:`name` attribute.
 :parameter modelkey: Check the :attr:`modelkey` attribute.
@@ -108,6 +114,59 @@ mapper.
 
     Default: ``None``.
 
+.. attribute:: sort_indexes
+
+    Optional tuple of field names, possibly spanning one
+    :class:`ForeignKey` (``'issuer__size'``), which backends can keep sorted
+    so that :meth:`Query.sort_by` does not need to sort the whole query.
+    Fields must be numeric, boolean or dates. Once the :attr:`model` is
+    prepared this is a dictionary of names and ordering information.
+
+    Default: ``()``.
+
+.. attribute:: ttl
+
+    Optional number of seconds an instance lives after it was last saved.
+    Expired instances are excluded from queries and removed, together with
+    their indices, by :meth:`Manager.sweep`.
+
+    Default: ``None``.
+
+.. attribute:: cap
+
+    Optional maximum number of instances of :attr:`model`. When a commit
+    exceeds it, the oldest instances are deleted together with their
+    indices and structures. Instances are aged by their :attr:`ordering`
+    score, when available, otherwise by the order they were first saved.
+
+    Default: ``None``.
+
+.. attribute:: cap_by
+
+    Optional name of a :class:`Field` so that :attr:`cap` applies to each
+    value of the field, for example the newest ``N`` instances for each
+    user. Once the :attr:`model` is prepared this is the :class:`Field`.
+
+    Default: ``None``.
+
+.. attribute:: storage
+
+    How backends store instances, either ``hash`` or ``packed``. The redis
+    backend stores ``hash`` instances as a hash table with a field for each
+    model field, while ``packed`` instances are a single compact binary value
+    with positions in place of field names and numbers encoded as numbers.
+    Check the :ref:`packed storage <packed-storage>` documentation.
+
+    Default: ``hash``.
+
+.. attribute:: bucket
+
+    Optional number of instances grouped in a single key of the backend
+    server when :attr:`storage` is ``packed``. Instances are grouped by
+    ranges of their primary key, which must be numeric.
+
+    Default: ``None``.
+
 .. attribute:: dfields
 
     dictionary of :class:`Field` instances.
@@ -147,7 +206,9 @@ mapper.
 '''
     def __init__(self, model, fields, app_label=None, modelkey=None,
                  name=None, register=True, pkname=None, ordering=None,
-                 attributes=None, abstract=False, **kwargs):
+                 attributes=None, abstract=False, sort_indexes=None,
+                 ttl=None, cap=None, cap_by=None, storage=None, bucket=None,
+                 **kwargs):
         self.model = model
         self.abstract = abstract
         self.attributes = unique_tuple(attributes or ())
@@ -192,6 +253,31 @@ mapper.
         self.ordering = None
         if ordering:
             self.ordering = self.get_sorting(ordering, ImproperlyConfigured)
+        self._sort_indexes = unique_tuple(sort_indexes or ())
+        self._sort_info = None
+        self.ttl = ttl
+        self.cap = cap
+        self.cap_by = None
+        if cap_by:
+            if not cap:
+                raise ImproperlyConfigured('"%s" cap_by requires cap.' % self)
+            elif cap_by not in self.dfields:
+                raise ImproperlyConfigured('"%s" cannot cap by "%s". It is '
+                                           'not a field.' % (self, cap_by))
+            self.cap_by = self.dfields[cap_by]
+        self.storage = storage or 'hash'
+        if self.storage not in ('hash', 'packed'):
+            raise ImproperlyConfigured('"%s" storage must be "hash" or '
+                                       '"packed".' % self)
+        self.bucket = bucket
+        if bucket:
+            if self.storage != 'packed':
+                raise ImproperlyConfigured('"%s" bucket requires packed '
+                                           'storage.' % self)
+            elif pk is None or (pk.type != 'auto' and
+                                pk.internal_type != 'numeric'):
+                raise ImproperlyConfigured('"%s" bucket requires a numeric '
+                                           'primary key.' % self)
 
     @property
     def type(self):
@@ -261,6 +347,46 @@ Return ``True`` if the instance is ready to be saved to database.'''
                         data[name] = svalue
         return len(errors) == 0
 
+    @property
+    def sort_indexes(self):
+        # Evaluated lazily since nested sort indexes need related models
+        if self._sort_info is None:
+            info = OrderedDict()
+            for name in self._sort_indexes:
+                sort = self.get_sorting(name, ImproperlyConfigured)
+                last = sort.nested or sort
+                if (sort.desc or sort.auto or last.nested or
+                        last.field.internal_type != 'numeric' or
+                        (sort.nested and not sort.field.index)):
+                    raise ImproperlyConfigured(
+                        '"%s" cannot have sort index "%s". It must be a '
+                        'numeric field, possibly of an indexed foreign key.'
+                        % (self, name))
+                info[name] = sort
+            self._sort_info = info
+        return self._sort_info
+
+    def sort_index(self, sortby):
+        '''Return the name of the :attr:`sort_indexes` entry matching the
+ordering information ``sortby``, or ``None``.'''
+        path = sort_path(sortby)
+        for name, sort in self.sort_indexes.items():
+            if sort_path(sort) == path:
+                return name
+
+    def related_path(self, path):
+        '''Return the list of :class:`ForeignKey` followed by the double
+underscored ``path``, for example ``'instrument__issuer'``, or ``None``
+if ``path`` is not a chain of foreign keys.'''
+        fields, meta = [], self
+        for name in path.split(JSPLITTER):
+            field = meta.dfields.get(name)
+            if field is None or field.type != 'related object':
+                return None
+            fields.append(field)
+            meta = field.relmodel._meta
+        return fields
+
     def get_sorting(self, sortby, errorClass=None):
         desc = False
         if isinstance(sortby, autoincrement):
@@ -330,6 +456,14 @@ of fields names and a list of field attribute names.'''
                                  for idx in self.indices))}
 
 
+def sort_path(sortby):
+    path = []
+    while sortby:
+        path.append(sortby.name)
+        sortby = sortby.nested
+    return tuple(path)
+
+
 class autoincrement(object):
     '''An :class:`autoincrement` is used in a :class:`StdModel` Meta
 class to specify a model with :ref:`incremental sorting <incremental-sorting>`.
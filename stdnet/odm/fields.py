@@ -6,7 +6,7 @@ from base64 import b64encode
 from stdnet import range_lookups
 from stdnet.utils import (DefaultJSONEncoder, DefaultJSONHook, timestamp2date,
                           date2timestamp, UnicodeMixin, to_string, string_type,
-                          encoders, flat_to_nested, dict_flat_generator)
+                          encoders, KeyPaths)
 from stdnet.utils.exceptions import *
 
 from . import related
@@ -505,16 +505,52 @@ or other entities. They are indexes by default.'''
 class CharField(SymbolField):
     '''A text :class:`SymbolField` which is never an index.
 It contains unicode and by default and :attr:`Field.required`
-is set to ``False``.'''
+is set to ``False``.
+
+:parameter compress: Optional compression method, ``zlib`` or ``lzma``, for
+    values stored in the backend server. Check the :attr:`compressor`
+    attribute.
+:parameter compress_threshold: values shorter than this number of bytes are
+    not compressed. Default ``1024``.
+
+.. attribute:: compressor
+
+    An :class:`stdnet.utils.encoders.Compressor` which compresses values
+    when saving instances and decompresses them when loading. Values
+    stored uncompressed, for example before compression was enabled, are
+    loaded as they are. ``None`` if values are not compressed.
+'''
+    compressor = None
+
     def __init__(self, *args, **kwargs):
         kwargs['index'] = False
         kwargs['unique'] = False
         kwargs['primary_key'] = False
         self.max_length = kwargs.pop('max_length', None)  # not used for now
+        compress = kwargs.pop('compress', None)
+        threshold = kwargs.pop('compress_threshold', 1024)
         required = kwargs.get('required', None)
         if required is None:
             kwargs['required'] = False
         super(CharField, self).__init__(*args, **kwargs)
+        if compress:
+            self.compressor = encoders.Compressor(compress, threshold,
+                                                  charset=self.charset)
+
+    def to_python(self, value, backend=None):
+        if self.compressor is not None:
+            value = self.compressor.loads(value)
+        return super(CharField, self).to_python(value, backend)
+
+    def set_get_value(self, instance, value):
+        value = super(CharField, self).set_get_value(instance, value)
+        return self.compress(value)
+
+    def compress(self, value):
+        '''Compress the database representation ``value`` if required.'''
+        if self.compressor is not None:
+            return self.compressor.dumps(value)
+        return value
 
 
 class ByteField(CharField):
@@ -540,6 +576,11 @@ This field is python specific and therefore not of much use
 if accessed from external programs. Consider the :class:`ForeignKey`
 or :class:`JSONField` fields as more general alternatives.
 
+:parameter protocol: the pickle protocol used when saving values. Values
+    saved with any protocol are loaded. Default ``2``, which can be read by
+    python 2 and python 3. ``pickle.HIGHEST_PROTOCOL`` is faster and more
+    compact on python 3.
+
 .. note:: The best way to use this field is when its :class:`Field.as_cache`
           attribute is ``True``.
 '''
@@ -551,14 +592,14 @@ or :class:`JSONField` fields as more general alternatives.
         # as to_python
         value = self.to_python(value)
         setattr(instance, self.attname, value)
-        return self.serialise(value)
+        return self.compress(self.serialise(value))
 
     def serialise(self, value, lookup=None):
         if value is not None:
             return self.encoder.dumps(value)
 
     def get_encoder(self, params):
-        return encoders.PythonPickle(protocol=2)
+        return encoders.PythonPickle(protocol=params.pop('protocol', 2))
 
 
 class ForeignKey(Field):
@@ -706,6 +747,15 @@ behaviour and how the field is stored in the back-end server.
 
     Default: :class:`stdnet.utils.jsontools.date_decimal_hook`.
 
+:parameter codec: The format of data in the back-end server, ``json`` or
+    ``msgpack``. ``msgpack`` uses the binary
+    :class:`stdnet.utils.encoders.Msgpack` encoder, which is faster and more
+    compact than JSON and requires the msgpack package. Values saved as JSON
+    are loaded with either codec. It can be used only when :attr:`as_string`
+    is ``True`` and without ``encoder_class`` or ``decoder_hook``.
+
+    Default ``json``.
+
 :parameter as_string: Set the :attr:`as_string` attribute.
 
     Default ``True``.
@@ -750,18 +800,48 @@ behaviour and how the field is stored in the back-end server.
     internal_type = 'serialized'
     _default = {}
 
+    def __init__(self, *args, **kwargs):
+        super(JSONField, self).__init__(*args, **kwargs)
+        if not self.as_string:
+            if self.compressor is not None:
+                raise FieldError('%s cannot be compressed unless stored as '
+                                 'a string.' % self.__class__.__name__)
+            elif isinstance(self.encoder, encoders.Msgpack):
+                raise FieldError('%s cannot use the msgpack codec unless '
+                                 'stored as a string.'
+                                 % self.__class__.__name__)
+
+    def register_with_model(self, name, model):
+        super(JSONField, self).register_with_model(name, model)
+        if not self.as_string:
+            self.key_paths = KeyPaths(self.attname)
+
     def get_encoder(self, params):
         self.as_string = params.pop('as_string', True)
         if not self.as_string and not isinstance(self._default, dict):
             self._default = {}
-        return encoders.Json(
+        codec = params.pop('codec', 'json')
+        if codec == 'msgpack' and ('encoder_class' in params or
+                                   'decoder_hook' in params):
+            raise FieldError('%s cannot use the msgpack codec with a JSON '
+                             'encoder_class or decoder_hook.'
+                             % self.__class__.__name__)
+        encoder = encoders.Json(
             charset=self.charset,
             json_encoder=params.pop('encoder_class', DefaultJSONEncoder),
             object_hook=params.pop('decoder_hook', DefaultJSONHook))
+        if codec == 'msgpack':
+            return encoders.Msgpack(fallback=encoder, charset=self.charset)
+        elif codec != 'json':
+            raise FieldError('Unknown codec "%s" for %s.'
+                             % (codec, self.__class__.__name__))
+        return encoder
 
     def to_python(self, value, backend=None):
         if value is None:
             return self.get_default()
+        if self.compressor is not None:
+            value = self.compressor.loads(value)
         try:
             return self.encoder.loads(value)
         except TypeError:
@@ -774,13 +854,11 @@ behaviour and how the field is stored in the back-end server.
         setattr(instance, self.attname, value)
         if self.as_string:
             # dump as a string
-            return self.serialise(value)
+            return self.compress(self.serialise(value))
         else:
             # unwind as a dictionary
-            value = dict(dict_flat_generator(value,
-                                             attname=self.attname,
-                                             dumps=self.serialise,
-                                             error=FieldValueError))
+            value = self.key_paths.flat(value, dumps=self.serialise,
+                                        error=FieldValueError)
             # If the dictionary is empty we modify so that
             # an update is possible.
             if not value:
@@ -801,9 +879,8 @@ behaviour and how the field is stored in the back-end server.
         if self.as_string:
             return data.pop(self.attname, None)
         else:
-            return flat_to_nested(data, instance=instance,
-                                  attname=self.attname,
-                                  loads=self.encoder.loads)
+            return self.key_paths.nested(data, instance=instance,
+                                         loads=self.encoder.loads)
 
     def get_sorting(self, name, errorClass):
         pass
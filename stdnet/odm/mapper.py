@@ -1,8 +1,10 @@
 from inspect import ismodule, isclass
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 
 from stdnet.utils import native_str
 from stdnet.utils.importer import import_module
-from stdnet import getdb
+from stdnet import getdb, change_record
 
 from .base import ModelType, Model
 from .session import Manager, Session, ModelDictionary, StructureManager
@@ -10,7 +12,11 @@ from .struct import Structure
 from .globals import Event, get_model_from_hash
 
 
-__all__ = ['Router', 'model_iterator']
+__all__ = ['Router', 'ChangeConsumer', 'model_iterator']
+
+# pools of threads shared by routers committing in parallel, by size
+_commit_pools = {}
+_commit_pools_lock = Lock()
 
 
 class Router(object):
@@ -58,12 +64,23 @@ one wishes to do so.
     deleted::
 
         models.post_delete.bind(callback, sender=MyModel)
+
+.. attribute:: parallel_commit
+
+    When ``True`` (or a positive integer), a :class:`Transaction` involving
+    models registered with more than one backend executes the session of
+    each backend concurrently. Synchronous backends use a pool of threads
+    (of size ``parallel_commit`` when an integer is given) while
+    asynchronous backends are gathered. Default ``False``.
 '''
-    def __init__(self, default_backend=None, install_global=False):
+    def __init__(self, default_backend=None, install_global=False,
+                 parallel_commit=False):
         self._registered_models = ModelDictionary()
         self._registered_names = {}
         self._default_backend = default_backend
         self._install_global = install_global
+        self._commit_pool = None
+        self.parallel_commit = parallel_commit
         self._structures = {}
         self._search_engine = None
         self.pre_commit = Event()
@@ -77,6 +94,24 @@ one wishes to do so.
 calling the :meth:`register` method without explicitly passing a backend.'''
         return self._default_backend
 
+    @property
+    def commit_pool(self):
+        '''The pool of threads used to commit sessions on several
+synchronous backends concurrently when :attr:`parallel_commit` is enabled.
+Routers with the same number of workers share the same pool, which lives as
+long as the process, so that discarded routers do not leave threads
+behind.'''
+        if self._commit_pool is None:
+            workers = self.parallel_commit
+            if workers is True or not workers:
+                workers = 4
+            with _commit_pools_lock:
+                pool = _commit_pools.get(workers)
+                if pool is None:
+                    pool = _commit_pools[workers] = ThreadPool(workers)
+            self._commit_pool = pool
+        return self._commit_pool
+
     @property
     def registered_models(self):
         '''List of registered :class:`Model`.'''
@@ -251,6 +286,27 @@ For example::
         for manager in self._registered_models.values():
             manager.create_all()
 
+    def check_indexes(self, chunk=1000, throttle=0):
+        '''Check the indices of :attr:`registered_models`, one field at a
+time, via the :meth:`Manager.check_index` method.
+
+:return: a list of :class:`stdnet.index_error` with the inconsistencies
+    found.'''
+        return self._check_indexes(False, chunk, throttle)
+
+    def repair_indexes(self, chunk=1000, throttle=0):
+        '''Check and repair the indices of :attr:`registered_models`.
+
+:return: a list of :class:`stdnet.index_error` with the inconsistencies
+    repaired.'''
+        return self._check_indexes(True, chunk, throttle)
+
+    def consumer(self, name, backend=None):
+        '''Return the :class:`ChangeConsumer` called ``name`` which reads
+the changes committed to ``backend``, the :attr:`default_backend` if not
+given. The backend must have a ``changelog`` connection parameter.'''
+        return ChangeConsumer(getdb(backend or self._default_backend), name)
+
     def add(self, instance):
         '''Add an ``instance`` to its backend database. This is a shurtcut
 method for::
@@ -261,6 +317,22 @@ method for::
 
     # PRIVATE METHODS
 
+    def _check_indexes(self, repair, chunk, throttle):
+        managers = list(self._registered_models.values())
+        if not managers:
+            return []
+        return managers[0].backend.execute(
+            self._check_managers(managers, repair, chunk, throttle))
+
+    def _check_managers(self, managers, repair, chunk, throttle):
+        errors = []
+        for manager in managers:
+            for field in manager._meta.indices:
+                result = yield manager.check_index(field.attname, repair,
+                                                   chunk, throttle)
+                errors.extend(result)
+        yield errors
+
     def _register_applications(self, applications, models, backends):
         backends = backends or {}
         for model in model_iterator(applications):
@@ -307,6 +379,54 @@ def models_from_model(model, include_related=False, exclude=None):
             yield model
 
 
+class ChangeConsumer(object):
+    '''Read, in batches, the :class:`stdnet.change_record` appended by a
+backend with a ``changelog`` when instances are committed or deleted. The
+offset of the last acknowledged change is stored in the backend so that a
+consumer can resume from any process. Obtained from :meth:`Router.consumer`::
+
+    consumer = models.consumer('search-indexer')
+    changes = consumer.read(500)
+    ...
+    consumer.ack(changes[-1])
+
+.. attribute:: backend
+
+    The :class:`stdnet.BackendDataServer` with the changelog.
+
+.. attribute:: name
+
+    The name of the consumer.
+'''
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def __repr__(self):
+        return '%s %s' % (self.name, self.backend)
+
+    def offset(self):
+        '''The sequence number of the last acknowledged change.'''
+        return self.backend.changes_offset(self.name)
+
+    def read(self, count=100):
+        '''Read at most ``count`` changes following the acknowledged offset.
+Reading does not move the offset, call :meth:`ack` once the changes are
+processed.'''
+        return self.backend.execute(self._read(count))
+
+    def ack(self, offset):
+        '''Acknowledge the changes up to ``offset``, a sequence number or a
+:class:`stdnet.change_record`.'''
+        if isinstance(offset, change_record):
+            offset = offset.seq
+        return self.backend.ack_changes(self.name, offset)
+
+    def _read(self, count):
+        offset = yield self.offset()
+        yield self.backend.changes(offset, count)
+
+
 def model_iterator(application, include_related=True, exclude=None):
     '''A generator of :class:`StdModel` classes found in *application*.
 
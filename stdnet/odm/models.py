@@ -16,6 +16,7 @@ the main class of :mod:`stdnet.odm` module.'''
     _model_type = 'object'
     abstract = True
     _loadedfields = None
+    _related_batch = None
 
     def __init__(self, *args, **kwargs):
         meta = self._meta
@@ -271,6 +272,15 @@ proxy for the :attr:`Metaclass.pk` attribute.'''
                     qs = qs.load_only(*load_only)
                 if dont_load:
                     qs = qs.dont_load(*dont_load)
+                batch = self._related_batch
+                if batch and not (load_only or dont_load):
+                    # load the related instances of the whole batch
+                    batch = [i for i in batch if not hasattr(i, cache_name)
+                             and getattr(i, field.attname) is not None]
+                    ids = list(set((getattr(i, field.attname) for i in batch)))
+                    callback = partial(self.__set_batch_related_value, field,
+                                       batch)
+                    return qs.filter(**{pkname: ids}).items(callback=callback)
                 callback = partial(self.__set_related_value, field)
                 return qs.filter(**{pkname: val}).items(callback=callback)
 
@@ -286,6 +296,17 @@ proxy for the :attr:`Metaclass.pk` attribute.'''
         setattr(self, field.get_cache_name(), rel_obj)
         return rel_obj
 
+    def __set_batch_related_value(self, field, batch, items):
+        related = dict(((obj.pkvalue(), obj) for obj in items))
+        cache_name = field.get_cache_name()
+        for instance in batch:
+            rel_obj = related.get(getattr(instance, field.attname))
+            if rel_obj is not None:
+                setattr(instance, cache_name, rel_obj)
+        if not hasattr(self, cache_name):
+            return self.__set_related_value(field)
+        return getattr(self, cache_name)
+
 
 def create_model(name, *attributes, **params):
     '''Create a :class:`Model` class for objects requiring
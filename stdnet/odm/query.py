@@ -1,10 +1,20 @@
+import json
+import time
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from copy import copy
+from datetime import date, datetime
 from inspect import isgenerator
 from functools import partial
 from collections import Mapping
 
+try:
+    import numpy as ny
+except ImportError:     # pragma    nocover
+    ny = None
+
 from stdnet import range_lookups
-from stdnet.utils import JSPLITTER, iteritems, unique_tuple
+from stdnet.utils import (JSPLITTER, iteritems, unique_tuple, to_bytes,
+                          to_string, native_str)
 from stdnet.utils.exceptions import *
 
 from .globals import lookup_value
@@ -34,6 +44,48 @@ def update_dictionary(result, extra):
     return result
 
 
+def numpy_array(field, values, backend):
+    '''Convert the raw backend ``values`` of ``field`` into a numpy array.
+Numeric values are parsed in one step with ``nan`` for missing values,
+dates and datetimes are converted from their timestamps.'''
+    if field.type == 'related object':
+        # foreign keys store the primary key of the related model
+        field = field.relmodel._meta.pk
+    python_type = getattr(field, 'python_type', None)
+    if field.type == 'auto':
+        python_type = int
+    elif field.internal_type != 'numeric':
+        python_type = None
+    if python_type is None:
+        return ny.array([field.to_python(v, backend) for v in values],
+                        dtype=object)
+    values = ny.array(values, dtype=object)
+    missing = (values == None) | (values == '') | (values == b'')
+    values[missing] = 'nan'
+    numbers = values.astype(float)
+    if python_type is datetime:
+        return timestamps_array(ny.round(numbers * 1e6), missing,
+                                'datetime64[us]')
+    elif python_type is date:
+        # dates are stored as the timestamp of the local midnight, which is
+        # at most one hour from the standard time midnight
+        return timestamps_array(ny.round((numbers - time.timezone) / 86400.),
+                                missing, 'datetime64[D]')
+    elif python_type is float or missing.any():
+        return numbers
+    elif python_type is bool:
+        return numbers.astype(bool)
+    else:
+        return values.astype(ny.int64)
+
+
+def timestamps_array(values, missing, dtype):
+    values[missing] = 0
+    values = values.astype(ny.int64)
+    values[missing] = ny.iinfo(ny.int64).min    # NaT
+    return values.view(dtype)
+
+
 def get_lookups(attname, field_lookups):
     lookups = field_lookups.get(attname)
     if lookups is None:
@@ -525,7 +577,11 @@ each element in the query. The *coe* should reference an instance of
 follows the foreign-key relationship ``related``.
 
 :parameter related: A field name corresponding to a :class:`ForeignKey`
-    in :attr:`Query.model`.
+    in :attr:`Query.model`, a double underscored path of foreign keys such as
+    ``'instrument__issuer'``, or the name of a related manager for reverse
+    foreign keys and many-to-many relationships. In the latter case the
+    related instances are available, without further requests, via the
+    manager ``all`` method.
 :parameter related_fields: optional :class:`Field` names for the ``related``
     model to load. If not provided, all fields will be loaded.
 
@@ -539,11 +595,48 @@ in a generative way::
 
 :rtype: a new :class:`Query`.'''
         field = self._get_related_field(related)
-        if not field:
-            raise FieldError('"%s" is not a related field for "%s"' %
-                             (related, self._meta))
+        path = None
+        if field:
+            related = field.name
+        elif JSPLITTER in related:
+            path = self._meta.related_path(related)
+        if not field and not path:
+            if related not in self._meta.related:
+                raise FieldError('"%s" is not a related field for "%s"' %
+                                 (related, self._meta))
+            manager = self._meta.related[related]
+            if not manager.field.index:
+                # the manager cannot query a field which is not an index
+                raise QuerySetError('%s is not an index. Cannot load "%s".'
+                                    % (manager.field, related))
         q = self._clone()
-        return q._add_to_load_related(field, *related_fields)
+        if path:
+            # intermediate foreign keys are loaded too
+            bits = related.split(JSPLITTER)
+            for i in range(1, len(bits)):
+                name = JSPLITTER.join(bits[:i])
+                if not q.select_related or name not in q.select_related:
+                    q._add_to_load_related(name)
+        return q._add_to_load_related(related, *related_fields)
+
+    def batch_related(self, batch=True):
+        '''Lazy :class:`ForeignKey` fields of the instances loaded by this
+:class:`Query` are resolved in batches. The first time a related object is
+accessed, the related objects of all the instances loaded with it are
+fetched in a single request::
+
+    positions = session.query(Position).batch_related().all()
+    for p in positions:
+        # Only the first access performs a database roundtrip
+        i = p.instrument
+
+Unlike :meth:`load_related`, nothing is loaded unless it is accessed.
+
+:parameter batch: switch batching on or off. Default ``True``.
+:rtype: a new :class:`Query`.'''
+        q = self._clone()
+        q.data['batch_related'] = batch
+        return q
 
     def load_only(self, *fields):
         '''This is provides a :ref:`performance boost <increase-performance>`
@@ -560,7 +653,8 @@ data intensive fields you don't need.
                 bits = field.split(JSPLITTER)
                 related = self._get_related_field(bits[0])
                 if related:
-                    q._add_to_load_related(related, JSPLITTER.join(bits[1:]))
+                    q._add_to_load_related(related.name,
+                                           JSPLITTER.join(bits[1:]))
                     continue
             new_fields.append(field)
         if fields and not new_fields:
@@ -582,6 +676,162 @@ to load all fields except a subset specified by *fields*.
         q.exclude_fields = fs if fs else None
         return q
 
+    def values(self, *fields):
+        '''Return a new :class:`Query` which evaluates to a list of
+dictionaries mapping ``fields`` names to their values, rather than to model
+instances. It provides a :ref:`performance boost <increase-performance>`
+when only few fields are needed since instances are neither created nor
+added to the :attr:`session`::
+
+    qs = models.instrument.filter(ccy='EUR').values('id', 'name')
+
+:parameter fields: names of fields of :attr:`model`. If not provided all
+    scalar fields and the primary key are returned. When one of them is a
+    :class:`JSONField` stored as a dictionary all the instance data is loaded.
+:rtype: a new :class:`Query`.'''
+        return self._values(fields, 'dict')
+
+    def values_list(self, *fields, **kwargs):
+        '''Same as :meth:`values` but evaluates to a list of tuples. If
+``flat`` is ``True`` and only one field is given, it evaluates to a list of
+the field values.'''
+        flat = kwargs.pop('flat', False)
+        if flat and len(fields) != 1:
+            raise QuerySetError('values_list with flat=True requires one '
+                                'field only.')
+        return self._values(fields, 'flat' if flat else 'tuple')
+
+    def to_arrays(self, *fields, **kwargs):
+        '''Load ``fields`` of the matched instances into NumPy_ arrays without
+creating model instances. Instances are loaded ``batch`` at a time and each
+batch is converted in one step:
+
+* float fields into float arrays, integer and boolean fields into integer
+  and boolean arrays, or float arrays when values are missing. Missing
+  values are ``nan``.
+* date fields into ``datetime64[D]`` arrays and datetime fields into UTC
+  ``datetime64[us]`` arrays. Missing values are ``NaT``.
+* other fields into object arrays of python values.
+
+:parameter fields: names of fields of :attr:`model`. If not provided all
+    scalar fields and the primary key are loaded.
+:parameter batch: number of instances loaded at a time. Default ``10000``.
+:parameter structured: if ``True`` a structured array is returned rather than
+    a dictionary of arrays. Default ``False``.
+:return: a dictionary mapping field names to arrays or a structured array.
+
+.. _NumPy: http://www.numpy.org/
+'''
+        if ny is None:
+            raise ImproperlyConfigured('to_arrays requires numpy')
+        batch = kwargs.get('batch', 10000)
+        structured = kwargs.get('structured', False)
+        q = self._values(fields, 'raw')
+        return q.backend.execute(q._to_arrays(batch, structured),
+                                 lambda result: result[0])
+
+    def _to_arrays(self, batch, structured):
+        names, _ = self.data['values']
+        meta = self._meta
+        pk = meta.pk
+        fields = [meta.dfields[name] for name in names]
+        backend = self.backend
+        # batches are loaded by primary key from a snapshot of the matched
+        # ids, rather than slicing the query, which would run it again for
+        # every batch. The primary key is loaded to keep the query order.
+        ids = yield self.get_field(pk.name).all()
+        load = list(names)
+        if pk.name not in load:
+            load.append(pk.name)
+        index = load.index(pk.name)
+        query = self.session.query(self.model)
+        columns = [[] for _ in fields]
+        for start in range(0, len(ids), batch):
+            chunk = ids[start:start+batch]
+            position = dict(((id, n) for n, id in enumerate(chunk)))
+            rows = yield query.filter(**{pk.name: chunk})._values(
+                load, 'raw').all()
+            rows = sorted(rows, key=lambda row: position.get(
+                pk.to_python(row[index], backend), -1))
+            if rows:
+                for field, column, values in zip(fields, columns, zip(*rows)):
+                    column.append(numpy_array(field, values, backend))
+        arrays = [ny.concatenate(column) if column else
+                  numpy_array(field, (), backend)
+                  for field, column in zip(fields, columns)]
+        if structured:
+            result = ny.empty(len(arrays[0]), dtype=[
+                (native_str(name), a.dtype) for name, a in zip(names, arrays)])
+            for name, a in zip(names, arrays):
+                result[native_str(name)] = a
+        else:
+            result = dict(zip(names, arrays))
+        # asynchronous backends compare yielded values with a sentinel, which
+        # numpy arrays do elementwise
+        yield (result,)
+
+    def _values(self, fields, kind):
+        meta = self._meta
+        if not fields:
+            fields = [meta.pkname()]
+            fields.extend((f.name for f in meta.scalarfields))
+        for name in fields:
+            if name not in meta.dfields:
+                raise QuerySetError('Model "%s" has no field "%s".' %
+                                    (meta, name))
+        if any((meta.dfields[name].type == 'json object' and
+                not meta.dfields[name].as_string for name in fields)):
+            # the flattened keys of json fields stored as dictionaries are
+            # not known in advance, all the instance data is loaded
+            q = self._clone()
+            q.data['fields'] = None
+        else:
+            q = self.load_only(*fields)
+        q.data['values'] = (tuple(fields), kind)
+        return q
+
+    def after(self, cursor=None, limit=None):
+        '''Keyset pagination. Return a new :class:`Query` which loads at
+most ``limit`` instances following ``cursor`` in the query ordering.
+Unlike slicing, the cost of a page does not depend on how many instances
+precede it::
+
+    page = qs.after(None, 50).all()
+    next_page = qs.after(qs.cursor(page[-1]), 50).all()
+
+The query must be ordered by the model :attr:`Metaclass.ordering` or sorted,
+via :meth:`sort_by`, on one of the :attr:`Metaclass.sort_indexes`.
+
+:parameter cursor: a token obtained from :meth:`cursor`, an instance of
+    :attr:`model`, a score or ``None`` to start from the first instance.
+:parameter limit: optional maximum number of instances to load, a positive
+    integer.
+:rtype: a new :class:`Query`.'''
+        return self._seek(True, cursor, limit)
+
+    def before(self, cursor=None, limit=None):
+        '''Same as :meth:`after` but loads at most ``limit`` instances
+preceding ``cursor`` in the query ordering. Instances are still returned in
+the query ordering. With ``cursor=None`` the last page is loaded.'''
+        return self._seek(False, cursor, limit)
+
+    def cursor(self, instance):
+        '''An opaque token for ``instance`` which can be passed to
+:meth:`after` and :meth:`before`.'''
+        ordering, _ = self._seek_ordering()
+        value = instance
+        while ordering.nested:
+            value = getattr(value, ordering.field.name)
+            if not isinstance(value, ordering.field.relmodel):
+                raise QuerySetError('Cannot evaluate the cursor of "%s". '
+                                    'Related instance not available.'
+                                    % instance)
+            ordering = ordering.nested
+        value = getattr(value, ordering.field.attname)
+        score = ordering.field.scorefun(value) if value is not None else 0
+        data = json.dumps((score, to_string(instance.pkvalue())))
+        return native_str(urlsafe_b64encode(to_bytes(data)).rstrip(b'='))
+
     ##        METHODS FOR RETRIEVING DATA
 
     def __getitem__(self, slic):
@@ -753,6 +1003,45 @@ an exception is raised.
         else:
             return value
 
+    def _seek_ordering(self):
+        meta = self._meta
+        ordering = self.ordering
+        if ordering:
+            index = meta.sort_index(ordering)
+            if index:
+                return ordering, index
+        elif meta.ordering and not meta.ordering.auto:
+            return meta.ordering, None
+        raise QuerySetError('Keyset pagination on "%s" requires the model '
+                            'ordering or a sort index.' % meta)
+
+    def _seek(self, after, cursor, limit):
+        ordering, index = self._seek_ordering()
+        if limit is not None and limit < 1:
+            raise QuerySetError('Keyset pagination limit must be positive, '
+                                'got %s.' % limit)
+        score, id = None, None
+        if isinstance(cursor, self.model):
+            cursor = self.cursor(cursor)
+        if isinstance(cursor, (int, float)):
+            score = float(cursor)
+        elif cursor is not None:
+            try:
+                data = to_bytes(cursor)
+                data = urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+                score, id = json.loads(to_string(data))
+                score, id = float(score), native_str(id)
+            except (TypeError, ValueError):
+                raise QuerySetError('Invalid cursor "%s".' % cursor)
+        q = self._clone()
+        q.data['seek'] = {'after': after,
+                          'desc': ordering.desc,
+                          'index': index,
+                          'score': score,
+                          'id': id,
+                          'limit': limit}
+        return q
+
     def _get_related_field(self, related):
         meta = self._meta
         if related in meta.dfields:
@@ -760,7 +1049,7 @@ an exception is raised.
             if hasattr(field, 'relmodel'):
                 return field
 
-    def _add_to_load_related(self, field, *related_fields):
+    def _add_to_load_related(self, name, *related_fields):
         rf = unique_tuple((v for v in related_fields))
         # we need to copy the related dictionary including its values
         if self.select_related:
@@ -768,8 +1057,15 @@ an exception is raised.
         else:
             d = {}
         self.data['select_related'] = d
-        if field.name in d:
-            d[field.name] = unique_tuple(d[field.name], rf)
+        if name in d:
+            d[name] = unique_tuple(d[name], rf)
         else:
-            d[field.name] = rf
+            d[name] = rf
+        # intermediate models of nested paths must load the foreign keys
+        for path in d:
+            bits = path.split(JSPLITTER)
+            for i in range(1, len(bits)):
+                name = JSPLITTER.join(bits[:i])
+                if d.get(name) and bits[i] not in d[name]:
+                    d[name] += (bits[i],)
         return self
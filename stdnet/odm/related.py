@@ -197,6 +197,28 @@ via a simple attribute of the model.'''
     def relmodel(self):
         return self.field.relmodel
 
+    @property
+    def formodel(self):
+        '''The model of the instances returned by this manager.'''
+        return self.model
+
+    def get_cache_name(self):
+        return '_%s_cache' % self.field.related_name
+
+    def set_cache(self, instance, value):
+        '''Store the list of related instances ``value`` of ``instance``,
+loaded via :meth:`Query.load_related`.'''
+        setattr(instance, self.get_cache_name(), value)
+
+    def all(self):
+        # Instances loaded via Query.load_related are returned without
+        # querying the backend
+        if self.related_instance is not None:
+            cache = getattr(self.related_instance, self.get_cache_name(), None)
+            if cache is not None:
+                return cache
+        return super(One2ManyRelatedManager, self).all()
+
     def query(self, session=None):
         # Override query method to account for related instance if available
         query = super(One2ManyRelatedManager, self).query(session)
@@ -232,6 +254,7 @@ attribute of the model.'''
                                   % name)
         kwargs.update({self.name_formodel: value,
                        self.name_relmodel: self.related_instance})
+        self.related_instance.__dict__.pop(self.get_cache_name(), None)
         return self.session(session), self.model(**kwargs)
 
     def add(self, value, session=None, **kwargs):
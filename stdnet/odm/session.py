@@ -1,6 +1,6 @@
 from itertools import chain
 
-from stdnet import session_result, session_data, async
+from stdnet import session_result, session_data, async, multi_async
 from stdnet.utils import itervalues, iteritems
 from stdnet.utils.structures import OrderedDict
 from stdnet.utils.exceptions import *
@@ -286,15 +286,16 @@ empty keys associated with the model will exists after this operation.'''
             if dirty and transaction.signal_commit:
                 models.pre_commit.fire(model, instances=dirty,
                                        session=session)
+            bulk = transaction.bulk
             if be == rbe:
                 yield be, session_data(meta, dirty, deletes, queries,
-                                       structures)
+                                       structures, bulk)
             else:
                 if dirty or has_delete or structures:
                     yield be, session_data(meta, dirty, deletes, (),
-                                           structures)
+                                           structures, bulk)
                 if queries:
-                    yield rbe, session_data(meta, (), (), queries, ())
+                    yield rbe, session_data(meta, (), (), queries, (), bulk)
 
     def _add_structure(self, instance):
         instance.action = 'update'
@@ -352,6 +353,15 @@ class Transaction(object):
 
         default ``True``.
 
+    .. attribute:: bulk
+
+        If ``True`` instances are committed without updating the indices of
+        their models, which must be rebuilt once loading has finished via
+        the :meth:`Manager.rebuild_indices` method. Unique constraints are
+        checked when indices are rebuilt.
+
+        default ``False``.
+
     .. attribute:: deleted
 
         Dictionary of list of ids deleted from the backend server after a
@@ -367,11 +377,12 @@ class Transaction(object):
     on_result = None
 
     def __init__(self, session, name=None, signal_commit=True,
-                 signal_delete=True):
+                 signal_delete=True, bulk=False):
         self.name = name or 'transaction'
         self.session = session
         self.signal_commit = signal_commit
         self.signal_delete = signal_delete
+        self.bulk = bulk
         self.deleted = ModelDictionary()
         self.saved = ModelDictionary()
 
@@ -445,13 +456,18 @@ class Transaction(object):
     def _commit(self, session, callback):
         asy = False
         try:
-            asy = False
-            responses = []
-            for backend, data in session.backends_data():
-                responses.append(backend.execute_session(data))
-                asy = asy or backend.is_async()
+            backends_data = list(session.backends_data())
+            asy = any((backend.is_async() for backend, _ in backends_data))
+            parallel = session.router.parallel_commit and len(backends_data) > 1
+            if parallel and not asy:
+                responses = [self._parallel_execute(
+                    session.router.commit_pool, backends_data)]
+            else:
+                responses = [backend.execute_session(data)
+                             for backend, data in backends_data]
             if asy:
-                return async(self._async_commit(session, responses, callback))
+                return async(self._async_commit(session, responses, callback,
+                                                parallel))
             for response in responses:
                 tuple(self._post_commit(session, response))
             return callback() if callback else True
@@ -459,6 +475,21 @@ class Transaction(object):
             if not asy:
                 session.transaction = None
 
+    def _parallel_execute(self, pool, backends_data):
+        # Execute the session pipeline of each backend on a thread of
+        # ``pool``. The responses are merged into a single response, with
+        # the errors of the backends which failed, so that the instances
+        # committed by the other backends are processed before raising.
+        results = [pool.apply_async(backend.execute_session, (data,))
+                   for backend, data in backends_data]
+        response = []
+        for result in results:
+            try:
+                response.extend(result.get())
+            except Exception as e:
+                response.append(e)
+        return response
+
     def _post_commit(self, session, response):
         signals = []
         exceptions = []
@@ -496,9 +527,10 @@ class Transaction(object):
                 error = str(exceptions[0])
             raise CommitException(error, failures=nf)
 
-    def _async_commit(self, session, responses, callback):
-        done = []
+    def _async_commit(self, session, responses, callback, parallel=False):
         try:
+            if parallel:
+                responses = yield multi_async(responses)
             for response in responses:
                 r = yield response
                 yield self._post_commit(session, r)
@@ -949,6 +981,14 @@ Equivalent to::
     '''
         return self.query().all()
 
+    def count(self):
+        '''Return the number of instances of :attr:`model` in the backend.
+Equivalent to::
+
+    self.query().count()
+    '''
+        return self.query().count()
+
     def create_all(self):
         '''A method which can implement table creation. For sql models. Does
 nothing for redis or mongo.'''
@@ -992,6 +1032,125 @@ a full text search value.'''
     def keys(self):
         return self.session().keys(self.model)
 
+    def sweep(self, limit=None):
+        '''Delete instances of a model with a :attr:`ModelMeta.ttl` which
+have expired. Instances related via a required :class:`ForeignKey` are
+deleted as well.
+
+:parameter limit: optional maximum number of expired instances to delete.
+:return: the list of deleted ids.'''
+        backend = self.backend
+        return backend.execute(backend.expired(self._meta, limit),
+                               self._sweep)
+
+    def _sweep(self, ids):
+        if ids:
+            qs = self.filter(**{self._meta.pkname(): ids})
+            # instances refreshed since they were read are not deleted
+            qs.data['expired'] = True
+            return qs.delete()
+        return []
+
+    def rebuild_indices(self, chunk=1000):
+        '''Rebuild all the indices of the model from the stored instances
+in a single pass, ``chunk`` instances at a time. Used after instances are
+committed by a :attr:`Transaction.bulk` transaction.
+Instances are indexed in the alphabetical order of their ids and those
+violating a unique constraint, of two instances the one with the greater id,
+are deleted and reported together, once all instances are indexed, by a
+:class:`stdnet.CommitException`.
+
+:parameter chunk: number of instances indexed by each call to the backend
+    server. Default ``1000``.
+:return: the number of instances indexed.'''
+        backend = self.backend
+        return backend.execute(backend.rebuild_indices(self._meta, chunk),
+                               self._rebuild_indices)
+
+    def _rebuild_indices(self, result):
+        count, failures = result
+        if failures:
+            error = '\n'.join(('%s %s: %s' % (self.model, id, e)
+                               for id, e in failures))
+            raise CommitException(error, failures=len(failures))
+        return count
+
+    def build_index(self, field, chunk=1000, throttle=0):
+        '''Build the index of ``field`` for the stored instances, for example
+after adding ``index=True`` to a field. Instances are walked ``chunk`` at a
+time, through a snapshot of the ids stored when the build starts, sleeping
+``throttle`` seconds between chunks, and the index is built into shadow keys
+which replace the current index once finished. Instances committed meanwhile
+update the shadow keys as well. If the build fails the shadow keys are
+removed.
+
+:parameter field: the name of an indexed field.
+:parameter chunk: number of instances processed by each call to the backend
+    server. Default ``1000``.
+:parameter throttle: seconds to wait between chunks. Default ``0``.
+:return: a list of :class:`stdnet.index_error` for instances violating a
+    unique constraint.'''
+        return self.backend.build_index(self._meta, self._index_field(field),
+                                        chunk, throttle)
+
+    def check_index(self, field, repair=False, chunk=1000, throttle=0):
+        '''Build the index of ``field`` as :meth:`build_index` does and
+compare it with the current index.
+
+:parameter repair: if ``True`` the current index is replaced by the built
+    one.
+:return: a list of :class:`stdnet.index_error` with the inconsistencies
+    found.'''
+        return self.backend.build_index(self._meta, self._index_field(field),
+                                        chunk, throttle, compare=True,
+                                        swap=repair)
+
+    def _index_field(self, name):
+        field = self._meta.dfields.get(name)
+        if field is None or field not in self._meta.indices:
+            raise FieldError('"%s" is not an indexed field of %s.' %
+                             (name, self.model))
+        return field
+
+    def incr(self, instance, field, by=1):
+        '''Atomically increment the numeric ``field`` of ``instance`` by
+``by`` in the backend server, without loading or saving the instance. Indices
+and the ordering of the model are updated when they depend on ``field``.
+
+:parameter instance: a model instance or its primary key.
+:parameter field: the name of an :class:`IntegerField` or a
+    :class:`FloatField`.
+:parameter by: the increment, negative to decrement. Default ``1``.
+:return: the new value of ``field``, also set on ``instance`` when it is a
+    model instance.'''
+        meta = self._meta
+        name = field
+        field = meta.dfields.get(name)
+        if (field is None or field.internal_type != 'numeric' or
+                getattr(field, 'python_type', None) not in (int, float) or
+                field.primary_key or field.unique):
+            raise FieldError('Cannot increment "%s". Not a numeric, non '
+                             'unique, field.' % name)
+        id = instance
+        if isinstance(instance, self.model):
+            id = instance.pkvalue()
+        else:
+            instance = None
+        backend = self.backend
+        return backend.execute(
+            backend.incr(meta, id, field, field.python_type(by)),
+            lambda value: self._incr(instance, id, field, value))
+
+    def _incr(self, instance, id, field, value):
+        if value is None:
+            raise self.model.DoesNotExist('%s with %s %s not found' %
+                                          (self.model, self._meta.pkname(),
+                                           id))
+        value = field.to_python(value, self.backend)
+        if instance is not None:
+            setattr(instance, field.attname, value)
+        return value
+
     def pkvalue(self, instance):
         '''Return the primary key value for ``instance``.'''
         return instance.pkvalue()
@@ -1,10 +1,18 @@
+import os
 import logging
 import json
 import sys
 import csv
+import time
+from copy import copy
+from gzip import GzipFile
+from collections import deque
 from inspect import isclass
+from multiprocessing.pool import ThreadPool
 
-from stdnet.utils import StringIO
+from stdnet import async
+from stdnet.utils import StringIO, BytesIO, to_bytes, to_string
+from stdnet.utils.exceptions import QuerySetError
 
 from .globals import get_model_from_hash
 
@@ -13,7 +21,9 @@ __all__ = ['get_serializer',
            'unregister_serializer',
            'all_serializers',
            'Serializer',
-           'JsonSerializer']
+           'JsonSerializer',
+           'NdjsonSerializer',
+           'BulkLoader']
 
 
 LOGGER = logging.getLogger('stdnet.odm')
@@ -84,12 +94,19 @@ to each :class:`Serializer` implementation.
 '''
     default_options = {}
     arguments = ()
+    loader = None
 
     def __init__(self, **options):
         opts = self.default_options.copy()
         opts.update(((v, options[v]) for v in options if v in self.arguments))
         self.options = opts
 
+    @property
+    def offset(self):
+        '''The :attr:`BulkLoader.offset` of the last call to :meth:`load`,
+for serializers loading with a :class:`BulkLoader`.'''
+        return self.loader.offset if self.loader is not None else 0
+
     @property
     def data(self):
         '''CList of data to dump into a stream.'''
@@ -180,10 +197,130 @@ model, the model will get loaded otherwise it will skip the loading.'''
         pass
 
 
+class BulkLoader(object):
+    '''Commit rows of serialized data to a :class:`Router` in transactions
+of ``batch`` rows, with at most ``pipeline`` transactions committed
+concurrently by a pool of threads. With asynchronous backends transactions
+are committed by the event loop instead, and :meth:`load` does not block.
+
+:parameter models: the :class:`Router` with the models to load.
+:parameter batch: number of rows in a transaction. Default ``1000``.
+:parameter pipeline: number of transactions in flight. Default ``4``.
+:parameter signal_commit: fire the commit signals of the :class:`Router`.
+:parameter bulk: commit with :attr:`Transaction.bulk` transactions and
+    rebuild the indices of the loaded models, via
+    :meth:`Manager.rebuild_indices`, once all rows are committed.
+
+.. attribute:: offset
+
+    The number of rows committed, in order. When loading fails it is the
+    offset to resume from. Rows following it may have been committed
+    already, they are overridden when loaded again.
+
+.. attribute:: on_result
+
+    ``True`` once the last :meth:`load` committed all rows, or the
+    asynchronous result of the load when backends are asynchronous.
+'''
+    on_result = None
+
+    def __init__(self, models, batch=1000, pipeline=4, signal_commit=True,
+                 bulk=False):
+        self.models = models
+        self.batch = max(batch, 1)
+        self.pipeline = max(pipeline, 1)
+        self.signal_commit = signal_commit
+        self.bulk = bulk
+        self.offset = 0
+
+    def load(self, rows, offset=0):
+        '''Load ``rows``, an iterable over ``(model, data)`` pairs where
+``data`` is passed to :meth:`StdModel.from_base64_data`. A ``None`` row is
+counted but not loaded.
+
+:parameter offset: number of rows to skip.
+:return: the :attr:`offset` after all rows are committed, or the
+    :attr:`on_result` called back with it when backends are asynchronous.'''
+        self.offset = offset
+        self.loaded = set()
+        models = self.models
+        if any((models[m].backend.is_async()
+                for m in models.registered_models)):
+            self.on_result = async(self._async_load(rows, offset))
+            return self.on_result
+        pending = deque()
+        pool = ThreadPool(self.pipeline)
+        try:
+            for size, items in self._batches(rows, offset):
+                pending.append((size, pool.apply_async(self._commit,
+                                                       (items,))))
+                if len(pending) >= self.pipeline:
+                    self._done(*pending.popleft())
+        finally:
+            # batches in flight are committed before failures propagate
+            try:
+                while pending:
+                    self._done(*pending.popleft())
+            finally:
+                pool.close()
+        if self.bulk:
+            for model in self.loaded:
+                self.models[model].rebuild_indices()
+        self.on_result = True
+        return self.offset
+
+    def _async_load(self, rows, offset):
+        pending = deque()
+        for size, items in self._batches(rows, offset):
+            pending.append((size, self._commit(items)))
+            if len(pending) >= self.pipeline:
+                size, result = pending.popleft()
+                yield result
+                self.offset += size
+        while pending:
+            size, result = pending.popleft()
+            yield result
+            self.offset += size
+        if self.bulk:
+            for model in self.loaded:
+                yield self.models[model].rebuild_indices()
+        yield self.offset
+
+    def _batches(self, rows, offset):
+        size, items = 0, []
+        for n, row in enumerate(rows):
+            if n < offset:
+                continue
+            size += 1
+            if row is not None:
+                self.loaded.add(row[0])
+                items.append(row)
+            if size == self.batch:
+                yield size, items
+                size, items = 0, []
+        if size:
+            yield size, items
+
+    def _commit(self, items):
+        session = self.models.session()
+        with session.begin(signal_commit=self.signal_commit,
+                           bulk=self.bulk) as t:
+            for model, data in items:
+                t.add(model.from_base64_data(**data))
+        return t.on_result
+
+    def _done(self, size, result):
+        result.get()
+        self.offset += size
+
+
 class CsvSerializer(Serializer):
     '''A csv serializer for single model. It serialize/unserialize a model
-query into a csv file.'''
-    default_options = {'lineterminator': '\n'}
+query into a csv file. Loading is performed by a :class:`BulkLoader` with
+the *batch*, *pipeline* and *bulk* options.'''
+    default_options = {'lineterminator': '\n', 'batch': 1000, 'pipeline': 4,
+                       'bulk': False}
+    arguments = ('batch', 'pipeline', 'bulk')
 
     def dump(self, qs):
         if self.data:
@@ -212,21 +349,200 @@ query into a csv file.'''
             fieldnames = self.data[0]['fieldnames']
             data = self.data[0]['data']
             if data:
-                w = csv.DictWriter(stream, fieldnames, **self.options)
+                w = csv.DictWriter(stream, fieldnames, **self.csv_options)
                 writeheader(w)
                 for row in data:
                     w.writerow(row)
         return stream
 
-    def load(self, models, stream, model=None):
+    @property
+    def csv_options(self):
+        return dict(((k, v) for k, v in self.options.items()
+                     if k not in self.arguments))
+
+    def load(self, models, stream, model=None, offset=0):
+        '''Load the csv ``stream`` into ``model``. The first ``offset``
+rows, after the header, are skipped.'''
         if not model:
             raise ValueError('Model is required when loading from csv file')
-        r = csv.DictReader(stream, **self.options)
-        with models.session().begin() as t:
-            for item_data in r:
-                t.add(model.from_base64_data(**item_data))
-        return t.on_result
+        r = csv.DictReader(stream, **self.csv_options)
+        self.loader = BulkLoader(models, self.options['batch'],
+                                 self.options['pipeline'],
+                                 bulk=self.options['bulk'])
+        self.loader.load(((model, row) for row in r), offset)
+        return self.loader.on_result
+
+
+class NdjsonSerializer(Serializer):
+    '''A streaming :class:`Serializer` which writes one json document per
+line, the model hash and the instance data. Queries added by :meth:`dump` are
+not loaded until :meth:`write` walks them in batches, with
+:meth:`Query.after` when the query is not filtered and supports keyset
+pagination, or else over a snapshot of the matched ids, so that memory does
+not grow with the number of instances. Instances are removed from the query session once written.
+
+It has four options: the *batch* size, default ``1000``, *gzip* for
+compressed streams, default ``False``, *pipeline*, the number of batches
+committed concurrently by the :class:`BulkLoader` used by :meth:`load`,
+default ``4``, and *bulk*, to load without updating indices and rebuild them
+at the end, default ``False``.
+
+.. attribute:: stats
+
+    Dictionary mapping model names to the number of instances written,
+    the time taken and the instances per second.
+
+.. attribute:: offset
+
+    The number of lines loaded by the last call to :meth:`load`. Check
+    :attr:`BulkLoader.offset`.
+'''
+    default_options = {'batch': 1000, 'gzip': False, 'pipeline': 4,
+                       'bulk': False}
+    arguments = ('batch', 'gzip', 'pipeline', 'bulk')
+
+    def __init__(self, **options):
+        super(NdjsonSerializer, self).__init__(**options)
+        self.stats = {}
+
+    def dump(self, qs):
+        self.data.append(qs)
+
+    def write(self, stream=None):
+        if stream is None:
+            stream = BytesIO() if self.options['gzip'] else StringIO()
+        return self._write(self.data, stream)
+
+    def write_files(self, path, workers=4):
+        '''Write each query added by :meth:`dump` to its own file in the
+``path`` directory, using a pool of ``workers`` threads. Files are named after
+the model with the ``.ndjson`` extension, ``.ndjson.gz`` when *gzip* is on.
+
+:return: the list of file paths.'''
+        ext = '.ndjson.gz' if self.options['gzip'] else '.ndjson'
+        files = [(qs, os.path.join(path, str(qs._meta) + ext))
+                 for qs in self.data]
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(self._write_file, files)
+        finally:
+            pool.close()
+
+    def write_query(self, qs, stream):
+        '''Write the instances of ``qs``, a :class:`Query` or an iterable
+over instances, into ``stream``, one per line.'''
+        query = hasattr(qs, 'backend_query')
+        gzip = self.options['gzip']
+        start = time.time()
+        rows, meta = 0, None
+        for items in self._batches(qs):
+            lines = []
+            for obj in items:
+                meta = obj._meta
+                lines.append(json.dumps([meta.hash, obj.tojson()]))
+                if query:
+                    qs.session.expunge(obj)
+            lines.append('')
+            lines = '\n'.join(lines)
+            stream.write(to_bytes(lines) if gzip else lines)
+            rows += len(items)
+        if meta is not None:
+            seconds = time.time() - start
+            rate = rows / seconds if seconds else 0
+            self.stats[str(meta)] = {'rows': rows, 'seconds': seconds,
+                                     'rate': rate}
+            LOGGER.info('Dumped %s instances of %s in %.2f seconds, %d per '
+                        'second', rows, meta, seconds, rate)
+
+    def load(self, models, stream, model=None, offset=0):
+        '''Load the instances in ``stream`` in batches. The first ``offset``
+lines are skipped.'''
+        if self.options['gzip']:
+            stream = GzipFile(fileobj=stream, mode='rb')
+        self.loader = BulkLoader(models, self.options['batch'],
+                                 self.options['pipeline'],
+                                 signal_commit=False,
+                                 bulk=self.options['bulk'])
+        return self.loader.load(self._rows(stream, model), offset)
+
+    def _batches(self, qs):
+        batch = self.options['batch']
+        if not hasattr(qs, 'backend_query'):
+            items = list(qs)
+            for start in range(0, len(items), batch):
+                yield items[start:start+batch]
+            return
+        try:
+            ordering, _ = qs._seek_ordering()
+        except QuerySetError:
+            ordering = None
+        # auto ids are not known, and not scored, when instances are committed.
+        # Pages of a filtered query would run the filter again, each of them.
+        filtered = (qs.fargs or qs.eargs or qs.unions or qs.intersections or
+                    qs.text or qs.data.get('where'))
+        if (ordering is not None and ordering.field is not qs._meta.pk and
+                not filtered):
+            page = qs.after(None, batch)
+            while True:
+                items = page.all()
+                if items:
+                    yield items
+                if len(items) < batch:
+                    break
+                page = qs.after(qs.cursor(items[-1]), batch)
+        else:
+            # page through a snapshot of the matched ids rather than slicing
+            # the query, which would run it again for every batch
+            pkname = qs._meta.pkname()
+            ids = qs.get_field(pkname).all()
+            query = qs.session.query(qs.model)
+            # the instances are loaded as the query would load them
+            query.exclude_fields = qs.exclude_fields
+            for name in ('fields', 'select_related', 'batch_related'):
+                query.data[name] = copy(qs.data.get(name))
+            for start in range(0, len(ids), batch):
+                chunk = ids[start:start+batch]
+                position = dict(((pk, n) for n, pk in enumerate(chunk)))
+                items = query.filter(**{pkname: chunk}).all()
+                items = sorted(items, key=lambda obj: position[obj.pkvalue()])
+                if items:
+                    yield items
+
+    def _write(self, queries, stream):
+        gzip = self.options['gzip']
+        out = GzipFile(fileobj=stream, mode='wb') if gzip else stream
+        try:
+            for qs in queries:
+                self.write_query(qs, out)
+        finally:
+            if gzip:
+                out.close()
+        return stream
+
+    def _write_file(self, args):
+        qs, path = args
+        with open(path, 'wb' if self.options['gzip'] else 'w') as stream:
+            self._write((qs,), stream)
+        return path
+
+    def _rows(self, stream, model):
+        for line in stream:
+            line = to_string(line).strip()
+            if not line:
+                # blank lines are counted so that offsets are line numbers
+                yield None
+                continue
+            hash, data = json.loads(line)
+            row_model = get_model_from_hash(hash)
+            if not row_model:
+                LOGGER.error('Could not load model %s', hash)
+                yield None
+            elif model is None or row_model is model:
+                yield row_model, data
+            else:
+                yield None
 
 
 register_serializer('json', JsonSerializer)
 register_serializer('csv', CsvSerializer)
+register_serializer('ndjson', NdjsonSerializer)
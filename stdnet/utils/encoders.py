@@ -18,22 +18,39 @@ These are all available :class:`Encoder`:
 
 .. autoclass:: Json
 
+.. autoclass:: Msgpack
+
 .. autoclass:: PythonPickle
 
 .. autoclass:: DateTimeConverter
 
 .. autoclass:: DateConverter
+
+.. autoclass:: Compressor
 '''
 import json
 import logging
+import zlib
 
 from datetime import datetime, date
+from decimal import Decimal
 from struct import pack, unpack
 
 from stdnet.utils import (JSONDateDecimalEncoder, pickle,
                           JSONDateDecimalEncoder, DefaultJSONHook,
                           ispy3k, date2timestamp, timestamp2date,
                           string_type)
+from stdnet.utils.exceptions import ImproperlyConfigured
+
+try:
+    import lzma
+except ImportError:     # pragma    nocover
+    lzma = None
+
+try:
+    import msgpack
+except ImportError:     # pragma    nocover
+    msgpack = None
 
 nan = float('nan')
 
@@ -220,6 +237,66 @@ remote data structures.'''
         return json.loads(x, object_hook=self.object_hook)
 
 
+class Msgpack(Encoder):
+    '''A compact binary encoder based on MessagePack_. Like :class:`Json` it
+maintains ``date``, ``datetime`` and ``Decimal`` values, which are stored as
+MessagePack extension types, but it is faster and its output is smaller.
+Encoded data starts with a null byte followed by ``m``, data without the
+header, for example data saved before the encoder was used, is loaded with
+the ``fallback`` encoder.
+
+:parameter fallback: the :class:`Encoder` loading data without the header.
+    Default :class:`Json`.
+
+.. _MessagePack: http://msgpack.org/
+'''
+    type = bytes
+    header = b'\x00m'
+    DATETIME, DATE, DECIMAL = 1, 2, 3
+
+    def __init__(self, fallback=None, charset='utf-8'):
+        if msgpack is None:
+            raise ImproperlyConfigured('Msgpack encoder requires the msgpack '
+                                       'module.')
+        self.fallback = fallback or Json(charset)
+
+    def dumps(self, x):
+        # on python 2 strings are loaded as unicode, as with Json
+        return self.header + msgpack.packb(x, default=self._default,
+                                           use_bin_type=ispy3k)
+
+    def loads(self, x):
+        if isinstance(x, bytes) and x[:2] == self.header:
+            return msgpack.unpackb(x[2:], ext_hook=self._ext_hook,
+                                   raw=False)
+        return self.fallback.loads(x)
+
+    def _default(self, obj):
+        if hasattr(obj, 'tojson'):
+            return obj.tojson()
+        elif isinstance(obj, datetime):
+            return msgpack.ExtType(self.DATETIME, pack(
+                '>HBBBBBI', obj.year, obj.month, obj.day, obj.hour,
+                obj.minute, obj.second, obj.microsecond))
+        elif isinstance(obj, date):
+            return msgpack.ExtType(self.DATE, pack('>HBB', obj.year,
+                                                   obj.month, obj.day))
+        elif isinstance(obj, Decimal):
+            return msgpack.ExtType(self.DECIMAL, str(obj).encode('ascii'))
+        elif hasattr(obj, 'tolist'):
+            return obj.tolist()
+        raise TypeError('%r is not serializable' % obj)
+
+    def _ext_hook(self, code, data):
+        if code == self.DATETIME:
+            return datetime(*unpack('>HBBBBBI', data))
+        elif code == self.DATE:
+            return date(*unpack('>HBB', data))
+        elif code == self.DECIMAL:
+            return Decimal(data.decode('ascii'))
+        return msgpack.ExtType(code, data)
+
+
 class DateTimeConverter(Encoder):
     '''Convert to and from python ``datetime`` objects and unix timestamps'''
     type = datetime
@@ -258,3 +335,67 @@ class CompactDouble(Encoder):
             return self.nan
         else:
             return unpack('>d', value)[0]
+
+
+class Compressor(Encoder):
+    '''Compress data longer than ``threshold`` bytes with the ``zlib`` or
+``lzma`` ``method``. Compressed data starts with a null header byte followed by
+the method identifier, data which is not compressed is left unchanged. Data
+not starting with the header, for example data saved before compression was
+enabled, is loaded unchanged. Data which cannot be decompressed is logged and
+loaded unchanged.
+
+:parameter method: the compression method, ``zlib`` or ``lzma``.
+:parameter threshold: the minimum size in bytes of compressed data.
+:parameter level: optional compression level or ``lzma`` preset.
+'''
+    type = bytes
+    header = b'\x00'
+    methods = {'zlib': b'z', 'lzma': b'x'}
+
+    def __init__(self, method='zlib', threshold=1024, level=None,
+                 charset='utf-8'):
+        if method not in self.methods:
+            raise ImproperlyConfigured('Unknown compression method "%s".'
+                                       % method)
+        elif method == 'lzma' and lzma is None:
+            raise ImproperlyConfigured('lzma compression requires the lzma '
+                                       'module.')
+        self.method = method
+        self.threshold = threshold
+        self.level = level
+        self.charset = charset
+        self.prefix = self.header + self.methods[method]
+        self.errors = (zlib.error,)
+        if lzma is not None:
+            self.errors += (lzma.LZMAError,)
+
+    def dumps(self, x):
+        if x is None:
+            return x
+        if not isinstance(x, bytes):
+            x = x.encode(self.charset)
+        if len(x) >= self.threshold:
+            if self.method == 'zlib':
+                data = zlib.compress(x, 6 if self.level is None else
+                                     self.level)
+            else:
+                data = lzma.compress(x, preset=self.level)
+            data = self.prefix + data
+            # keep incompressible data as it is
+            if len(data) < len(x):
+                return data
+        return x
+
+    def loads(self, x):
+        if isinstance(x, bytes) and x[:1] == self.header:
+            method = x[1:2]
+            try:
+                if method == self.methods['zlib']:
+                    return zlib.decompress(x[2:])
+                elif method == self.methods['lzma'] and lzma is not None:
+                    return lzma.decompress(x[2:])
+            except self.errors:
+                LOGGER.warning('Could not decompress %d bytes, loading them '
+                               'unchanged', len(x))
+        return x
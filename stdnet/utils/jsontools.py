@@ -14,6 +14,12 @@ flat_to_nested
 ~~~~~~~~~~~~~~~~~~~~~~
 .. autofunction:: flat_to_nested
 
+KeyPaths
+~~~~~~~~~~~~~~~~~~~~~~
+.. autoclass:: KeyPaths
+   :members:
+   :member-order: bysource
+
 addmul_number_dicts
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~
 .. autofunction:: addmul_number_dicts
@@ -32,7 +38,7 @@ __ALL__ = ['JSPLITTER', 'EMPTYJSON',
            'totimestamp2', 'todatetime',
            'JSONDateDecimalEncoder', 'date_decimal_hook',
            'DefaultJSONEncoder', 'DefaultJSONHook',
-           'flat_to_nested', 'dict_flat_generator',
+           'flat_to_nested', 'dict_flat_generator', 'KeyPaths',
            'addmul_number_dicts']
 
 JSPLITTER = '__'
@@ -178,6 +184,119 @@ def dict_flat_generator(value, attname=None, splitter=JSPLITTER,
                 yield k, v2
 
 
+class KeyPaths(object):
+    '''Convert dictionaries to and from their flat representation, like
+:func:`dict_flat_generator` and :func:`flat_to_nested`, caching the split
+key paths and the joined flat keys so that documents with the same keys are
+converted without string splitting and formatting.
+
+:parameter attname: optional attribute name prefixing flat keys.
+:parameter separator: optional separator. Default ``"__"``.
+:parameter max_size: the caches are cleared when they hold more than this
+    number of keys. Default ``10000``.
+'''
+    def __init__(self, attname=None, separator=None, max_size=10000):
+        self.attname = attname
+        self.separator = separator or JSPLITTER
+        self.max_size = max_size
+        self._paths = {}
+        self._keys = {}
+
+    def path(self, key):
+        '''The tuple of keys of the flat ``key``, without the
+:attr:`attname`. ``None`` if ``key`` is not prefixed by :attr:`attname`.'''
+        paths = self._paths
+        try:
+            return paths[key]
+        except KeyError:
+            keys = key.split(self.separator)
+            if self.attname:
+                keys = tuple(keys[1:]) if keys[0] == self.attname else None
+            else:
+                keys = tuple(keys)
+            if len(paths) >= self.max_size:
+                paths.clear()
+            paths[key] = keys
+            return keys
+
+    def flat(self, value, dumps=None, error=ValueError):
+        '''Convert the nested dictionary ``value`` into a flat dictionary.'''
+        if not isinstance(value, dict):
+            raise error('Cannot assign a non dictionary to a JSON field')
+        data = {}
+        if len(self._keys) >= self.max_size:
+            self._keys.clear()
+        self._flat(value, None, data, dumps, error)
+        return data
+
+    def nested(self, data, instance=None, loads=None):
+        '''Convert the flat dictionary ``data`` into a nested dictionary.
+If an ``instance`` is given, flat values are set as its attributes.'''
+        path = self.path
+        val = {}
+        flat_vals = {}
+        for key, value in iteritems(data):
+            if value is None:
+                continue
+            keys = path(key)
+            if keys is None:
+                continue
+            if loads:
+                value = loads(value)
+            if not keys:
+                if value is None:
+                    val = flat_vals = {}
+                    break
+                else:
+                    continue
+            else:
+                flat_vals[key] = value
+            d = val
+            for k in keys[:-1]:
+                if k not in d:
+                    nd = d[k] = {}
+                else:
+                    nd = d[k]
+                    if not isinstance(nd, dict):
+                        nd = d[k] = {'': nd}
+                d = nd
+            lk = keys[-1]
+            if lk not in d:
+                d[lk] = value
+            else:
+                d[lk][''] = value
+        if instance and flat_vals:
+            for attr, value in iteritems(flat_vals):
+                setattr(instance, attr, value)
+        return val
+
+    def _flat(self, value, prefix, data, dumps, error):
+        keys = self._keys
+        for field in value:
+            val = value[field]
+            if field:
+                try:
+                    key, name = keys[(prefix, field)]
+                except KeyError:
+                    key = '%s%s%s' % (prefix, self.separator,
+                                      field) if prefix else field
+                    name = self._name(key)
+                    keys[(prefix, field)] = key, name
+                if isinstance(val, dict):
+                    self._flat(val, key, data, dumps, error)
+                    continue
+            elif not prefix:
+                raise error('Cannot assign a non dictionary to a JSON field')
+            else:
+                name = self._name(prefix)
+            data[name] = dumps(val) if dumps else val
+
+    def _name(self, key):
+        if self.attname:
+            return '%s%s%s' % (self.attname, self.separator, key)
+        return key
+
+
 def value_type(data):
     v = None
     for d in data:
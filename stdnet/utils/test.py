@@ -210,11 +210,11 @@ after the :meth:`setUpClass` was called. By default it does nothing.'''
 
 :param instance: the :class:`StdModel` to check the primary key ``value``.
 :param value: the value of the id to check against.
-:param exact: if ``True`` the exact value must be matched. For redis backend
-    this parameter is not used.
+:param exact: if ``True`` the exact value must be matched. For redis and
+    memory backends this parameter is not used.
 '''
         pk = instance.pkvalue()
-        if exact or self.backend.name == 'redis':
+        if exact or self.backend.name in ('redis', 'memory'):
             self.assertEqual(pk, value)
         elif self.backend.name == 'mongo':
             if instance._meta.pk.type == 'auto':
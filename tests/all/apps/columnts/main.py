@@ -92,6 +92,7 @@ class tsdata(object):
 
 class ColumnMixin(object):
     '''Used by all tests on ColumnTS'''
+    multipledb = 'redis'
     structure = ColumnTS
     name = 'columnts'
     data_cls = ColumnData
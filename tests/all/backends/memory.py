@@ -0,0 +1,86 @@
+'''Tests for the in-memory backend.'''
+from stdnet import (odm, getdb, ModelNotAvailable, QuerySetError,
+                    CommitException)
+from stdnet.utils import test
+from stdnet.backends.memoryb import sortedset
+
+from examples.models import Instrument, Fund, Position, Node
+
+
+class TestSortedSet(test.TestCase):
+    multipledb = False
+
+    def test_ties(self):
+        z = sortedset()
+        z.update(((1, 'c'), (1, 'a'), (0, 'z'), (1, 'b')))
+        self.assertEqual(list(z), ['z', 'a', 'b', 'c'])
+        self.assertEqual(z.rank('b'), 2)
+        self.assertEqual(z.remove('b'), 1)
+        self.assertEqual(list(z), ['z', 'a', 'c'])
+        self.assertEqual(z.rank('c'), 2)
+
+    def test_range(self):
+        z = sortedset()
+        z.update(((3, 'c'), (1, 'a'), (2, 'b')))
+        self.assertEqual(z.range(0, 1), [(1, 'a'), (2, 'b')])
+        self.assertEqual(z.range(-1, -1), [(3, 'c')])
+        self.assertEqual(z.range(0, 0, desc=True), [(3, 'c')])
+        self.assertEqual(z.range_by_score(2, 5), [(2, 'b'), (3, 'c')])
+        self.assertEqual(z.incr(5, 'a'), 6)
+        self.assertEqual(list(z), ['b', 'c', 'a'])
+
+
+class TestMemoryBackend(test.TestWrite):
+    multipledb = False
+    connection_string = 'memory://'
+    models = (Instrument, Fund, Position, Node)
+
+    def test_connection(self):
+        b = getdb('memory://?db=3')
+        self.assertEqual(b.name, 'memory')
+        self.assertEqual(b.connection_string, 'memory://127.0.0.1:0?db=3')
+        self.assertTrue(b.ping())
+        self.assertEqual(b, getdb(b.connection_string))
+        self.assertNotEqual(b, getdb('memory://?db=4'))
+
+    def test_missing_structure(self):
+        ts = odm.TS()
+        self.assertRaises(ModelNotAvailable, self.backend.structure, ts)
+
+    def test_query(self):
+        models = self.mapper
+        with models.session().begin() as t:
+            for name, ccy in (('a', 'EUR'), ('b', 'USD'), ('c', 'EUR')):
+                t.add(models.instrument(name=name, ccy=ccy, type='equity'))
+        yield t.on_result
+        qs = models.instrument.filter(ccy='EUR')
+        yield self.async.assertEqual(qs.count(), 2)
+        qs = models.instrument.exclude(ccy='EUR')
+        yield self.async.assertEqual(qs.count(), 1)
+        qs = yield models.instrument.query().sort_by('-name').all()
+        self.assertEqual([i.name for i in qs], ['c', 'b', 'a'])
+        qs = models.instrument.filter(name__startswith='b')
+        yield self.async.assertEqual(qs.count(), 1)
+        qs = models.instrument.query().where('this.name == "a"')
+        self.assertRaises(QuerySetError, qs.count)
+
+    def test_unique(self):
+        models = self.mapper
+        yield models.instrument.new(name='a', ccy='EUR', type='equity')
+        try:
+            yield models.instrument.new(name='a', ccy='USD', type='bond')
+        except CommitException:
+            pass
+        else:
+            raise AssertionError('CommitException not raised')
+        qs = yield models.instrument.filter(ccy='USD').all()
+        self.assertFalse(qs)
+
+    def test_delete_related(self):
+        models = self.mapper
+        root = yield models.node.new(weight=1)
+        child = yield models.node.new(parent=root, weight=2)
+        yield models.node.new(parent=child, weight=3)
+        yield models.node.new(weight=4)
+        yield models.node.filter(id=root.id).delete()
+        yield self.async.assertEqual(models.node.query().count(), 1)
@@ -188,4 +188,37 @@ class TestExtraClientCommands(TestCase):
         res = yield self.client.zpopbyscore('foo', 0, 4.5)
         self.assertEqual(res, [b'a', b'c', b'd'])
         rem = yield self.client.zrange('foo', 0, -1)
-        self.assertEqual(rem, [b'e'])
\ No newline at end of file
+        self.assertEqual(rem, [b'e'])
+
+
+class TestAutoPipeline(TestCase):
+
+    def setUp(self):
+        client = self.backend.client
+        if client.is_async:
+            self.skipTest('Auto-pipelining requires a synchronous client')
+        self.client = client.autopipeline(0.01).prefixed(self.namespace)
+
+    def test_concurrent_commands(self):
+        from threading import Thread
+        c = self.client
+        for n in range(20):
+            c.set('key%s' % n, n)
+        results = {}
+
+        def get(n):
+            results[n] = c.get('key%s' % n)
+        threads = [Thread(target=get, args=(n,)) for n in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, dict(((n, str(n).encode('utf-8'))
+                                        for n in range(20))))
+
+    def test_error_routed_to_caller(self):
+        c = self.client
+        c.set('foo', 'bla')
+        self.assertRaises(redisb.RedisError, c.hget, 'foo', 'a')
+        self.assertEqual(c.get('foo'), b'bla')
+        self.assertTrue(c.execute_script('countpattern', (), '*') >= 1)
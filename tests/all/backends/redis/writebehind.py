@@ -0,0 +1,127 @@
+'''Write-behind redis backend.'''
+from stdnet import odm, getdb
+from stdnet.utils import test
+
+from examples.models import Group, Node
+
+
+class TestWriteBehind(test.TestWrite):
+    multipledb = 'redis'
+    models = (Group, Node)
+
+    def writebehind(self):
+        if self.backend.is_async():
+            self.skipTest('Write-behind requires a synchronous client')
+        cs = self.backend.connection_string.replace('redis://',
+                                                    'writebehind://', 1)
+        backend = getdb(cs, flush_interval=0)
+        models = odm.Router(backend)
+        models.register(Group)
+        models.register(Node)
+        return backend, models
+
+    def test_connection(self):
+        backend, models = self.writebehind()
+        self.assertEqual(backend.name, 'writebehind')
+        self.assertEqual(backend.flush_interval, 0)
+        self.assertEqual(backend.flush_size, 1000)
+        self.assertEqual(getdb(backend.connection_string).buffer,
+                         backend.buffer)
+
+    def test_coalesce(self):
+        backend, models = self.writebehind()
+        with models.session().begin() as t:
+            t.add(models.group(id=1, name='a'))
+            t.add(models.group(id=2, name='b'))
+        self.assertEqual(backend.pending, 2)
+        group = t.saved[Group._meta][0]
+        self.assertEqual(group.id, 1)
+        group.name = 'c'
+        models.session().add(group)
+        self.assertEqual(backend.pending, 2)
+        self.assertEqual(self.mapper.group.query().count(), 0)
+        results = backend.drain()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(backend.pending, 0)
+        group = self.mapper.group.get(id=1)
+        self.assertEqual(group.name, 'c')
+
+    def test_read_drains(self):
+        backend, models = self.writebehind()
+        models.group.new(id=1, name='a')
+        self.assertEqual(backend.pending, 1)
+        self.assertEqual(models.group.query().count(), 1)
+        self.assertEqual(backend.pending, 0)
+
+    def test_read_drains_models(self):
+        backend, models = self.writebehind()
+        models.group.new(id=1, name='a')
+        models.node.new(id=1, weight=1)
+        self.assertEqual(backend.pending, 2)
+        self.assertEqual(models.node.query().count(), 1)
+        self.assertEqual(backend.pending, 1)
+        self.assertEqual(self.mapper.group.query().count(), 0)
+
+    def test_get_pending(self):
+        backend, models = self.writebehind()
+        models.group.new(id=1, name='a')
+        models.group.new(id=2, name='b')
+        group = models.group.get(id=1)
+        self.assertEqual(group.name, 'a')
+        self.assertTrue(group.get_state().persistent)
+        self.assertEqual(models.group.filter(id=(1, 2)).count(), 2)
+        self.assertEqual(models.group.filter(id=2).values('name').all(),
+                         [{'name': 'b'}])
+        self.assertEqual(backend.pending, 2)
+        self.assertEqual(self.mapper.group.query().count(), 0)
+        # not all instances are pending
+        self.assertEqual(models.group.filter(id=(1, 3)).count(), 1)
+        self.assertEqual(backend.pending, 0)
+
+    def test_read_drain_failure(self):
+        backend, models = self.writebehind()
+        models.group.new(id=1, name='a')
+
+        def fail(pending):
+            raise IOError('connection lost')
+        backend._drain = fail
+        self.assertRaises(IOError, models.group.query().count)
+        del backend._drain
+        self.assertEqual(backend.pending, 1)
+
+    def test_write_through(self):
+        backend, models = self.writebehind()
+        models.node.new(id=1, weight=1)
+        self.assertEqual(backend.pending, 1)
+        node = models.node.new(weight=2)
+        self.assertEqual(backend.pending, 0)
+        self.assertTrue(node.id)
+        self.assertEqual(self.mapper.node.query().count(), 2)
+
+    def test_drain_callback(self):
+        backend, models = self.writebehind()
+        drained = []
+        backend.bind_drain(lambda b, results: drained.extend(results))
+        models.node.new(id=1, weight=1)
+        self.assertFalse(drained)
+        backend.drain()
+        self.assertEqual(len(drained), 1)
+
+    def test_drain_failure(self):
+        backend, models = self.writebehind()
+        group = models.group.new(id=1, name='a')
+
+        def fail(pending):
+            # a newer write while the pipeline is being executed
+            group.name = 'b'
+            models.session().add(group)
+            raise IOError('connection lost')
+        backend._drain = fail
+        self.assertRaises(IOError, backend.drain)
+        del backend._drain
+        self.assertEqual(backend.pending, 1)
+        self.assertEqual(self.mapper.group.query().count(), 0)
+        backend.drain()
+        self.assertEqual(backend.pending, 0)
+        group = self.mapper.group.get(id=1)
+        self.assertEqual(group.name, 'b')
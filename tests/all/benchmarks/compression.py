@@ -0,0 +1,41 @@
+'''Compression of text fields. Run with::
+
+    python runtests.py benchmarks.compression --benchmark
+
+The benchmarks time the compression and decompression of a JSON document
+of about 50KB, ``test_ratio`` checks the size reduction.
+'''
+import json
+
+from stdnet.utils import test, encoders
+
+
+def document(size=500):
+    return json.dumps([{'id': i, 'name': 'item %s' % i, 'tags': ['a', 'b'],
+                        'value': i * 0.5, 'valid': bool(i % 2)}
+                       for i in range(size)])
+
+
+class ZlibBenchmark(test.TestCase):
+    __benchmark__ = True
+    method = 'zlib'
+
+    @classmethod
+    def after_setup(cls):
+        cls.compressor = encoders.Compressor(cls.method)
+        cls.document = document()
+        cls.compressed = cls.compressor.dumps(cls.document)
+
+    def test_dumps(self):
+        self.compressor.dumps(self.document)
+
+    def test_loads(self):
+        self.compressor.loads(self.compressed)
+
+    def test_ratio(self):
+        self.assertTrue(len(self.compressed) < len(self.document) // 4)
+
+
+@test.skipUnless(encoders.lzma, 'Requires lzma')
+class LzmaBenchmark(ZlibBenchmark):
+    method = 'lzma'
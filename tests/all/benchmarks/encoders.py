@@ -0,0 +1,60 @@
+'''Encoders of JSONField and PickleObjectField. Run with::
+
+    python runtests.py benchmarks.encoders --benchmark
+
+The benchmarks time the encoding and decoding of a list of records with
+dates and decimals.
+'''
+from datetime import date, datetime
+from decimal import Decimal
+
+from stdnet.utils import test, encoders, pickle
+
+
+def records(size=200):
+    return [{'id': i, 'name': 'item %s' % i, 'day': date(2014, 1, 1 + i % 28),
+             'time': datetime(2014, 1, 1, i % 24, i % 60),
+             'price': Decimal('%s.25' % i), 'tags': ['a', 'b'],
+             'value': i * 0.5} for i in range(size)]
+
+
+class JsonBenchmark(test.TestCase):
+    __benchmark__ = True
+
+    @classmethod
+    def after_setup(cls):
+        cls.encoder = cls.get_encoder()
+        cls.records = records()
+        cls.data = cls.encoder.dumps(cls.records)
+
+    @classmethod
+    def get_encoder(cls):
+        return encoders.Json()
+
+    def test_dumps(self):
+        self.encoder.dumps(self.records)
+
+    def test_loads(self):
+        self.assertEqual(len(self.encoder.loads(self.data)), 200)
+
+
+@test.skipUnless(encoders.msgpack, 'Requires msgpack')
+class MsgpackBenchmark(JsonBenchmark):
+
+    @classmethod
+    def get_encoder(cls):
+        return encoders.Msgpack()
+
+
+class PickleBenchmark(JsonBenchmark):
+
+    @classmethod
+    def get_encoder(cls):
+        return encoders.PythonPickle()
+
+
+class PickleHighestBenchmark(JsonBenchmark):
+
+    @classmethod
+    def get_encoder(cls):
+        return encoders.PythonPickle(pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,70 @@
+'''Flattening of :class:`stdnet.odm.JSONField` with ``as_string=False``.
+Run with::
+
+    python runtests.py benchmarks.jsonflat --benchmark
+
+The benchmarks convert wide and deep documents to and from their flat
+representation with :class:`stdnet.utils.KeyPaths` and with the
+:func:`stdnet.utils.dict_flat_generator` and
+:func:`stdnet.utils.flat_to_nested` functions.
+'''
+import json
+
+from stdnet.utils import test, KeyPaths, dict_flat_generator, flat_to_nested
+
+
+def wide(size=500):
+    return dict(('key%s' % i, {'': i, 'value': i * 0.5})
+                for i in range(size))
+
+
+def deep(size=20, depth=5):
+    if not depth:
+        return dict(('leaf%s' % i, i) for i in range(size))
+    return dict(('level%s' % i, deep(size // 2 or 1, depth - 1))
+                for i in range(3))
+
+
+class KeyPathsWideBenchmark(test.TestCase):
+    __benchmark__ = True
+
+    @classmethod
+    def after_setup(cls):
+        cls.value = cls.document()
+        cls.paths = KeyPaths('data')
+        cls.flat = cls.paths.flat(cls.value, dumps=json.dumps)
+
+    @classmethod
+    def document(cls):
+        return wide()
+
+    def test_flat(self):
+        self.paths.flat(self.value, dumps=json.dumps)
+
+    def test_nested(self):
+        self.assertEqual(self.paths.nested(self.flat, loads=json.loads),
+                         self.value)
+
+
+class KeyPathsDeepBenchmark(KeyPathsWideBenchmark):
+
+    @classmethod
+    def document(cls):
+        return deep()
+
+
+class FlatWideBenchmark(KeyPathsWideBenchmark):
+
+    def test_flat(self):
+        dict(dict_flat_generator(self.value, 'data', dumps=json.dumps))
+
+    def test_nested(self):
+        self.assertEqual(flat_to_nested(self.flat, attname='data',
+                                        loads=json.loads), self.value)
+
+
+class FlatDeepBenchmark(FlatWideBenchmark):
+
+    @classmethod
+    def document(cls):
+        return deep()
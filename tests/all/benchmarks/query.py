@@ -0,0 +1,32 @@
+'''Query benchmarks. Run them against several backends to compare them::
+
+    python runtests.py benchmarks.query --benchmark --server redis:// memory://
+'''
+from examples.data import FinanceTest, Position, Instrument
+
+
+class QueryBenchmark(FinanceTest):
+    __benchmark__ = True
+
+    @classmethod
+    def after_setup(cls):
+        yield cls.data.makePositions(cls)
+
+    def test_filter(self):
+        qs = self.query(Instrument).filter(ccy='EUR')
+        yield qs.all()
+
+    def test_exclude(self):
+        qs = self.query(Instrument).exclude(ccy=('EUR', 'USD'))
+        yield qs.all()
+
+    def test_sort_by(self):
+        qs = self.query(Instrument).sort_by('-name')
+        yield qs[:20]
+
+    def test_load_related(self):
+        qs = self.query(Position).load_related('instrument', 'name')
+        yield qs.all()
+
+    def test_count(self):
+        yield self.query(Position).filter(size__gt=0).count()
@@ -0,0 +1,112 @@
+'''Hash and packed storage benchmarks. Run them against redis::
+
+    python runtests.py benchmarks.storage --benchmark --server redis://
+
+``MemoryBenchmark.test_memory`` measures, with the redis ``MEMORY USAGE``
+command, the bytes used by the same instances stored with each layout and
+records them in ``MemoryBenchmark.used``.
+'''
+from datetime import date
+
+from stdnet import odm
+from stdnet.utils import test
+
+
+class Item(odm.StdModel):
+    code = odm.SymbolField(index=False)
+    group = odm.SymbolField()
+    value = odm.FloatField()
+    count = odm.IntegerField()
+    flag = odm.BooleanField()
+    day = odm.DateField()
+
+    class Meta:
+        abstract = True
+
+
+class HashItem(Item):
+    pass
+
+
+class PackedItem(Item):
+
+    class Meta:
+        storage = 'packed'
+
+
+class BucketItem(Item):
+
+    class Meta:
+        storage = 'packed'
+        bucket = 100
+
+
+class HashStorageBenchmark(test.TestCase):
+    __benchmark__ = True
+    multipledb = 'redis'
+    model = HashItem
+    size = 1000
+
+    @classmethod
+    def after_setup(cls):
+        yield cls.create(cls.mapper, cls.size)
+
+    @classmethod
+    def create(cls, models, size, model=None):
+        model = model or cls.model
+        with models.session().begin() as t:
+            for i in range(size):
+                t.add(model(code='item%s' % i, group='g%s' % (i % 10),
+                            value=i*0.25, count=i, flag=i % 2,
+                            day=date(2014, 1, 1 + i % 28)))
+        return t.on_result
+
+    def test_create(self):
+        yield self.create(self.mapper, 100)
+
+    def test_load(self):
+        yield self.mapper.session().query(self.model).all()
+
+    def test_filter(self):
+        yield self.mapper.session().query(self.model).filter(group='g1').all()
+
+
+class PackedStorageBenchmark(HashStorageBenchmark):
+    model = PackedItem
+
+
+class BucketStorageBenchmark(HashStorageBenchmark):
+    model = BucketItem
+
+
+class MemoryBenchmark(test.TestCase):
+    __benchmark__ = True
+    multipledb = 'redis'
+    models = (HashItem, PackedItem, BucketItem)
+    size = 1000
+    # bytes used by the instances of each model
+    used = {}
+
+    @classmethod
+    def after_setup(cls):
+        for model in cls.models:
+            yield HashStorageBenchmark.create(cls.mapper, cls.size, model)
+
+    def memory(self, model):
+        backend = self.backend
+        client = backend.client
+        meta = model._meta
+        keys = yield client.keys(backend.basekey(meta, 'obj', '*'))
+        buckets = yield client.keys(backend.basekey(meta, 'pk', '*'))
+        used = 0
+        for key in keys + buckets:
+            used += yield client.execute_command('MEMORY', 'USAGE', key,
+                                                 'SAMPLES', 0)
+        yield used
+
+    def test_memory(self):
+        for model in self.models:
+            self.used[model._meta.name] = yield self.memory(model)
+        hash, packed, bucket = (self.used[m._meta.name] for m in self.models)
+        self.assertTrue(packed < hash)
+        self.assertTrue(bucket < packed)
@@ -0,0 +1,81 @@
+'''Binary codecs for JSONField and PickleObjectField.'''
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from stdnet import odm, FieldError, ImproperlyConfigured
+from stdnet.utils import test, encoders, pickle
+
+
+codec = 'msgpack' if encoders.msgpack else 'json'
+
+
+class Record(odm.StdModel):
+    name = odm.SymbolField()
+    data = odm.JSONField(codec=codec)
+    blob = odm.JSONField(codec=codec, compress='zlib',
+                         compress_threshold=100)
+    obj = odm.PickleObjectField(protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def sample():
+    return {'day': date(2014, 3, 1),
+            'time': datetime(2014, 3, 1, 12, 30, 15, 250),
+            'price': Decimal('10.125'),
+            'values': [1, 2.5, 'text', None, True],
+            'nested': {'a': {'b': [date(2013, 12, 31)]}}}
+
+
+@test.skipUnless(encoders.msgpack, 'Requires msgpack')
+class TestMsgpack(test.TestCase):
+
+    def test_encoder(self):
+        encoder = encoders.Msgpack()
+        data = encoder.dumps(sample())
+        self.assertTrue(data.startswith(b'\x00m'))
+        self.assertEqual(encoder.loads(data), sample())
+        self.assertTrue(len(data) < len(encoders.Json().dumps(sample())))
+        # values without the header are loaded as JSON
+        self.assertEqual(encoder.loads(b'{"a": [1, 2]}'), {'a': [1, 2]})
+        legacy = encoders.Json().dumps(sample())
+        self.assertEqual(encoder.loads(legacy)['price'], Decimal('10.125'))
+
+    def test_field(self):
+        field = Record._meta.dfields['data']
+        self.assertTrue(isinstance(field.encoder, encoders.Msgpack))
+        self.assertEqual(field.to_python(b'{"a": 1}'), {'a': 1})
+        field = Record._meta.dfields['obj']
+        self.assertEqual(field.encoder.protocol, pickle.HIGHEST_PROTOCOL)
+        self.assertRaises(FieldError, odm.JSONField, codec='msgpack',
+                          as_string=False)
+        self.assertRaises(FieldError, odm.JSONField, codec='foo')
+        self.assertRaises(FieldError, odm.JSONField, codec='msgpack',
+                          encoder_class=json.JSONEncoder)
+        self.assertRaises(FieldError, odm.JSONField, codec='msgpack',
+                          decoder_hook=dict)
+
+
+@test.skipUnless(encoders.msgpack, 'Requires msgpack')
+class TestMsgpackFields(test.TestWrite):
+    models = (Record,)
+
+    def test_save_load(self):
+        models = self.mapper
+        blob = {'rows': [sample()] * 20}
+        record = yield models.record.new(name='a', data=sample(), blob=blob,
+                                         obj=set([1, 2]))
+        cleaned = record._dbdata['cleaned_data']
+        self.assertTrue(cleaned['data'].startswith(b'\x00m'))
+        self.assertTrue(cleaned['blob'].startswith(b'\x00z'))
+        record = yield models.record.get(name='a')
+        self.assertEqual(record.data, sample())
+        self.assertEqual(record.blob, blob)
+        self.assertEqual(record.obj, set([1, 2]))
+
+    def test_legacy(self):
+        '''Values saved with the default codecs are loaded'''
+        meta = Record._meta
+        data = odm.JSONField().serialise(sample())
+        obj = odm.PickleObjectField().serialise([1, 2, 3])
+        self.assertEqual(meta.dfields['data'].to_python(data), sample())
+        self.assertEqual(meta.dfields['obj'].to_python(obj), [1, 2, 3])
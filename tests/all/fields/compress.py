@@ -0,0 +1,96 @@
+'''Compressed text and binary fields.'''
+import json
+
+from stdnet import odm, FieldError, ImproperlyConfigured
+from stdnet.utils import test, encoders
+
+
+class Document(odm.StdModel):
+    title = odm.SymbolField()
+    body = odm.CharField(compress='zlib', compress_threshold=100)
+    raw = odm.ByteField(compress='zlib')
+    meta = odm.JSONField(compress='zlib', compress_threshold=100)
+    extra = odm.PickleObjectField(compress='zlib', compress_threshold=100)
+
+
+class TestCompressor(test.TestCase):
+
+    def test_zlib(self):
+        c = encoders.Compressor(threshold=10)
+        data = c.dumps(u'hello world ' * 50)
+        self.assertTrue(data.startswith(b'\x00z'))
+        self.assertTrue(len(data) < 600)
+        self.assertEqual(c.loads(data), b'hello world ' * 50)
+        # short or incompressible data is not compressed
+        self.assertEqual(c.dumps(b'hello'), b'hello')
+        self.assertEqual(c.dumps(b'\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a'),
+                         b'\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a')
+        # uncompressed data is loaded as it is
+        self.assertEqual(c.loads(b'hello'), b'hello')
+        self.assertEqual(c.loads(b'\x00zhello'), b'\x00zhello')
+        # so is corrupt data
+        self.assertEqual(c.loads(data[:-10]), data[:-10])
+        self.assertEqual(c.loads(None), None)
+
+    @test.skipUnless(encoders.lzma, 'Requires lzma')
+    def test_lzma(self):
+        c = encoders.Compressor('lzma', threshold=10)
+        data = c.dumps(b'hello world ' * 50)
+        self.assertTrue(data.startswith(b'\x00x'))
+        self.assertEqual(c.loads(data), b'hello world ' * 50)
+        # the header identifies the method
+        zc = encoders.Compressor('zlib')
+        self.assertEqual(zc.loads(data), b'hello world ' * 50)
+
+    def test_errors(self):
+        self.assertRaises(ImproperlyConfigured, encoders.Compressor, 'foo')
+        self.assertRaises(ImproperlyConfigured, odm.CharField, compress='foo')
+        self.assertRaises(FieldError, odm.JSONField, compress='zlib',
+                          as_string=False)
+
+
+class TestCompressedFields(test.TestWrite):
+    models = (Document,)
+
+    def test_meta(self):
+        fields = Document._meta.dfields
+        self.assertEqual(fields['body'].compressor.method, 'zlib')
+        self.assertEqual(fields['body'].compressor.threshold, 100)
+        self.assertEqual(fields['raw'].compressor.threshold, 1024)
+
+    def test_save_load(self):
+        models = self.mapper
+        body = u'A long text body. ' * 100
+        meta = {'tags': ['a', 'b'] * 50, 'size': 1000}
+        doc = models.document(title='first', body=body, raw=b'\x01' * 2000,
+                              meta=meta, extra=[1, 2, 3] * 100)
+        yield models.session().add(doc)
+        self.assertEqual(doc.body, body)
+        self.assertEqual(doc.meta, meta)
+        cleaned = doc._dbdata['cleaned_data']
+        self.assertTrue(len(cleaned['body']) < len(body))
+        self.assertTrue(len(cleaned['meta']) < len(json.dumps(meta)))
+        doc = yield models.document.get(title='first')
+        self.assertEqual(doc.body, body)
+        self.assertEqual(doc.raw, b'\x01' * 2000)
+        self.assertEqual(doc.meta, meta)
+        self.assertEqual(doc.extra, [1, 2, 3] * 100)
+        rows = yield models.document.query().values_list('body', flat=True)\
+                                            .all()
+        self.assertEqual(rows, [body])
+
+    def test_short_values(self):
+        models = self.mapper
+        yield models.document.new(title='short', body=u'short', raw=b'raw',
+                                  meta={'a': 1}, extra=None)
+        doc = yield models.document.get(title='short')
+        self.assertEqual(doc.body, u'short')
+        self.assertEqual(doc.raw, b'raw')
+        self.assertEqual(doc.meta, {'a': 1})
+        self.assertEqual(doc.extra, None)
+
+    def test_uncompressed_values(self):
+        fields = Document._meta.dfields
+        self.assertEqual(fields['body'].to_python(b'plain text'),
+                         u'plain text')
+        self.assertEqual(fields['meta'].to_python(b'{"a": 2}'), {'a': 2})
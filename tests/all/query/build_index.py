@@ -0,0 +1,192 @@
+'''Build, check and repair indices of stored instances.'''
+import json
+
+from stdnet import odm, FieldError
+from stdnet.utils import test, to_string
+
+
+class Ticket(odm.StdModel):
+    code = odm.SymbolField(unique=True)
+    status = odm.SymbolField()
+    title = odm.CharField()
+
+
+class TestBuildIndex(test.TestWrite):
+    models = (Ticket,)
+
+    def load(self, rows, bulk=True):
+        models = self.mapper
+        with models.session().begin(bulk=bulk) as t:
+            for code, status in rows:
+                t.add(models.ticket(code=code, status=status))
+        return t.on_result
+
+    def test_errors(self):
+        models = self.mapper
+        self.assertRaises(FieldError, models.ticket.build_index, 'title')
+        self.assertRaises(FieldError, models.ticket.check_index, 'foo')
+
+    def test_build(self):
+        models = self.mapper
+        yield self.load((('a', 'open'), ('b', 'open'), ('c', 'closed')))
+        yield self.async.assertEqual(
+            models.ticket.filter(status='open').count(), 0)
+        yield self.async.assertEqual(
+            models.ticket.build_index('status', chunk=2), [])
+        yield self.async.assertEqual(
+            models.ticket.filter(status='open').count(), 2)
+        yield self.async.assertEqual(
+            models.ticket.filter(status='closed').count(), 1)
+        yield self.async.assertEqual(
+            models.ticket.build_index('code', chunk=2), [])
+        ticket = yield models.ticket.get(code='c')
+        self.assertEqual(ticket.status, 'closed')
+
+    def test_unique(self):
+        models = self.mapper
+        yield self.load((('a', 'open'), ('a', 'closed'), ('b', 'open')))
+        errors = yield models.ticket.build_index('code')
+        self.assertEqual(len(errors), 1)
+        error = errors[0]
+        self.assertEqual(error.model, Ticket)
+        self.assertEqual(error.field, 'code')
+        self.assertEqual(error.value, 'a')
+        self.assertEqual(error.error, 'unique')
+        ticket = yield models.ticket.get(code='a')
+        self.assertEqual(ticket.status, 'open')
+
+    def test_check(self):
+        models = self.mapper
+        yield self.load((('a', 'open'), ('b', 'open')), False)
+        yield self.async.assertEqual(models.check_indexes(), [])
+        ticket = yield models.ticket.get(code='b')
+        ticket.status = 'closed'
+        with models.session().begin(bulk=True) as t:
+            t.add(ticket)
+        yield t.on_result
+        errors = yield models.check_indexes(chunk=1)
+        self.assertEqual(sorted((e.value, e.id, e.error) for e in errors),
+                         [('closed', str(ticket.id), 'missing'),
+                          ('open', str(ticket.id), 'stale')])
+        # checking does not change the indices
+        yield self.async.assertEqual(
+            models.ticket.filter(status='closed').count(), 0)
+        errors = yield models.repair_indexes(chunk=1)
+        self.assertEqual(len(errors), 2)
+        yield self.async.assertEqual(models.check_indexes(), [])
+        yield self.async.assertEqual(
+            models.ticket.filter(status='closed').count(), 1)
+        yield self.async.assertEqual(
+            models.ticket.filter(status='open').count(), 1)
+
+
+class TestBuildIndexRedis(test.TestWrite):
+    multipledb = 'redis'
+    models = (Ticket,)
+
+    def test_commit_while_building(self):
+        models = self.mapper
+        backend = self.backend
+        meta = Ticket._meta
+        yield models.ticket.new(code='a', status='open')
+        info = json.dumps(backend.meta(meta))
+        shadow, snapshot = backend.tempkey(meta), backend.tempkey(meta)
+        yield backend.odmrun(backend.client, 'build_index', meta, (snapshot,),
+                             info, 'status', shadow, 0, 10, 10)
+        # commits update the index being built
+        yield models.ticket.new(code='b', status='open')
+        ticket = yield models.ticket.get(code='a')
+        ticket.status = 'closed'
+        yield models.session().add(ticket)
+        field = meta.dfields['status']
+        diff = yield backend.execute(backend._swap_index(
+            meta, info, field, shadow, 1, 0, 10, True, True))
+        self.assertEqual(diff, [])
+        yield backend.execute(backend._end_index(meta, info, field, shadow,
+                                                 (snapshot,), 1))
+        yield self.async.assertEqual(
+            models.ticket.filter(status='open').count(), 1)
+        yield self.async.assertEqual(
+            models.ticket.filter(status='closed').count(), 1)
+
+    def test_delete_while_building(self):
+        models = self.mapper
+        backend = self.backend
+        meta = Ticket._meta
+        with models.session().begin(bulk=True) as t:
+            for code in ('a', 'b', 'c'):
+                t.add(models.ticket(code=code, status='open'))
+        yield t.on_result
+        info = json.dumps(backend.meta(meta))
+        shadow, snapshot = backend.tempkey(meta), backend.tempkey(meta)
+        count, _ = yield backend.odmrun(backend.client, 'build_index', meta,
+                                        (snapshot,), info, 'status', shadow,
+                                        0, 1, 10)
+        self.assertEqual(count, 1)
+        ttl = yield backend.client.ttl(snapshot)
+        self.assertTrue(0 < ttl <= 10)
+        # deleting an instance already indexed does not skip the next one
+        ids = yield backend.client.lrange(snapshot, 0, 0)
+        yield models.ticket.filter(id=to_string(ids[0])).delete()
+        for start in (1, 2):
+            yield backend.odmrun(backend.client, 'build_index', meta,
+                                 (snapshot,), info, 'status', shadow, start,
+                                 1, 10)
+        field = meta.dfields['status']
+        yield backend.execute(backend._swap_index(
+            meta, info, field, shadow, 1, 0, 10, False, True))
+        yield backend.execute(backend._end_index(meta, info, field, shadow,
+                                                 (snapshot,), 1))
+        yield self.async.assertEqual(
+            models.ticket.filter(status='open').count(), 2)
+        for key in (snapshot, shadow, backend.basekey(meta, 'building')):
+            yield self.async.assertEqual(backend.client.exists(key), False)
+
+    def test_failure(self):
+        models = self.mapper
+        backend = models.ticket.backend
+        yield self.load_rows(models)
+        odmrun = backend.odmrun
+        shadows = []
+
+        def failing(client, command, meta, keys, info, *args, **options):
+            if command == 'build_index':
+                shadows.append(args[1])
+                if args[2]:
+                    raise IOError('connection lost')
+            return odmrun(client, command, meta, keys, info, *args,
+                          **options)
+        backend.odmrun = failing
+        try:
+            yield self.async.assertRaises(IOError, models.ticket.build_index,
+                                          'status', chunk=1)
+        finally:
+            backend.odmrun = odmrun
+        building = backend.basekey(Ticket._meta, 'building')
+        yield self.async.assertEqual(backend.client.exists(building), False)
+        keys = yield backend.client.keys(shadows[0] + '*')
+        self.assertEqual(keys, [])
+        yield self.async.assertEqual(
+            models.ticket.filter(status='open').count(), 2)
+
+    def test_legacy_index_keys(self):
+        models = self.mapper
+        backend = models.ticket.backend
+        yield self.load_rows(models)
+        ticket = yield models.ticket.get(code='a')
+        # an index key written before the registry of values existed
+        key = backend.basekey(Ticket._meta, 'idx', 'status', 'stale')
+        yield backend.client.sadd(key, ticket.id)
+        errors = yield models.check_indexes()
+        self.assertEqual([(e.value, e.id, e.error) for e in errors],
+                         [('stale', str(ticket.id), 'stale')])
+        errors = yield models.repair_indexes()
+        self.assertEqual(len(errors), 1)
+        yield self.async.assertEqual(backend.client.exists(key), False)
+        yield self.async.assertEqual(models.check_indexes(), [])
+
+    def load_rows(self, models):
+        with models.session().begin() as t:
+            t.add(models.ticket(code='a', status='open'))
+            t.add(models.ticket(code='b', status='open'))
+        return t.on_result
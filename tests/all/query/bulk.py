@@ -0,0 +1,150 @@
+'''Bulk transactions which defer the update of indices.'''
+import json
+
+from stdnet import odm, CommitException
+from stdnet.utils import test, to_string
+
+
+class Account(odm.StdModel):
+    code = odm.SymbolField(unique=True)
+    group = odm.SymbolField()
+    balance = odm.FloatField(default=0)
+
+    class Meta:
+        sort_indexes = ('balance',)
+
+
+class TestBulk(test.TestWrite):
+    models = (Account,)
+
+    def load(self, rows):
+        models = self.mapper
+        with models.session().begin(bulk=True) as t:
+            for code, group, balance in rows:
+                t.add(models.account(code=code, group=group,
+                                     balance=balance))
+        return t.on_result
+
+    def test_no_indices(self):
+        models = self.mapper
+        yield self.load((('a', 'x', 3), ('b', 'x', 1), ('c', 'y', 2)))
+        yield self.async.assertEqual(models.account.query().count(), 3)
+        yield self.async.assertEqual(
+            models.account.filter(group='x').count(), 0)
+        yield self.async.assertEqual(models.account.rebuild_indices(), 3)
+        yield self.async.assertEqual(
+            models.account.filter(group='x').count(), 2)
+        account = yield models.account.get(code='c')
+        self.assertEqual(account.group, 'y')
+        accounts = yield models.account.query().sort_by('balance').all()
+        self.assertEqual([a.code for a in accounts], ['b', 'c', 'a'])
+
+    def test_chunks(self):
+        models = self.mapper
+        rows = [('c%s' % i, 'g%s' % (i % 3), i) for i in range(10)]
+        yield self.load(rows)
+        yield self.async.assertEqual(models.account.rebuild_indices(3), 10)
+        yield self.async.assertEqual(
+            models.account.filter(group='g0').count(), 4)
+        yield self.async.assertEqual(
+            models.account.filter(code=('c0', 'c9')).count(), 2)
+
+    def test_stale_indices(self):
+        models = self.mapper
+        account = yield models.account.new(code='a', group='x')
+        account.group = 'z'
+        with models.session().begin(bulk=True) as t:
+            t.add(account)
+        yield t.on_result
+        yield models.account.rebuild_indices()
+        yield self.async.assertEqual(
+            models.account.filter(group='x').count(), 0)
+        yield self.async.assertEqual(
+            models.account.filter(group='z').count(), 1)
+
+    def test_unique_violations(self):
+        models = self.mapper
+        rows = [('a', 'x', 1), ('b', 'x', 2), ('a', 'y', 3), ('b', 'y', 4),
+                ('c', 'y', 5)]
+        yield self.load(rows)
+        yield self.async.assertRaises(CommitException,
+                                      models.account.rebuild_indices, 2)
+        accounts = yield models.account.query().all()
+        self.assertEqual(sorted(a.code for a in accounts), ['a', 'b', 'c'])
+        yield self.async.assertEqual(
+            models.account.filter(group='x').count(), 2)
+        yield self.async.assertEqual(models.account.rebuild_indices(), 3)
+
+
+    def test_unique_winner(self):
+        models = self.mapper
+        # the instances with ids 2 and 10 have the same code
+        rows = [('c%s' % i, 'x', i) for i in range(1, 11)]
+        rows[9] = ('c2', 'y', 10)
+        yield self.load(rows)
+        yield self.async.assertRaises(CommitException,
+                                      models.account.rebuild_indices, 3)
+        # ids are indexed in alphabetical order, "10" before "2"
+        account = yield models.account.get(code='c2')
+        self.assertEqual(account.group, 'y')
+        yield self.async.assertEqual(models.account.query().count(), 9)
+
+
+class TestBulkRedis(test.TestWrite):
+    multipledb = 'redis'
+    models = (Account,)
+
+    def test_registry(self):
+        models = self.mapper
+        backend = models.account.backend
+        key = backend.basekey(Account._meta, 'idx', 'group')
+        a = yield models.account.new(code='a', group='x')
+        yield models.account.new(code='b', group='y')
+        values = yield backend.client.smembers(key)
+        self.assertEqual(sorted(values), [b'x', b'y'])
+        yield models.session().delete(a)
+        values = yield backend.client.smembers(key)
+        self.assertEqual(values, set([b'y']))
+        yield models.account.rebuild_indices()
+        values = yield backend.client.smembers(key)
+        self.assertEqual(values, set([b'y']))
+        yield self.async.assertEqual(
+            models.account.filter(group='y').count(), 1)
+
+    def test_legacy_index_keys(self):
+        models = self.mapper
+        backend = models.account.backend
+        a = yield models.account.new(code='a', group='x')
+        # an index key written before the registry of values existed
+        key = backend.basekey(Account._meta, 'idx', 'group', 'stale')
+        yield backend.client.sadd(key, a.id)
+        yield self.async.assertEqual(
+            models.account.filter(group='stale').count(), 1)
+        yield models.account.rebuild_indices(chunk=1)
+        yield self.async.assertEqual(
+            models.account.filter(group='stale').count(), 0)
+        yield self.async.assertEqual(backend.client.exists(key), False)
+        yield self.async.assertEqual(
+            models.account.filter(group='x').count(), 1)
+
+    def test_delete_while_rebuilding(self):
+        models = self.mapper
+        backend = models.account.backend
+        meta = Account._meta
+        with models.session().begin(bulk=True) as t:
+            for code in ('a', 'b', 'c'):
+                t.add(models.account(code=code, group='x'))
+        yield t.on_result
+        info = json.dumps(backend.meta(meta))
+        snapshot = backend.tempkey(meta)
+        yield backend.odmrun(backend.client, 'reindex', meta, (snapshot,),
+                             info, 0, 1, 10)
+        # deleting an instance already indexed does not skip the next one
+        ids = yield backend.client.lrange(snapshot, 0, 0)
+        yield models.account.filter(id=to_string(ids[0])).delete()
+        for start in (1, 2, 3):
+            yield backend.odmrun(backend.client, 'reindex', meta,
+                                 (snapshot,), info, start, 1, 10)
+        yield self.async.assertEqual(
+            models.account.filter(group='x').count(), 2)
+        yield self.async.assertEqual(backend.client.exists(snapshot), False)
@@ -0,0 +1,86 @@
+'''Capped models which keep only the newest instances.'''
+from datetime import datetime, timedelta
+
+from stdnet import odm, ImproperlyConfigured
+from stdnet.utils import test
+
+
+class Activity(odm.StdModel):
+    name = odm.SymbolField()
+
+    class Meta:
+        cap = 3
+
+
+class Post(odm.StdModel):
+    user = odm.SymbolField()
+    dt = odm.DateTimeField()
+
+    class Meta:
+        cap = 2
+        cap_by = 'user'
+        ordering = 'dt'
+
+
+class TestCap(test.TestWrite):
+    models = (Activity, Post)
+
+    def test_meta(self):
+        self.assertEqual(Activity._meta.cap, 3)
+        self.assertEqual(Activity._meta.cap_by, None)
+        self.assertEqual(Post._meta.cap_by.name, 'user')
+        self.assertRaises(ImproperlyConfigured, odm.create_model, 'Capped',
+                          'name', cap=2, cap_by='foo')
+        self.assertRaises(ImproperlyConfigured, odm.create_model, 'Capped',
+                          'name', cap_by='name')
+
+    def test_newest_kept(self):
+        models = self.mapper
+        for name in 'abcde':
+            yield models.activity.new(name=name)
+        activities = yield models.activity.query().all()
+        self.assertEqual(sorted(a.name for a in activities), ['c', 'd', 'e'])
+        keys = yield models.activity.keys()
+        self.assertEqual(len([k for k in keys if ':obj:' in k]), 3)
+
+    def test_update_keeps_position(self):
+        models = self.mapper
+        first = yield models.activity.new(name='a')
+        for name in 'bc':
+            yield models.activity.new(name=name)
+        first.name = 'z'
+        yield models.session().add(first)
+        yield self.async.assertEqual(models.activity.query().count(), 3)
+        yield models.activity.new(name='d')
+        activities = yield models.activity.query().all()
+        self.assertEqual(sorted(a.name for a in activities), ['b', 'c', 'd'])
+
+    def test_cap_by(self):
+        models = self.mapper
+        dt = datetime(2014, 1, 1)
+        with models.session().begin() as t:
+            for i in range(4):
+                t.add(models.post(user='a', dt=dt + timedelta(days=i)))
+            t.add(models.post(user='b', dt=dt))
+        yield t.on_result
+        posts = yield models.post.filter(user='a').all()
+        self.assertEqual([p.dt for p in posts],
+                         [dt + timedelta(days=2), dt + timedelta(days=3)])
+        yield self.async.assertEqual(models.post.filter(user='b').count(), 1)
+
+    def test_cap_by_change(self):
+        models = self.mapper
+        dt = datetime(2014, 1, 1)
+        with models.session().begin() as t:
+            for i in range(2):
+                t.add(models.post(user='a', dt=dt + timedelta(days=i)))
+                t.add(models.post(user='b', dt=dt + timedelta(days=i)))
+        yield t.on_result
+        post = yield models.post.filter(user='a').sort_by('dt')[0]
+        post.user = 'b'
+        post.dt = dt + timedelta(days=5)
+        yield models.session().add(post)
+        yield self.async.assertEqual(models.post.filter(user='a').count(), 1)
+        posts = yield models.post.filter(user='b').all()
+        self.assertEqual([p.dt for p in posts],
+                         [dt + timedelta(days=1), dt + timedelta(days=5)])
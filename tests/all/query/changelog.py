@@ -0,0 +1,83 @@
+'''Changelog of committed and deleted instances.'''
+from stdnet import odm, getdb
+from stdnet.utils import test
+
+
+class Item(odm.StdModel):
+    name = odm.SymbolField()
+    price = odm.FloatField(default=0)
+    count = odm.IntegerField(default=0)
+
+
+class TestChangeLog(test.TestWrite):
+    models = (Item,)
+
+    def router(self, size=10):
+        backend = getdb(self.backend.connection_string, changelog=size)
+        models = odm.Router(backend)
+        models.register(Item)
+        return models
+
+    def test_backend(self):
+        self.assertEqual(self.backend.changelog, 0)
+        # the test backend does not record changes
+        yield self.mapper.item.new(name='a')
+        yield self.async.assertEqual(self.backend.changes(), [])
+        models = self.router()
+        self.assertEqual(models.item.backend.changelog, 10)
+        yield models.item.new(name='b')
+        changes = yield self.backend.changes()
+        self.assertEqual(len(changes), 1)
+
+    def test_records(self):
+        models = self.router()
+        item = yield models.item.new(name='a', price=1)
+        item.price = 2
+        yield models.session().add(item)
+        yield models.item.incr(item, 'count')
+        yield models.session().delete(item)
+        changes = yield models.item.backend.changes()
+        self.assertEqual([c.seq for c in changes], [1, 2, 3, 4])
+        self.assertEqual([c.action for c in changes],
+                         ['add', 'override', 'update', 'delete'])
+        self.assertEqual(set(c.model for c in changes), set([Item._meta.hash]))
+        self.assertEqual(set(c.id for c in changes), set([str(item.id)]))
+        self.assertEqual(sorted(changes[0].fields),
+                         ['count', 'name', 'price'])
+        self.assertEqual(changes[1].fields, ['price'])
+        self.assertEqual(changes[2].fields, ['count'])
+        self.assertEqual(changes[3].fields, [])
+
+    def test_capped(self):
+        models = self.router(3)
+        with models.session().begin() as t:
+            for name in 'abcde':
+                t.add(models.item(name=name))
+        yield t.on_result
+        backend = models.item.backend
+        changes = yield backend.changes()
+        self.assertEqual([c.seq for c in changes], [3, 4, 5])
+        changes = yield backend.changes(3, 1)
+        self.assertEqual([c.seq for c in changes], [4])
+
+    def test_consumer(self):
+        models = self.router()
+        consumer = models.consumer('indexer')
+        yield self.async.assertEqual(consumer.offset(), 0)
+        with models.session().begin() as t:
+            for name in 'abcde':
+                t.add(models.item(name=name))
+        yield t.on_result
+        changes = yield consumer.read(2)
+        self.assertEqual([c.seq for c in changes], [1, 2])
+        changes = yield consumer.read(2)
+        self.assertEqual([c.seq for c in changes], [1, 2])
+        yield consumer.ack(changes[-1])
+        yield self.async.assertEqual(consumer.offset(), 2)
+        changes = yield consumer.read()
+        self.assertEqual([c.seq for c in changes], [3, 4, 5])
+        yield consumer.ack(5)
+        yield self.async.assertEqual(consumer.read(), [])
+        # other consumers have their own offset
+        changes = yield models.consumer('cache').read()
+        self.assertEqual(len(changes), 5)
@@ -2,13 +2,18 @@
 import datetime
 from random import randint
 
-from stdnet import odm
+from stdnet import odm, getdb, FieldError
 from stdnet.utils import test, zip
 
-from examples.models import Instrument, Fund, Position, Dictionary, SimpleModel
+from examples.models import (Instrument, Fund, Position, Dictionary,
+                             SimpleModel, Group, Person, Node)
 from examples.data import finance_data, FinanceTest
 
 
+class Member(odm.StdModel):
+    group = odm.ForeignKey(Group, index=False)
+
+
 class DictData(test.DataGenerator):
 
     def generate(self):
@@ -205,6 +210,87 @@ test as it involves lots of operations and consistency checks.'''
         self.assertEqual(Position.objects.all().count(),0)
 
 
+class TestCascadeDelete(test.TestWrite):
+    '''Cascade deletes run in chunks of at most ``delete_chunk``
+instances.'''
+    multipledb = 'redis'
+    models = (Group, Person, Node)
+
+    def mapper_with_chunk(self, chunk):
+        backend = getdb(self.backend.connection_string, delete_chunk=chunk)
+        models = odm.Router(backend)
+        for model in self.models:
+            models.register(model)
+        return models
+
+    def test_chunk(self):
+        models = self.mapper_with_chunk(2)
+        self.assertEqual(models.group.backend.delete_chunk, 2)
+        with models.session().begin() as t:
+            group = t.add(models.group(name='a'))
+        yield t.on_result
+        with models.session().begin() as t:
+            for n in range(7):
+                t.add(models.person(name='p%s' % n, group=group))
+        yield t.on_result
+        with models.session().begin() as t:
+            t.delete(t.session.query(Group).filter(name='a'))
+        yield t.on_result
+        self.assertEqual(len(t.deleted[Group._meta]), 1)
+        self.assertEqual(len(t.deleted[Person._meta]), 7)
+        yield self.async.assertEqual(models.person.query().count(), 0)
+        yield self.async.assertEqual(models.group.query().count(), 0)
+
+    def test_self_related(self):
+        models = self.mapper_with_chunk(3)
+        root = yield models.node.new(weight=0)
+        parents = [root]
+        for level in range(3):
+            with models.session().begin() as t:
+                children = [t.add(models.node(parent=p, weight=level))
+                            for p in parents for _ in range(2)]
+            yield t.on_result
+            parents = children
+        yield self.async.assertEqual(models.node.query().count(), 15)
+        other = yield models.node.new(weight=10)
+        session = models.session()
+        yield session.delete(root)
+        all = yield models.node.query().all()
+        self.assertEqual(all, [other])
+
+    def test_pending_expire(self):
+        models = self.mapper_with_chunk(2)
+        backend = models.group.backend
+        group = yield models.group.new(name='a')
+        with models.session().begin() as t:
+            for n in range(7):
+                t.add(models.person(name='p%s' % n, group=group))
+        yield t.on_result
+        # run the first chunk only
+        pipe = backend.client.pipeline()
+        query = models.group.filter(name='a').backend_query(pipe=pipe)
+        backend.accumulate_delete(pipe, query)
+        result = yield pipe.execute()
+        self.assertTrue(result[-1].remaining)
+        pending = result[-1].graph['pending']
+        ttls = []
+        for key in pending:
+            ttl = yield backend.client.ttl(key)
+            ttls.append(ttl)
+        self.assertTrue(max(ttls) > 0)
+        self.assertTrue(max(ttls) <= query.expire)
+
+    def test_not_an_index(self):
+        models = self.mapper_with_chunk(10)
+        models.register(Member)
+        group = yield models.group.new(name='a')
+        yield models.member.new(group=group)
+        yield self.async.assertRaises(FieldError, models.session().delete,
+                                      group)
+        yield self.async.assertEqual(models.member.query().count(), 1)
+        yield self.async.assertEqual(models.group.query().count(), 1)
+
+
 class TestDeleteStructuredFields(test.TestWrite):
     model = Dictionary
     data_cls = DictData
@@ -0,0 +1,73 @@
+'''Atomic increments of numeric fields.'''
+from stdnet import odm, FieldError
+from stdnet.utils import test
+
+
+class Page(odm.StdModel):
+    name = odm.SymbolField()
+    views = odm.IntegerField(default=0)
+    rating = odm.FloatField(default=0)
+
+
+class Story(odm.StdModel):
+    title = odm.SymbolField()
+    votes = odm.IntegerField(default=0)
+
+    class Meta:
+        ordering = '-votes'
+
+
+class TestIncr(test.TestWrite):
+    models = (Page, Story)
+
+    def test_incr(self):
+        models = self.mapper
+        page = yield models.page.new(name='home')
+        value = yield models.page.incr(page, 'views')
+        self.assertEqual(value, 1)
+        self.assertEqual(page.views, 1)
+        value = yield models.page.incr(page.id, 'views', 5)
+        self.assertEqual(value, 6)
+        self.assertEqual(page.views, 1)
+        page = yield models.page.get(id=page.id)
+        self.assertEqual(page.views, 6)
+        self.assertEqual(page.name, 'home')
+
+    def test_decr_float(self):
+        models = self.mapper
+        page = yield models.page.new(name='home', rating=1.5)
+        value = yield models.page.incr(page, 'rating', 0.25)
+        self.assertAlmostEqual(value, 1.75)
+        value = yield models.page.incr(page, 'views', -2)
+        self.assertEqual(value, -2)
+        page = yield models.page.get(id=page.id)
+        self.assertAlmostEqual(page.rating, 1.75)
+
+    def test_index(self):
+        models = self.mapper
+        page = yield models.page.new(name='home', views=3)
+        yield models.page.incr(page, 'views')
+        yield self.async.assertEqual(models.page.filter(views=3).count(), 0)
+        yield self.async.assertEqual(models.page.filter(views=4).count(), 1)
+        yield self.async.assertEqual(
+            models.page.filter(views__gt=3).count(), 1)
+
+    def test_ordering(self):
+        models = self.mapper
+        with models.session().begin() as t:
+            for title, votes in (('a', 3), ('b', 2), ('c', 1)):
+                t.add(models.story(title=title, votes=votes))
+        yield t.on_result
+        story = yield models.story.get(title='c')
+        yield models.story.incr(story, 'votes', 10)
+        stories = yield models.story.query().all()
+        self.assertEqual([s.title for s in stories], ['c', 'a', 'b'])
+        self.assertEqual(stories[0].votes, 11)
+
+    def test_errors(self):
+        models = self.mapper
+        self.assertRaises(FieldError, models.page.incr, 1, 'name')
+        self.assertRaises(FieldError, models.page.incr, 1, 'id')
+        self.assertRaises(FieldError, models.page.incr, 1, 'foo')
+        yield self.async.assertRaises(Page.DoesNotExist, models.page.incr,
+                                      1000, 'views')
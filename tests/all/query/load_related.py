@@ -1,7 +1,7 @@
-from stdnet import odm, FieldError
+from stdnet import odm, FieldError, QuerySetError
 from stdnet.utils import test
 
-from examples.models import Dictionary, Profile
+from examples.models import Dictionary, Profile, Node
 from examples.data import FinanceTest, Position, Instrument, Fund
 
 
@@ -9,6 +9,10 @@ class Role(odm.StdModel):
     profile = odm.ForeignKey(Profile)
 
 
+class Note(odm.StdModel):
+    profile = odm.ForeignKey(Profile, index=False, related_name='notes')
+
+
 class test_load_related(FinanceTest):
     
     @classmethod
@@ -144,9 +148,130 @@ class test_load_related(FinanceTest):
             self.assertTrue(isinstance(val, inst.relmodel))
             self.assertEqual(p.instrument.ccy, 'EUR')
 
+    def test_reverse_foreign_key(self):
+        session = self.session()
+        qs = session.query(Instrument).load_related('positions')
+        self.assertEqual(qs.select_related['positions'], ())
+        instruments = yield qs.all()
+        self.assertTrue(instruments)
+        manager = Instrument._meta.related['positions']
+        for inst in instruments:
+            positions = getattr(inst, manager.get_cache_name())
+            self.assertEqual(inst.positions.all(), positions)
+            expected = yield inst.positions.query().all()
+            self.assertEqual(set(positions), set(expected))
+            for p in positions:
+                self.assertEqual(p.instrument_id, inst.id)
+
+    def test_reverse_foreign_key_fields(self):
+        session = self.session()
+        qs = session.query(Fund).load_related('positions', 'size')
+        funds = yield qs.all()
+        self.assertTrue(funds)
+        for fund in funds:
+            for p in fund.positions.all():
+                self.assertEqual(set(p._loadedfields), set(('size',)))
+
+    def test_batch_related(self):
+        session = self.session()
+        qs = session.query(Position).batch_related()
+        self.assertTrue(qs.data['batch_related'])
+        inst = Position._meta.dfields['instrument']
+        fund = Position._meta.dfields['fund']
+        pos = yield qs.all()
+        self.assertTrue(pos)
+        for p in pos:
+            self.assertFalse(hasattr(p, inst.get_cache_name()))
+        instrument = yield pos[0].instrument
+        self.assertEqual(instrument.id, pos[0].instrument_id)
+        for p in pos:
+            val = getattr(p, inst.get_cache_name())
+            self.assertTrue(isinstance(val, inst.relmodel))
+            self.assertEqual(val.id, p.instrument_id)
+            self.assertFalse(hasattr(p, fund.get_cache_name()))
+
+    def test_batch_related_off(self):
+        session = self.session()
+        inst = Position._meta.dfields['instrument']
+        qs = session.query(Position).batch_related().batch_related(False)
+        pos = yield qs.all()
+        self.assertTrue(len(pos) > 1)
+        instrument = yield pos[0].instrument
+        self.assertEqual(instrument.id, pos[0].instrument_id)
+        self.assertFalse(hasattr(pos[1], inst.get_cache_name()))
+
+
+class test_load_related_nested(test.TestCase):
+    model = Node
+
+    @classmethod
+    def after_setup(cls):
+        with cls.session().begin() as t:
+            root = t.add(Node(weight=0))
+        yield t.on_result
+        with cls.session().begin() as t:
+            children = [t.add(Node(parent=root, weight=w)) for w in (1, 2)]
+        yield t.on_result
+        with cls.session().begin() as t:
+            for child in children:
+                for i in range(3):
+                    t.add(Node(parent=child, weight=10*child.weight + i))
+        yield t.on_result
+
+    def test_meta(self):
+        qs = self.query().load_related('parent__parent')
+        self.assertEqual(qs.select_related, {'parent': (),
+                                             'parent__parent': ()})
+        qs = self.query().load_related('parent', 'weight')\
+                         .load_related('parent__parent', 'weight')
+        self.assertEqual(qs.select_related['parent'], ('weight', 'parent'))
+        self.assertEqual(qs.select_related['parent__parent'], ('weight',))
+        self.assertRaises(FieldError, qs.load_related, 'parent__weight')
+        self.assertRaises(FieldError, qs.load_related, 'parent__bla')
+
+    def test_nested(self):
+        field = Node._meta.dfields['parent']
+        cache = field.get_cache_name()
+        qs = self.query().filter(weight__gt=2).load_related('parent__parent')
+        nodes = yield qs.all()
+        self.assertEqual(len(nodes), 6)
+        for node in nodes:
+            parent = getattr(node, cache)
+            self.assertTrue(isinstance(parent, Node))
+            self.assertEqual(parent.weight, node.weight // 10)
+            root = getattr(parent, cache)
+            self.assertTrue(isinstance(root, Node))
+            self.assertEqual(root.weight, 0)
+            self.assertEqual(root.parent_id, None)
+
+    def test_nested_fields(self):
+        field = Node._meta.dfields['parent']
+        cache = field.get_cache_name()
+        qs = self.query().filter(weight__gt=2).load_related('parent', 'weight')\
+                         .load_related('parent__parent', 'weight')
+        nodes = yield qs.all()
+        self.assertEqual(len(nodes), 6)
+        for node in nodes:
+            parent = getattr(node, cache)
+            self.assertEqual(set(parent._loadedfields), set(('weight',
+                                                             'parent')))
+            root = getattr(parent, cache)
+            self.assertEqual(set(root._loadedfields), set(('weight',)))
+            self.assertEqual(root.weight, 0)
+
+    def test_missing(self):
+        field = Node._meta.dfields['parent']
+        qs = self.query().filter(weight__lt=3).load_related('parent__parent')
+        nodes = yield qs.all()
+        self.assertEqual(len(nodes), 3)
+        for node in nodes:
+            self.assertFalse(getattr(getattr(node, field.get_cache_name(),
+                                             None), field.get_cache_name(),
+                                     None))
+
 
 class test_load_related_empty(test.TestCase):
-    models = (Role, Profile, Position, Instrument, Fund)
+    models = (Role, Note, Profile, Position, Instrument, Fund)
     
     @classmethod
     def after_setup(cls):
@@ -171,6 +296,12 @@ class test_load_related_empty(test.TestCase):
         query = yield qs.all()
         profiles = set((role.profile for role in query))
         self.assertEqual(len(profiles), 2)
+
+    def test_manager_not_an_index(self):
+        qs = self.mapper.profile.query()
+        self.assertRaises(QuerySetError, qs.load_related, 'notes')
+        profile = yield self.mapper.profile.get(name='k1')
+        self.assertRaises(QuerySetError, profile.notes.all)
     
  
 class load_related_structure(test.TestCase):
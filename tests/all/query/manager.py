@@ -81,6 +81,18 @@ class TestManager(test.TestCase):
         yield self.async.assertRaises(stdnet.QuerySetError,
                                       objects.get, group='g2')
         
+    def test_count(self):
+        objects = self.mapper.simplemodel
+        n = yield objects.query().count()
+        yield self.async.assertEqual(objects.count(), n)
+        yield objects.update_or_create(code='test7', group='g3')
+        yield self.async.assertEqual(objects.count(), n+1)
+        qs = objects.filter(group='g3')
+        yield self.async.assertEqual(qs.count(), 1)
+        if self.backend.name == 'redis':
+            self.assertFalse(qs.backend_query().query_key.startswith(
+                self.backend.tempkey(qs._meta, '')))
+        
     def testNoFilter(self):
         objects = self.mapper[SimpleModel]
         filter1 = lambda : objects.filter(description = 'bo').count()
@@ -170,6 +170,26 @@ class TestManyToManyAddDelete(TestManyToManyBase, test.TestWrite):
         yield p1.roles.remove(role)
         profiles = role.profiles.query()
         yield self.async.assertEqual(profiles.count(), 0)
+
+    def test_load_related(self):
+        role1, role2 = yield self.addsome()
+        qs = self.query(Profile).load_related('roles')
+        profiles = yield qs.sort_by('name').all()
+        self.assertEqual(len(profiles), 3)
+        cache_name = Profile.roles.get_cache_name()
+        self.assertEqual(getattr(profiles[0], cache_name),
+                         profiles[0].roles.all())
+        self.assertEqual(set(profiles[0].roles.all()), set((role1, role2)))
+        self.assertEqual(profiles[1].roles.all(), [])
+        self.assertEqual(profiles[2].roles.all(), [])
+        roles = yield self.query(Role).load_related('profiles', 'id').all()
+        for role in roles:
+            self.assertEqual(role.profiles.all(), [profiles[0]])
+        # Adding a role clears the loaded instances
+        role3 = yield self.session().add(Role(name='tester'))
+        yield profiles[1].roles.add(role3)
+        roles = yield profiles[1].roles.all()
+        self.assertEqual(roles, [role3])
         
         
 class TestRegisteredThroughModel(TestManyToManyBase, test.TestCase):
@@ -0,0 +1,193 @@
+'''Models with packed storage.'''
+from datetime import datetime
+
+from stdnet import odm, CommitException, ImproperlyConfigured
+from stdnet.utils import test
+
+
+class Sensor(odm.StdModel):
+    code = odm.SymbolField(unique=True)
+    kind = odm.SymbolField()
+
+    class Meta:
+        storage = 'packed'
+
+
+class Reading(odm.StdModel):
+    sensor = odm.ForeignKey(Sensor, related_name='readings')
+    value = odm.FloatField()
+    count = odm.IntegerField(default=0)
+    valid = odm.BooleanField(default=True)
+    taken = odm.DateTimeField(required=False)
+    note = odm.CharField()
+    data = odm.JSONField(as_string=False)
+
+    class Meta:
+        storage = 'packed'
+        bucket = 4
+
+
+class Plain(odm.StdModel):
+    name = odm.SymbolField()
+    value = odm.FloatField()
+    count = odm.IntegerField()
+
+
+class TestPacked(test.TestWrite):
+    models = (Sensor, Reading)
+
+    def populate(self):
+        models = self.mapper
+        with models.session().begin() as t:
+            t.add(models.sensor(code='a', kind='temperature'))
+            t.add(models.sensor(code='b', kind='pressure'))
+        yield t.on_result
+        a = yield models.sensor.get(code='a')
+        b = yield models.sensor.get(code='b')
+        with models.session().begin() as t:
+            for i in range(10):
+                t.add(models.reading(sensor=a if i % 2 else b, value=0.1*i,
+                                     count=i, valid=i % 3 == 0,
+                                     note='reading %s' % i,
+                                     data={'unit': 'C', 'n': i}))
+        yield t.on_result
+        yield a, b
+
+    def test_meta(self):
+        self.assertEqual(Sensor._meta.storage, 'packed')
+        self.assertEqual(Sensor._meta.bucket, None)
+        self.assertEqual(Reading._meta.bucket, 4)
+        self.assertEqual(Plain._meta.storage, 'hash')
+        self.assertRaises(ImproperlyConfigured, odm.create_model, 'Packed',
+                          'name', storage='foo')
+        self.assertRaises(ImproperlyConfigured, odm.create_model, 'Packed',
+                          'name', bucket=10)
+
+        def symbol_pk():
+            class Code(odm.StdModel):
+                code = odm.SymbolField(primary_key=True)
+
+                class Meta:
+                    register = False
+                    storage = 'packed'
+                    bucket = 10
+        self.assertRaises(ImproperlyConfigured, symbol_pk)
+
+    def test_load(self):
+        models = self.mapper
+        a, b = yield self.populate()
+        readings = yield models.reading.query().sort_by('count').all()
+        self.assertEqual(len(readings), 10)
+        for i, r in enumerate(readings):
+            self.assertEqual(r.count, i)
+            self.assertAlmostEqual(r.value, 0.1*i)
+            self.assertEqual(r.valid, i % 3 == 0)
+            self.assertEqual(r.note, 'reading %s' % i)
+            self.assertEqual(r.data, {'unit': 'C', 'n': i})
+            self.assertEqual(r.taken, None)
+            self.assertEqual(r.sensor_id, a.id if i % 2 else b.id)
+        readings = yield models.reading.query().load_only('count', 'note')\
+                                       .sort_by('-count')[:2]
+        self.assertEqual([(r.count, r.note) for r in readings],
+                         [(9, 'reading 9'), (8, 'reading 8')])
+
+    def test_indices(self):
+        models = self.mapper
+        a, b = yield self.populate()
+        yield self.async.assertEqual(
+            models.reading.filter(sensor=a).count(), 5)
+        yield self.async.assertEqual(
+            models.reading.filter(sensor__kind='pressure').count(), 5)
+        yield self.async.assertEqual(
+            models.reading.filter(valid=True).count(), 4)
+        yield self.async.assertEqual(
+            models.reading.filter(count__gt=6).count(), 3)
+        yield self.async.assertEqual(
+            models.sensor.filter(code='b').count(), 1)
+        yield self.async.assertRaises(CommitException, models.sensor.new,
+                                      code='a', kind='humidity')
+
+    def test_update(self):
+        models = self.mapper
+        yield self.populate()
+        reading = yield models.reading.get(count=3)
+        reading.note = 'changed'
+        reading.taken = datetime(2014, 1, 2, 10, 30)
+        yield models.session().add(reading)
+        reading = yield models.reading.get(count=3)
+        self.assertEqual(reading.note, 'changed')
+        self.assertEqual(reading.taken, datetime(2014, 1, 2, 10, 30))
+        self.assertAlmostEqual(reading.value, 0.3)
+        yield self.async.assertEqual(models.reading.incr(reading, 'count', 5),
+                                     8)
+        yield self.async.assertEqual(
+            models.reading.filter(count=8).count(), 2)
+
+    def test_related(self):
+        models = self.mapper
+        a, b = yield self.populate()
+        readings = yield models.reading.filter(count__lt=4)\
+                                       .load_related('sensor', 'kind').all()
+        for r in readings:
+            self.assertEqual(r.sensor.kind,
+                             'temperature' if r.count % 2 else 'pressure')
+        counts = yield a.readings.query().get_field('count').all()
+        self.assertEqual(sorted(counts), [1, 3, 5, 7, 9])
+        qs = models.sensor.filter(code='a').get_field('id')
+        yield self.async.assertEqual(
+            models.reading.filter(sensor=qs).count(), 5)
+        readings = yield models.reading.query().sort_by('sensor__code').all()
+        self.assertEqual([r.sensor_id for r in readings[:5]], [a.id]*5)
+
+    def test_delete(self):
+        models = self.mapper
+        a, b = yield self.populate()
+        yield models.reading.filter(sensor=a).delete()
+        yield self.async.assertEqual(models.reading.query().count(), 5)
+        yield models.sensor.query().delete()
+        yield self.async.assertEqual(models.reading.query().count(), 0)
+
+
+class TestPackedRedis(test.TestWrite):
+    multipledb = 'redis'
+    models = (Sensor, Reading, Plain)
+
+    def test_layout(self):
+        models = self.mapper
+        backend = self.backend
+        client = backend.client
+        sensor = yield models.sensor.new(code='a', kind='temperature')
+        reading = yield models.reading.new(sensor=sensor, value=3, count=1,
+                                           note='', data={'unit': 'C'})
+        keys = backend.instance_keys(reading)
+        self.assertEqual(keys[0], backend.basekey(Reading._meta, 'pk', 0))
+        yield self.async.assertEqual(client.type(keys[0]), b'hash')
+        key = backend.basekey(Sensor._meta, 'obj', sensor.id)
+        yield self.async.assertEqual(client.type(key), b'string')
+        key = backend.basekey(Reading._meta, 'layout')
+        layout = yield client.hgetall(key)
+        self.assertEqual(int(layout[b'bucket']), 4)
+        readings = yield models.reading.query().where('this.count > 0').all()
+        self.assertEqual(readings, [reading])
+
+    def test_memory(self):
+        '''Compare the memory used by packed and hash instances'''
+        models = self.mapper
+        client = self.backend.client
+        size = 200
+        with models.session().begin() as t:
+            for i in range(size):
+                t.add(models.reading(sensor=1, value=i*0.5, count=i,
+                                     note='reading'))
+                t.add(models.plain(name='reading', value=i*0.5, count=i))
+        yield t.on_result
+        memory = []
+        for meta in (Reading._meta, Plain._meta):
+            pattern = self.backend.basekey(meta, '*')
+            keys = yield client.keys(pattern)
+            used = 0
+            for key in keys:
+                used += yield client.execute_command('MEMORY', 'USAGE', key)
+            memory.append(used)
+        packed, plain = memory
+        self.assertTrue(packed < plain)
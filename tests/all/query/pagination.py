@@ -0,0 +1,81 @@
+'''Keyset pagination with Query.after and Query.before.'''
+from stdnet import QuerySetError
+
+from examples.models import SportAtDate2, SportAtDate3
+
+from .sorting import TestSort
+
+
+class TestKeysetPagination(TestSort):
+    model = SportAtDate2
+    desc = True
+    limit = 7
+
+    def query_to_paginate(self):
+        return self.query()
+
+    def test_after(self):
+        qs = self.query_to_paginate()
+        all = yield qs.all()
+        ids, cursor = [], None
+        while True:
+            page = yield qs.after(cursor, self.limit).all()
+            self.assertTrue(len(page) <= self.limit)
+            if not page:
+                break
+            ids.extend((o.id for o in page))
+            cursor = qs.cursor(page[-1])
+        self.assertEqual(ids, [o.id for o in all])
+
+    def test_before(self):
+        qs = self.query_to_paginate()
+        all = yield qs.all()
+        ids, cursor = [], None
+        while True:
+            page = yield qs.before(cursor, self.limit).all()
+            if not page:
+                break
+            ids = [o.id for o in page] + ids
+            cursor = qs.cursor(page[0])
+        self.assertEqual(ids, [o.id for o in all])
+
+    def test_filter(self):
+        qs = self.query_to_paginate().filter(name='rugby')
+        all = yield qs.all()
+        page = yield qs.after(None, 3).all()
+        self.assertEqual([o.id for o in page], [o.id for o in all[:3]])
+        page = yield qs.after(qs.cursor(page[-1]), 3).all()
+        self.assertEqual([o.id for o in page], [o.id for o in all[3:6]])
+        self.checkOrder(page, 'dt')
+
+    def test_instance_cursor(self):
+        qs = self.query_to_paginate()
+        all = yield qs.all()
+        page = yield qs.after(all[4]).all()
+        self.assertEqual([o.id for o in page], [o.id for o in all[5:]])
+
+    def test_cursor_not_available(self):
+        qs = self.query_to_paginate()
+        all = yield qs.all()
+        cursor = qs.cursor(all[4])
+        yield self.session().delete(all[4])
+        page = yield qs.after(cursor, 5).all()
+        self.assertEqual([o.id for o in page], [o.id for o in all[5:10]])
+        page = yield qs.before(cursor, 2).all()
+        self.assertEqual([o.id for o in page], [o.id for o in all[2:4]])
+
+    def test_errors(self):
+        qs = self.query_to_paginate()
+        self.assertRaises(QuerySetError, qs.after, 'foo')
+        self.assertRaises(QuerySetError, qs.after, None, 0)
+        self.assertRaises(QuerySetError, qs.before, None, -1)
+        self.assertRaises(QuerySetError, lambda: qs.after()[:5])
+        qs = self.query().sort_by('name')
+        self.assertRaises(QuerySetError, qs.after)
+
+
+class TestKeysetPaginationSortIndex(TestKeysetPagination):
+    model = SportAtDate3
+
+    def query_to_paginate(self):
+        return self.query().sort_by('-dt')
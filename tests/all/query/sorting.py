@@ -1,12 +1,24 @@
 from datetime import date, datetime
 
-from stdnet import QuerySetError, odm
+from stdnet import QuerySetError, ImproperlyConfigured, odm
 from stdnet.utils import test, zip, range
 
-from examples.models import (SportAtDate, SportAtDate2, Person,
+from examples.models import (SportAtDate, SportAtDate2, SportAtDate3, Person,
                              TestDateModel, Group)
 
 
+class Issuer(odm.StdModel):
+    size = odm.FloatField()
+
+
+class Bond(odm.StdModel):
+    issuer = odm.ForeignKey(Issuer)
+    price = odm.FloatField()
+
+    class Meta:
+        sort_indexes = ('price', 'issuer__size')
+
+
 class SortGenerator(test.DataGenerator):
 
     def generate(self, **kwargs):
@@ -98,6 +110,68 @@ Pure explicit ordering.'''
     model = TestDateModel
 
 
+class TestSortIndex(TestSort, ExplicitOrderingMixin):
+    '''Test sort_by on a field with a sort index.'''
+    model = SportAtDate3
+
+    def testMeta(self):
+        meta = self.model._meta
+        self.assertEqual(list(meta.sort_indexes), ['dt'])
+        qs = self.query().sort_by('-dt')
+        self.assertEqual(meta.sort_index(qs.ordering), 'dt')
+        qs = self.query().sort_by('name')
+        self.assertEqual(meta.sort_index(qs.ordering), None)
+
+    def testBadSortIndex(self):
+
+        class BadIndex(odm.StdModel):
+            name = odm.SymbolField()
+
+            class Meta:
+                register = False
+                sort_indexes = ('name',)
+
+        self.assertRaises(ImproperlyConfigured,
+                          lambda: BadIndex._meta.sort_indexes)
+
+
+class TestSortIndexForeignKey(test.TestWrite):
+    models = (Bond, Issuer)
+
+    def test_meta(self):
+        sort = Bond._meta.sort_indexes['issuer__size']
+        self.assertEqual(sort.name, 'issuer_id')
+        self.assertEqual(sort.nested.name, 'size')
+
+    def test_sort_by(self):
+        models = self.mapper
+        with models.session().begin() as t:
+            a = t.add(models.issuer(size=3))
+            b = t.add(models.issuer(size=1))
+        yield t.on_result
+        with models.session().begin() as t:
+            for price, issuer in ((5, a), (2, b), (4, a), (1, b)):
+                t.add(models.bond(issuer=issuer, price=price))
+        yield t.on_result
+        bonds = yield models.bond.query().sort_by('price').all()
+        self.assertEqual([v.price for v in bonds], [1, 2, 4, 5])
+        bonds = yield models.bond.query().sort_by('-price')[:2]
+        self.assertEqual([v.price for v in bonds], [5, 4])
+        bonds = yield models.bond.filter(issuer=a).sort_by('price').all()
+        self.assertEqual([v.price for v in bonds], [4, 5])
+        bonds = yield models.bond.query().sort_by('issuer__size').all()
+        self.assertEqual([v.issuer_id for v in bonds], [b.id, b.id, a.id, a.id])
+        # changing the related instance refreshes the sort index
+        b.size = 10
+        yield models.issuer.save(b)
+        bonds = yield models.bond.query().sort_by('issuer__size').all()
+        self.assertEqual([v.issuer_id for v in bonds], [a.id, a.id, b.id, b.id])
+        # and so does incrementing it
+        yield models.issuer.incr(a, 'size', 20)
+        bonds = yield models.bond.query().sort_by('issuer__size').all()
+        self.assertEqual([v.issuer_id for v in bonds], [b.id, b.id, a.id, a.id])
+
+
 class TestSortByForeignKeyField(TestSort):
     model = Person
     models = (Person, Group)
@@ -160,6 +234,14 @@ class TestOrderingModel(TestSort):
         qs = self.query().exclude(name='rugby')
         return self.checkOrder(qs, 'dt')
 
+    def test_slice(self):
+        qs = self.query()
+        all = yield qs.all()
+        for start, stop in ((0, 5), (5, 10), (3, -2), (0, 0)):
+            page = yield self.query()[start:stop]
+            self.assertEqual([o.id for o in page],
+                             [o.id for o in all[start:stop]])
+
 
 class TestOrderingModelDesc(TestOrderingModel):
     model = SportAtDate2
@@ -0,0 +1,126 @@
+'''Query.to_arrays into NumPy arrays.'''
+from datetime import date, datetime
+
+from stdnet import odm
+from stdnet.odm.query import ny
+from stdnet.utils import test
+from stdnet.utils.dates import date2timestamp
+
+
+class Reading(odm.StdModel):
+    sensor = odm.SymbolField()
+    value = odm.FloatField(required=False)
+    count = odm.IntegerField(default=0)
+    valid = odm.BooleanField(default=True)
+    day = odm.DateField(required=False)
+    timestamp = odm.DateTimeField(required=False)
+
+    class Meta:
+        ordering = 'id'
+
+
+class Currency(odm.StdModel):
+    code = odm.SymbolField(primary_key=True)
+
+
+class Price(odm.StdModel):
+    ccy = odm.ForeignKey(Currency, required=False)
+    reading = odm.ForeignKey(Reading, required=False)
+    value = odm.FloatField()
+
+
+@test.skipUnless(ny, 'Requires numpy')
+class TestToArrays(test.TestWrite):
+    models = (Reading, Currency, Price)
+
+    def populate(self, size=5):
+        models = self.mapper
+        with models.session().begin() as t:
+            for i in range(size):
+                t.add(models.reading(
+                    sensor='s%s' % (i % 2), value=i*0.5 if i else None,
+                    count=i, valid=i % 2 == 0,
+                    day=date(2014, 1, i+1) if i else None,
+                    timestamp=datetime(2014, 1, 1, 12, i, 30) if i else None))
+        return t.on_result
+
+    def test_arrays(self):
+        models = self.mapper
+        yield self.populate()
+        arrays = yield models.reading.query().to_arrays(
+            'id', 'sensor', 'value', 'count', 'valid', batch=2)
+        self.assertEqual(sorted(arrays),
+                         ['count', 'id', 'sensor', 'valid', 'value'])
+        self.assertEqual(arrays['id'].dtype, ny.int64)
+        self.assertEqual(list(arrays['count']), [0, 1, 2, 3, 4])
+        self.assertEqual(arrays['count'].dtype, ny.int64)
+        self.assertEqual(list(arrays['valid']),
+                         [True, False, True, False, True])
+        self.assertEqual(list(arrays['sensor']),
+                         ['s0', 's1', 's0', 's1', 's0'])
+        value = arrays['value']
+        self.assertEqual(value.dtype, float)
+        self.assertTrue(ny.isnan(value[0]))
+        self.assertEqual(list(value[1:]), [0.5, 1, 1.5, 2])
+
+    def test_order(self):
+        models = self.mapper
+        yield self.populate()
+        qs = models.reading.filter(sensor='s0').sort_by('-count')
+        arrays = yield qs.to_arrays('count', batch=2)
+        self.assertEqual(list(arrays['count']), [4, 2, 0])
+
+    def test_dates(self):
+        models = self.mapper
+        yield self.populate(3)
+        arrays = yield models.reading.query().to_arrays('day', 'timestamp')
+        day = arrays['day']
+        self.assertEqual(day.dtype, ny.dtype('datetime64[D]'))
+        self.assertTrue(ny.isnat(day[0]))
+        self.assertEqual(list(day[1:]), [ny.datetime64('2014-01-02'),
+                                         ny.datetime64('2014-01-03')])
+        timestamp = arrays['timestamp']
+        self.assertEqual(timestamp.dtype, ny.dtype('datetime64[us]'))
+        self.assertTrue(ny.isnat(timestamp[0]))
+        # timestamps are UTC
+        self.assertEqual(list(timestamp[1:]), [
+            ny.datetime64(int(date2timestamp(datetime(2014, 1, 1, 12, i, 30))),
+                          's') for i in (1, 2)])
+
+    def test_structured(self):
+        models = self.mapper
+        yield self.populate()
+        qs = models.reading.filter(sensor='s0')
+        data, = yield self.structured(qs, 'count', 'value', batch=2)
+        self.assertEqual(data.dtype.names, ('count', 'value'))
+        self.assertEqual(list(data['count']), [0, 2, 4])
+        data, = yield self.structured(models.reading.filter(sensor='foo'),
+                                      'count')
+        self.assertEqual(len(data), 0)
+
+    def test_foreign_keys(self):
+        models = self.mapper
+        yield self.populate(2)
+        reading = yield models.reading.get(count=1)
+        eur = yield models.currency.new(code='EUR')
+        with models.session().begin() as t:
+            t.add(models.price(ccy=eur, reading=reading, value=1))
+            t.add(models.price(value=2))
+        yield t.on_result
+        qs = models.price.query().sort_by('value')
+        arrays = yield qs.to_arrays('ccy', 'reading')
+        self.assertEqual(arrays['ccy'].dtype, object)
+        self.assertEqual(list(arrays['ccy']), ['EUR', None])
+        ids = arrays['reading']
+        self.assertEqual(ids.dtype, float)
+        self.assertEqual(ids[0], reading.id)
+        self.assertTrue(ny.isnan(ids[1]))
+
+    def structured(self, qs, *fields, **kwargs):
+        # numpy arrays are not yielded to the test runner, which compares
+        # yielded values with a sentinel
+        kwargs['structured'] = True
+        result = qs.to_arrays(*fields, **kwargs)
+        if isinstance(result, ny.ndarray):
+            return (result,)
+        return result.add_callback(lambda data: (data,))
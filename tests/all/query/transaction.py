@@ -1,6 +1,6 @@
 import random
 
-from stdnet import odm, InvalidTransaction
+from stdnet import odm, getdb, InvalidTransaction, CommitException
 from examples.models import SimpleModel, Dictionary
 from stdnet.utils import test, populate
 
@@ -71,6 +71,75 @@ class TestTransactions(test.TestWrite):
         yield t.on_result
 
 
+class TestParallelCommit(test.TestWrite):
+    models = (SimpleModel, Dictionary)
+
+    def setUp(self):
+        self.other = getdb(self.backend.connection_string,
+                           namespace='%sother-' % self.namespace)
+        self.router = odm.Router(parallel_commit=True)
+        self.router.register(SimpleModel, self.backend)
+        self.router.register(Dictionary, self.other)
+
+    def tearDown(self):
+        return self.other.flush()
+
+    def test_commit_on_two_backends(self):
+        session = self.router.session()
+        with session.begin() as t:
+            s = t.add(SimpleModel(code='parallel', description='a test'))
+            d = t.add(Dictionary(name='parallel'))
+            self.assertEqual(len(list(session.backends_data())), 2)
+        yield t.on_result
+        self.assertTrue(s.id)
+        self.assertTrue(d.id)
+        self.assertEqual(len(t.saved), 2)
+        yield self.async.assertEqual(
+            self.router.simplemodel.get(code='parallel'), s)
+        yield self.async.assertEqual(
+            self.router.dictionary.get(name='parallel'), d)
+
+    def test_errors_are_aggregated(self):
+        session = self.router.session()
+        yield session.add(Dictionary(name='unique'))
+
+        def commit():
+            with session.begin() as t:
+                t.add(SimpleModel(code='ok', description='a test'))
+                t.add(Dictionary(name='unique'))
+            return t.on_result
+        yield self.async.assertRaises(CommitException, commit)
+        yield self.async.assertEqual(
+            self.router.simplemodel.filter(code='ok').count(), 1)
+
+    def test_backend_failure(self):
+        other = self.router.dictionary.backend
+
+        def execute_session(session_data):
+            raise IOError('connection lost')
+        other.execute_session = execute_session
+        session = self.router.session()
+        s = SimpleModel(code='ok', description='a test')
+
+        def commit():
+            with session.begin() as t:
+                t.add(s)
+                t.add(Dictionary(name='lost'))
+            return t.on_result
+        try:
+            yield self.async.assertRaises(CommitException, commit)
+        finally:
+            del other.execute_session
+        # the instances committed by the other backend are processed
+        self.assertTrue(s.id)
+        self.assertTrue(s.get_state().persistent)
+
+    def test_shared_pool(self):
+        pool = self.router.commit_pool
+        self.assertEqual(odm.Router(parallel_commit=True).commit_pool, pool)
+        self.assertNotEqual(odm.Router(parallel_commit=2).commit_pool, pool)
+
+
 class TestMultiFieldTransaction(test.TestCase):
     model = Dictionary
 
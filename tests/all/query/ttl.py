@@ -0,0 +1,128 @@
+'''Models with a time to live.'''
+import time
+
+from stdnet import odm
+from stdnet.utils import test
+
+
+class Quote(odm.StdModel):
+    symbol = odm.SymbolField()
+    price = odm.FloatField(default=0)
+
+    class Meta:
+        ttl = 0.5
+
+
+class Tick(odm.StdModel):
+    quote = odm.ForeignKey(Quote, related_name='ticks')
+    size = odm.IntegerField(default=0)
+
+
+class TestTTL(test.TestWrite):
+    models = (Quote, Tick)
+
+    def create(self, *symbols):
+        models = self.mapper
+        with models.session().begin() as t:
+            for symbol in symbols:
+                t.add(models.quote(symbol=symbol))
+        yield t.on_result
+        quotes = yield models.quote.query().all()
+        with models.session().begin() as t:
+            for quote in quotes:
+                t.add(models.tick(quote=quote))
+        yield t.on_result
+
+    def expire(self):
+        time.sleep(Quote._meta.ttl + 0.1)
+
+    def test_meta(self):
+        self.assertEqual(Quote._meta.ttl, 0.5)
+        self.assertEqual(Tick._meta.ttl, None)
+
+    def test_expired_excluded(self):
+        models = self.mapper
+        yield self.create('a', 'b', 'c')
+        yield self.async.assertEqual(models.quote.query().count(), 3)
+        self.expire()
+        yield self.async.assertEqual(models.quote.query().count(), 0)
+        yield self.async.assertEqual(models.quote.filter(symbol='a').count(),
+                                     0)
+        yield self.async.assertEqual(models.quote.query().all(), [])
+        # data is still there until swept
+        yield self.async.assertEqual(models.tick.query().count(), 3)
+
+    def test_sweep(self):
+        models = self.mapper
+        yield self.create('a', 'b', 'c')
+        ids = yield models.quote.sweep()
+        self.assertEqual(ids, [])
+        self.expire()
+        ids = yield models.quote.sweep()
+        self.assertEqual(len(ids), 3)
+        yield self.async.assertEqual(models.tick.query().count(), 0)
+        keys = yield models.quote.keys()
+        self.assertFalse([k for k in keys if ':obj:' in k])
+        ids = yield models.quote.sweep()
+        self.assertEqual(ids, [])
+
+    def test_sweep_limit(self):
+        models = self.mapper
+        yield self.create('a', 'b', 'c')
+        self.expire()
+        ids = yield models.quote.sweep(2)
+        self.assertEqual(len(ids), 2)
+        yield self.async.assertEqual(models.tick.query().count(), 1)
+        ids = yield models.quote.sweep(2)
+        self.assertEqual(len(ids), 1)
+        yield self.async.assertEqual(models.tick.query().count(), 0)
+
+    def test_save_refreshes(self):
+        models = self.mapper
+        quote = yield models.quote.new(symbol='a')
+        time.sleep(0.3)
+        quote.price = 2
+        yield models.session().add(quote)
+        time.sleep(0.3)
+        yield self.async.assertEqual(models.quote.query().count(), 1)
+        ids = yield models.quote.sweep()
+        self.assertEqual(ids, [])
+
+    def test_slice(self):
+        models = self.mapper
+        yield self.create('a', 'b', 'c')
+        self.expire()
+        yield self.create('d', 'e', 'f')
+        quotes = yield models.quote.query()[0:2]
+        self.assertEqual(len(quotes), 2)
+        quotes = yield models.quote.query().sort_by('symbol')[0:3]
+        self.assertEqual([q.symbol for q in quotes], ['d', 'e', 'f'])
+        quotes = yield models.quote.query().sort_by('-symbol')[1:]
+        self.assertEqual([q.symbol for q in quotes], ['e', 'd'])
+
+    def test_sweep_refreshed(self):
+        models = self.mapper
+        yield self.create('a', 'b', 'c')
+        quote = yield models.quote.get(symbol='a')
+        self.expire()
+        ids = yield models.quote.backend.expired(Quote._meta)
+        self.assertEqual(len(ids), 3)
+        # refresh an instance after the expired ids are read
+        quote.price = 3
+        yield models.session().add(quote)
+        deleted = yield models.quote._sweep(ids)
+        self.assertEqual(len(deleted), 2)
+        self.assertFalse(quote.id in deleted)
+        yield self.async.assertEqual(models.quote.query().count(), 1)
+        yield self.async.assertEqual(models.tick.query().count(), 1)
+
+    def test_slice_expired(self):
+        models = self.mapper
+        yield self.create('a', 'b', 'c')
+        qs = models.quote.query().sort_by('symbol')
+        quotes = yield qs[0:2]
+        self.assertEqual([q.symbol for q in quotes], ['a', 'b'])
+        self.expire()
+        # the same query does not load instances expired since it was built
+        quotes = yield qs[2:]
+        self.assertEqual(quotes, [])
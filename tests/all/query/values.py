@@ -0,0 +1,89 @@
+'''Query.values and Query.values_list'''
+from datetime import date
+
+from stdnet import odm, QuerySetError
+from stdnet.utils import test
+
+
+class Team(odm.StdModel):
+    name = odm.SymbolField()
+
+
+class Player(odm.StdModel):
+    name = odm.SymbolField()
+    team = odm.ForeignKey(Team, required=False)
+    born = odm.DateField(required=False)
+    score = odm.FloatField(default=0)
+
+    class Meta:
+        ordering = 'score'
+
+
+class Profile(odm.StdModel):
+    name = odm.SymbolField()
+    doc = odm.JSONField(as_string=False)
+
+
+class TestValues(test.TestWrite):
+    models = (Team, Player, Profile)
+
+    def populate(self):
+        models = self.mapper
+        team = yield models.team.new(name='reds')
+        with models.session().begin() as t:
+            t.add(models.player(name='pippo', team=team, score=3.5,
+                                born=date(1990, 4, 1)))
+            t.add(models.player(name='pluto', score=1))
+            t.add(models.player(name='saturn', team=team, score=2))
+        yield t.on_result
+        yield team
+
+    def test_values(self):
+        models = self.mapper
+        team = yield self.populate()
+        rows = yield models.player.query().values('name', 'score').all()
+        self.assertEqual(rows, [{'name': 'pluto', 'score': 1.0},
+                                {'name': 'saturn', 'score': 2.0},
+                                {'name': 'pippo', 'score': 3.5}])
+        qs = models.player.filter(name='pippo')
+        rows = yield qs.values().all()
+        self.assertEqual(len(rows), 1)
+        row = rows[0]
+        self.assertEqual(sorted(row), ['born', 'id', 'name', 'score', 'team'])
+        self.assertEqual(row['team'], team.id)
+        self.assertEqual(row['born'], date(1990, 4, 1))
+
+    def test_values_list(self):
+        models = self.mapper
+        team = yield self.populate()
+        qs = models.player.filter(team=team)
+        rows = yield qs.values_list('name', 'team').all()
+        self.assertEqual(rows, [('saturn', team.id), ('pippo', team.id)])
+        names = yield qs.values_list('name', flat=True).all()
+        self.assertEqual(names, ['saturn', 'pippo'])
+        ids = yield models.player.query().values_list('id', flat=True).all()
+        players = yield models.player.query().all()
+        self.assertEqual(ids, [p.id for p in players])
+        names = yield models.player.query().values_list('name', flat=True)[:2]
+        self.assertEqual(names, ['pluto', 'saturn'])
+
+    def test_json_dictionary(self):
+        models = self.mapper
+        doc = {'tags': ['a', 'b'], 'size': {'x': 2, 'y': 1.5}}
+        yield models.profile.new(name='a', doc=doc)
+        yield models.profile.new(name='b')
+        qs = models.profile.query().sort_by('name')
+        rows = yield qs.values('name', 'doc').all()
+        self.assertEqual(rows, [{'name': 'a', 'doc': doc},
+                                {'name': 'b', 'doc': {}}])
+        rows = yield qs.values().all()
+        self.assertEqual(rows[0]['doc'], doc)
+        self.assertEqual(sorted(rows[0]), ['doc', 'id', 'name'])
+        docs = yield qs.values_list('doc', flat=True).all()
+        self.assertEqual(docs, [doc, {}])
+
+    def test_errors(self):
+        qs = self.mapper.player.query()
+        self.assertRaises(QuerySetError, qs.values, 'foo')
+        self.assertRaises(QuerySetError, qs.values_list, 'name', 'score',
+                          flat=True)
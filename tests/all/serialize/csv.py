@@ -1,5 +1,6 @@
 '''Test the CSV serializer'''
 from stdnet import odm
+from stdnet.utils import StringIO
 
 from examples.data import FinanceTest, Fund
 
@@ -24,3 +25,16 @@ class TestFinanceCSV(base.SerializerMixin, FinanceTest):
         
 class TestLoadFinanceCSV(base.LoadSerializerMixin, FinanceTest):
     serializer = 'csv'
+
+    def test_load_result(self):
+        models = self.mapper
+        s = yield self.dump()
+        data = s.write().getvalue()
+        size = len(data.splitlines()) - 1
+        yield models.instrument.flush()
+        s = odm.get_serializer('csv', batch=4)
+        result = s.load(models, StringIO(data), self.model)
+        self.assertEqual(result, s.loader.on_result)
+        yield result
+        self.assertEqual(s.offset, size)
+        yield self.async.assertEqual(models.instrument.query().count(), size)
@@ -0,0 +1,150 @@
+'''Test the streaming NDJSON serializer'''
+from __future__ import absolute_import
+import os
+import json
+import shutil
+import tempfile
+
+from stdnet import odm
+from stdnet.utils import BytesIO
+
+from examples.data import FinanceTest
+
+from . import base
+
+
+class TestFinanceNDJSON(base.SerializerMixin, FinanceTest):
+    serializer = 'ndjson'
+
+    def test_query(self):
+        models = self.mapper
+        s = odm.get_serializer('ndjson', batch=7)
+        qs = models.instrument.query()
+        s.dump(qs)
+        size = yield qs.count()
+        lines = s.write().getvalue().splitlines()
+        self.assertEqual(len(lines), size)
+        self.assertEqual(len(set(lines)), size)
+        self.assertTrue(lines[0].startswith('["%s", {' %
+                                            models.instrument._meta.hash))
+        self.assertEqual(s.stats[str(models.instrument._meta)]['rows'], size)
+
+    def test_snapshot(self):
+        models = self.mapper
+        qs = models.instrument.query().sort_by('-id')
+        ids = yield qs.get_field('id').all()
+        ids = [int(i) for i in ids]
+        s = odm.get_serializer('ndjson', batch=4)
+        s.dump(qs)
+        s.dump(models.instrument.filter(id=ids[:5]).load_only('name'))
+        lines = [json.loads(l)[1] for l in s.write().getvalue().splitlines()]
+        self.assertEqual([int(d['id']) for d in lines[:len(ids)]], ids)
+        rows = lines[len(ids):]
+        self.assertEqual(sorted(int(d['id']) for d in rows), sorted(ids[:5]))
+        self.assertEqual(set(rows[0]), set(('id', 'name')))
+
+    def test_snapshot_filtered(self):
+        models = self.mapper
+        qs = models.instrument.exclude(ccy='EUR').sort_by('name')
+        instruments = yield qs.all()
+        names = [i.name for i in instruments]
+        s = odm.get_serializer('ndjson', batch=3)
+        s.dump(qs.dont_load('description'))
+        lines = [json.loads(l)[1] for l in s.write().getvalue().splitlines()]
+        self.assertEqual([d['name'] for d in lines], names)
+        self.assertFalse([d for d in lines if 'description' in d])
+
+    def test_write_files(self):
+        models = self.mapper
+        s = odm.get_serializer('ndjson', batch=5, gzip=True)
+        s.dump(models.instrument.query())
+        s.dump(models.fund.query())
+        path = tempfile.mkdtemp()
+        try:
+            files = s.write_files(path)
+            self.assertEqual([os.path.basename(f) for f in files],
+                             ['examples.instrument.ndjson.gz',
+                              'examples.fund.ndjson.gz'])
+            with open(files[1], 'rb') as f:
+                s2 = odm.get_serializer('ndjson', gzip=True)
+                yield models.fund.flush()
+                s2.load(models, f)
+        finally:
+            shutil.rmtree(path)
+        size = yield models.fund.query().count()
+        self.assertEqual(size, s.stats['examples.fund']['rows'])
+
+
+class TestLoadFinanceNDJSON(base.LoadSerializerMixin, FinanceTest):
+    serializer = 'ndjson'
+
+    def test_load_gzip(self):
+        models = self.mapper
+        qs = yield models.instrument.query().sort_by('id').all()
+        s = odm.get_serializer('ndjson', batch=4, gzip=True)
+        s.dump(models.instrument.query())
+        stream = s.write()
+        yield models.instrument.flush()
+        s.load(models, BytesIO(stream.getvalue()))
+        qs2 = yield models.instrument.query().sort_by('id').all()
+        self.assertEqual(qs, qs2)
+
+    def test_load_batches(self):
+        models = self.mapper
+        s = odm.get_serializer('ndjson')
+        s.dump(models.instrument.query())
+        data = s.write().getvalue()
+        size = len(data.splitlines())
+        yield models.instrument.flush()
+        s = odm.get_serializer('ndjson', batch=3, pipeline=2)
+        self.assertEqual(s.load(models, BytesIO(data)), size)
+        self.assertEqual(s.offset, size)
+        yield self.async.assertEqual(models.instrument.query().count(), size)
+
+    def test_load_resume(self):
+        models = self.mapper
+        s = odm.get_serializer('ndjson')
+        s.dump(models.instrument.query())
+        data = s.write().getvalue()
+        lines = data.splitlines()
+        lines[7] = '["%s", ' % models.instrument._meta.hash
+        yield models.instrument.flush()
+        s = odm.get_serializer('ndjson', batch=3, pipeline=2)
+        self.assertRaises(ValueError, s.load, models,
+                          BytesIO(b'\n'.join(lines)))
+        self.assertEqual(s.offset, 6)
+        s.load(models, BytesIO(data), offset=s.offset)
+        yield self.async.assertEqual(models.instrument.query().count(),
+                                     len(lines))
+
+    def test_load_resume_blank_lines(self):
+        models = self.mapper
+        s = odm.get_serializer('ndjson')
+        s.dump(models.instrument.query())
+        lines = s.write().getvalue().splitlines()
+        size = len(lines)
+        lines[2:2] = ['', '']
+        lines[8] = '["%s", ' % models.instrument._meta.hash
+        yield models.instrument.flush()
+        s = odm.get_serializer('ndjson', batch=2, pipeline=1)
+        self.assertRaises(ValueError, s.load, models,
+                          BytesIO(b'\n'.join(lines)))
+        self.assertEqual(s.offset, 8)
+        s.load(models, BytesIO(b'\n'.join(lines[:8] + [''] + lines[9:])),
+               offset=s.offset)
+        yield self.async.assertEqual(models.instrument.query().count(),
+                                     size - 1)
+
+    def test_load_bulk(self):
+        models = self.mapper
+        types = yield models.instrument.query().load_only('type').all()
+        types = [i.type for i in types]
+        s = odm.get_serializer('ndjson')
+        s.dump(models.instrument.query())
+        data = s.write().getvalue()
+        yield models.instrument.flush()
+        s = odm.get_serializer('ndjson', batch=5, bulk=True)
+        s.load(models, BytesIO(data))
+        yield self.async.assertEqual(
+            models.instrument.filter(type=types[0]).count(),
+            types.count(types[0]))
@@ -7,7 +7,8 @@ from stdnet.utils.version import get_git_changeset
 from stdnet.utils import test, encoders, to_bytes, to_string
 from stdnet.utils import date2timestamp, timestamp2date,\
                             addmul_number_dicts, grouper,\
-                            _format_int, populate
+                            _format_int, populate, KeyPaths,\
+                            dict_flat_generator, flat_to_nested
 
 from examples.models import Statistics3
 
@@ -90,6 +91,32 @@ class TestUtils(test.TestCase):
         self.assertEqual(len(r),2)
         self.assertEqual(r['bla']['bla1'],7)
         self.assertEqual(r['foo'],2.5)
+
+    def test_key_paths(self):
+        paths = KeyPaths('data')
+        value = {'a': {'': 1, 'b': {'c': 2}}, 'd': [1, 2], 'e': {'': {'f': 3}}}
+        flat = paths.flat(value)
+        self.assertEqual(flat, {'data__a': 1, 'data__a__b__c': 2,
+                                'data__d': [1, 2], 'data__e': {'f': 3}})
+        self.assertEqual(flat, dict(dict_flat_generator(value, 'data')))
+        self.assertEqual(paths.flat(value), flat)
+        self.assertEqual(paths.path('data__a__b__c'), ('a', 'b', 'c'))
+        self.assertEqual(paths.path('name'), None)
+        flat['name'] = 'foo'
+        nested = paths.nested(flat)
+        self.assertEqual(nested, flat_to_nested(flat, attname='data'))
+        self.assertEqual(nested['a'], {'': 1, 'b': {'c': 2}})
+        self.assertRaises(ValueError, paths.flat, 1)
+        self.assertRaises(ValueError, paths.flat, {'': 1})
+
+    def test_key_paths_max_size(self):
+        paths = KeyPaths(max_size=3)
+        paths.flat({'a': 1, 'b': 2, 'c': {'d': 3}})
+        for key in ('a', 'b', 'c__d', 'e'):
+            paths.path(key)
+        self.assertEqual(len(paths._paths), 1)
+        self.assertEqual(paths.flat({'e': 1}), {'e': 1})
+        self.assertEqual(len(paths._keys), 1)
     
     
 class testFunctions(test.TestCase):